@@ -1,338 +1,4104 @@
-from time import sleep
+from time import monotonic, process_time
 from datetime import datetime
-from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBClientError
+from collections import deque, namedtuple
 
+import argparse
+import array
+import bisect
+import concurrent.futures
+import gzip
+import hashlib
+import http.client
+import json
 import logging
-import logging.config
+import math
+import mmap
 import os.path
 import pynvml as N
 import psutil
+import re
+import signal
 import subprocess
 import socket
+import ssl
+import struct
 import sys
-import yaml
+import threading
+import urllib.parse
+import zlib
 
 # Global LOGGER var
 LOGGER = logging.getLogger(__name__)
 
+# Imported by import_influxdb() once an influxdb sink is created: with requests, dateutil and pytz, the influxdb client
+# would be the largest part of the start time of the agent, which systemd restarts after every crash and deploy
+InfluxDBClient      = None
+InfluxDBClientError = None
+InfluxDBServerError = None
+RequestException    = None
+
+# Directory of the parsed copies of the YAML files, see load_yaml()
+CONF_CACHE_DIR = os.getenv("NVML_AGENT_CACHE_DIR", "/var/cache/nvml-agent")
+
+# Agent options that may be set in conf.yaml next to the influxdb keys, with their default values
+AGENT_DEFAULTS = {
+    "sampling_interval": 5,     # seconds between two samples in daemon mode
+    "pod_index_refresh": 30,    # seconds between two full diffs of the running containers
+    "container_runtime": "docker",                   # backend of RUNTIME_CLIENTS used to list containers
+    "runtime_endpoint" : "/var/run/docker.sock",     # unix socket of the container runtime
+    "queue_size"        : 100,              # snapshots waiting for export before the overflow policy applies
+    "queue_overflow"    : "drop-oldest",    # one of QUEUE_OVERFLOW_POLICIES
+    "export_retries"    : 5,                # attempts after a failed write before the points are spooled
+    "export_backoff"    : 1,                # seconds to wait after the first failed write, doubled each time
+    "export_max_backoff": 60,               # upper bound of the wait between two write attempts or probes
+    "spool_dir"          : "",                  # directory of the on-disk spool of failed points, empty to drop them
+    "spool_max_bytes"    : 256 * 1024 * 1024,   # size cap of the spool, oldest segments are evicted above it
+    "spool_segment_bytes": 4 * 1024 * 1024,     # size of a spool segment before rotating to a new one
+    "spool_replay_rate"  : 1000,                # points per second replayed from the spool once influxdb is back
+    "telemetry_metrics"  : None,                # names of TELEMETRY_METRICS collected per GPU, None for all of them
+    "process_utilization": True,                # per-process SM/memory/encoder/decoder utilisation of each sample
+    "prometheus_port"    : 0,                   # port of the /metrics endpoint, 0 to disable it
+    "prometheus_address" : "",                  # address the /metrics endpoint listens on, empty for all
+    "collector_threads"  : 8,                   # workers querying the GPUs and resolving their processes, 1 for none
+    "delta_export"       : False,               # only write the fields that changed since they were last written
+    "delta_deadband"     : 0.0,                 # relative change of a field below which it is not written again
+    "delta_heartbeat"    : 300,                 # seconds after which every field is written again, even unchanged
+    "rollup_window"      : 0,                   # seconds aggregated into one point per series, 0 to write each sample
+    "rollup_quantiles"   : [0.95],              # quantiles of each field over a rollup window
+    "rollup_capacity"    : 1024,                # values kept per field and window for the quantiles
+    "profile_dir"        : "/tmp",              # directory of the stack samples written by the SIGUSR2 profiler
+    "profile_interval"   : 0.01,                # seconds between two stack samples of the profiler
+    "nvml_events"        : [],                  # names of NVML_EVENT_TYPES written as soon as NVML reports them
+    "kubelet_token_file" : "",                  # bearer token sent to the kubelet (container_runtime: kubelet)
+    "kubelet_ca_file"    : "",                  # CA bundle of the kubelet certificate, empty to not verify it
+    "pod_label_tags"     : [],                  # pod labels written as label_<key> tags (container_runtime: kubelet)
+    "pod_resources_socket": "/var/lib/kubelet/pod-resources/kubelet.sock",  # kubelet pod-resources API, empty for none
+    "adaptive_sampling"     : False,    # move the interval between the two below with the activity of the GPUs
+    "sampling_min_interval" : 1,        # seconds between two samples while the GPU processes or memory change
+    "sampling_idle_interval": 60,       # seconds between two samples (heartbeat) while no GPU runs a process
+    "sampling_memory_change": 0.05,     # relative change of the memory used on a GPU that counts as activity
+    "cpu_budget"            : 0.0,      # fraction of one CPU the agent may use, the interval is stretched above it
+    "start_jitter"          : 0,        # seconds over which the nodes spread their first sample, by hostname
+    "ring_store_path"   : "",           # memory-mapped file keeping the recent samples on the node, empty to disable
+    "ring_store_series" : 32,           # GPUs and pods on a GPU kept in the ring store, the oldest one is replaced
+    "ring_store_records": 86400,        # samples kept per series, the oldest one is overwritten
+}
+
+# What SnapshotQueue.put does when the queue is full
+QUEUE_OVERFLOW_POLICIES = ("drop-oldest", "block")
+
+# Seconds the exporter is given to drain the queue on shutdown, then to give up once aborted. With the final
+# flush (at most influxdb_timeout) the shutdown stays below TimeoutStopSec=30 of the service.
+EXPORT_DRAIN_TIMEOUT = 10
+EXPORT_ABORT_TIMEOUT = 5
+
+# Seconds before a pod known by its uid only is resolved again, doubled on each retry up to the maximum
+POD_RETRY_DELAY     = 1
+POD_RETRY_MAX_DELAY = 60
+
+# Labels set by the kubelet on every container it creates, under any container runtime
+K8S_POD_NAME_LABEL       = "io.kubernetes.pod.name"
+K8S_POD_NAMESPACE_LABEL  = "io.kubernetes.pod.namespace"
+K8S_CONTAINER_NAME_LABEL = "io.kubernetes.container.name"
+K8S_POD_UID_LABEL        = "io.kubernetes.pod.uid"
+
+# Label of the pods of a Deployment, its value suffixes the name of their ReplicaSet
+K8S_POD_TEMPLATE_HASH_LABEL = "pod-template-hash"
+
+# Extended resource of the NVIDIA device plugin, its device ids are the GPU uuids (<uuid>::<n> when time-sliced)
+NVIDIA_GPU_RESOURCE = "nvidia.com/gpu"
+
+# Prefix of the resources of the MIG devices with the mixed strategy of the device plugin (nvidia.com/mig-1g.5gb...),
+# their device ids are the MIG uuids, which nvidia.com/gpu advertises as well with the single strategy
+NVIDIA_MIG_RESOURCE_PREFIX = "nvidia.com/mig-"
+
+# gpuInstanceId and computeInstanceId of a process listed by NVML that does not run in a MIG device
+NVML_NO_INSTANCE = 0xFFFFFFFF
+
+# Method of the kubelet pod-resources API listing the devices allocated to each container
+POD_RESOURCES_LIST_METHOD = "/v1.PodResourcesLister/List"
+
+# Characters of a pod label key that are not kept in its label_<key> tag
+LABEL_TAG_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+# Timestamp multiplier from seconds for each precision accepted by the influxdb write endpoint
+INFLUX_PRECISIONS = {"s": 1, "ms": 10 ** 3, "u": 10 ** 6, "ns": 10 ** 9}
+
+# Pod uid in a kubernetes cgroup path, "pod<uid>" with the cgroupfs driver, "-pod<uid_with_underscores>.slice" with systemd
+CGROUP_POD_UID_RE      = re.compile(r"pod([0-9a-f]{8}[-_][0-9a-f]{4}[-_][0-9a-f]{4}[-_][0-9a-f]{4}[-_][0-9a-f]{12})")
+# Container id as a path component (cgroupfs) or in a "<runtime>-<id>.scope" unit (systemd: docker, cri-containerd, crio)
+CGROUP_CONTAINER_ID_RE = re.compile(r"(?:^|[-/])([0-9a-f]{64})(?=\.scope|/|$)")
+
+# NVML events the agent can wait for: name in the configuration -> event type constant of the binding
+NVML_EVENT_TYPES = {
+    "xid"           : "nvmlEventTypeXidCriticalError",
+    "single_bit_ecc": "nvmlEventTypeSingleBitEccError",
+    "double_bit_ecc": "nvmlEventTypeDoubleBitEccError",
+    "pstate"        : "nvmlEventTypePState",
+    "clock"         : "nvmlEventTypeClock",
+}
+
+# NVML events logged as errors, they usually need the GPU or its job to be looked at
+NVML_CRITICAL_EVENTS = ("xid", "double_bit_ecc")
+
+# Layout of the ring store, see RingStore. The header gives the geometry of the file, then comes a directory entry per
+# series (kind, index of its next record, records written, time of its last record, key) and the records of the series
+RING_STORE_MAGIC   = b"NVMLRING"
+RING_STORE_VERSION = 1
+RING_STORE_HEADER  = struct.Struct("<8sIII")        # magic, version, series, records per series
+RING_STORE_ENTRY   = struct.Struct("<B3xIId236s")   # 256 bytes, the key is the tab separated identity of the series
+RING_STORE_RECORD  = struct.Struct("<d5f")          # epoch time of the sample, then the values of RING_STORE_FIELDS
+
+# Kinds of the series of the ring store
+RING_STORE_GPU = 1
+RING_STORE_POD = 2
+
+# Values of a record of each kind: (name, telemetry metric or index of ProcessUsage.utilization, scale).
+# A pod series sums the processes of the pod on the GPU; NaN when NVML did not report the value.
+RING_STORE_FIELDS = {
+    RING_STORE_GPU: (("sm_util",        "sm_utilization_pct",     1),
+                     ("mem_util",       "memory_utilization_pct", 1),
+                     ("memory_used_mb", "memory_used_bytes",      1.0 / 1024 / 1024),
+                     ("power_w",        "power_usage_mw",         0.001),
+                     ("temperature_c",  "temperature_c",          1)),
+    RING_STORE_POD: (("sm_util",        0,                        1),
+                     ("mem_util",       1,                        1),
+                     ("enc_util",       2,                        1),
+                     ("dec_util",       3,                        1),
+                     ("memory_used_mb", None,                     1)),
+}
+
+# Upper bounds, in seconds, of the buckets of the stage timing histograms; the last bucket is +Inf
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Counters of the agent itself, exported with its health
+AGENT_COUNTERS = ("subprocesses", "runtime_refreshes", "pod_index_hits", "pod_index_misses",
+                  "cgroup_cache_hits", "cgroup_cache_misses", "process_tracker_hits", "process_tracker_new",
+                  "nvml_events", "nvml_enumerations")
+
+# Health of the agent when a snapshot was taken: per stage (bucket counts, sum, count, last) and counter/gauge values
+AgentHealth = namedtuple("AgentHealth", ["stages", "counters", "gauges"])
+
+# Identity of a single NVIDIA GPU, or of a MIG device (index of its GPU, its own handle, name and uuid), resolved once
+# per NVML session and again when the MIG configuration changes
+GPUDevice   = namedtuple("GPUDevice", ["index", "handle", "name", "uuid", "mig"], defaults=(None,))
+
+# Position of a MIG device in its GPU: its uuid (MIG-...), the uuid of the GPU, its GPU and compute instance ids
+MIGInstance = namedtuple("MIGInstance", ["uuid", "parent_uuid", "gpu_instance_id", "compute_instance_id"])
+
+# Identity of the pod a container belongs to; the owner (e.g. Deployment/trainer) and the labels selected by
+# pod_label_tags, as ((tag key, value), ...), are only known with the kubelet backend
+PodInfo      = namedtuple("PodInfo", ["pod_uid", "container_name", "name", "namespace", "container_id",
+                                      "owner_kind", "owner_name", "labels"], defaults=("", "", ()))
+
+# Container (and pod, under kubernetes) a process runs in, as read from its cgroup
+ContainerRef = namedtuple("ContainerRef", ["pod_uid", "container_id"])
+
+# GPU process followed by the ProcessTracker, (pid, create_time) identifies it even when the pid is reused; a pod
+# known by its uid only is resolved again from retry_at (monotonic time), after retry_delay seconds of backoff
+TrackedProcess = namedtuple("TrackedProcess", ["create_time", "username", "command", "pod", "retry_at", "retry_delay"],
+                            defaults=(None, 0))
+
+# Backend the samples are exported to: its name, its ExportDriver, and the agent options with its own overrides
+ExportSink = namedtuple("ExportSink", ["name", "driver", "options"])
+
+# Agent options a sink of the sinks list may override for itself
+SINK_OPTIONS = ("queue_size", "queue_overflow", "export_retries", "export_backoff", "export_max_backoff",
+                "spool_max_bytes", "spool_segment_bytes", "spool_replay_rate", "delta_export", "delta_deadband",
+                "delta_heartbeat")
+
+
+def escape_key(value):
+    """Escape a measurement, tag key, tag value or field key for influxdb line protocol"""
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def encode_line(measurement, tags, fields, timestamp):
+    """Encode a single point into influxdb line protocol
+    Args:
+        measurement (string)        : Name of the measurement
+        tags        (py dictionary) : Tag values, written sorted by key as recommended by influxdb
+        fields      (py dictionary) : Field values; int are written as integers, float as floats, others as strings
+        timestamp   (int)           : Timestamp in the precision of the write request
+    Returns:
+        line (string) : measurement,tag=value field=value timestamp
+    """
+    tag_set   = "".join(",%s=%s" % (escape_key(key), escape_key(tags[key]))
+                        for key in sorted(tags) if tags[key] != "")
+    field_set = []
+    for key in sorted(fields):
+        value = fields[key]
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif isinstance(value, int):
+            value = "%di" % value
+        elif isinstance(value, float):
+            value = repr(value)
+        else:
+            value = '"%s"' % str(value).replace("\\", "\\\\").replace('"', '\\"')
+        field_set.append("%s=%s" % (escape_key(key), value))
+
+    return "%s%s %s %d" % (escape_key(measurement), tag_set, ",".join(field_set), timestamp)
+
+
+# NVML calls for the telemetry that has no field id, each is made at most once per GPU and sample
+TELEMETRY_CALLS = {
+    "utilization"     : lambda nvml, handle: nvml.nvmlDeviceGetUtilizationRates(handle),
+    "memory"          : lambda nvml, handle: nvml.nvmlDeviceGetMemoryInfo(handle),
+    "temperature"     : lambda nvml, handle: nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU),
+    "power"           : lambda nvml, handle: nvml.nvmlDeviceGetPowerUsage(handle),
+    "energy"          : lambda nvml, handle: nvml.nvmlDeviceGetTotalEnergyConsumption(handle),
+    "sm_clock"        : lambda nvml, handle: nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_SM),
+    "memory_clock"    : lambda nvml, handle: nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_MEM),
+    "throttle_reasons": lambda nvml, handle: nvml.nvmlDeviceGetCurrentClocksThrottleReasons(handle),
+    "pcie_tx"         : lambda nvml, handle: nvml.nvmlDeviceGetPcieThroughput(handle, nvml.NVML_PCIE_UTIL_TX_BYTES),
+    "pcie_rx"         : lambda nvml, handle: nvml.nvmlDeviceGetPcieThroughput(handle, nvml.NVML_PCIE_UTIL_RX_BYTES),
+}
+
+# Telemetry collected per GPU: metric name -> (NVML field id constant, fallback call of TELEMETRY_CALLS, extractor)
+# Metrics with a field id supported by the binding and the driver are read together by nvmlDeviceGetFieldValues,
+# the others fall back to their TELEMETRY_CALLS entry.
+TELEMETRY_METRICS = {
+    "sm_utilization_pct"    : (None,                                     "utilization",      lambda r: r.gpu),
+    "memory_utilization_pct": (None,                                     "utilization",      lambda r: r.memory),
+    "memory_used_bytes"     : (None,                                     "memory",           lambda r: r.used),
+    "temperature_c"         : (None,                                     "temperature",      None),
+    "memory_temperature_c"  : ("NVML_FI_DEV_MEMORY_TEMP",                None,               None),
+    "power_usage_mw"        : ("NVML_FI_DEV_POWER_INSTANT",              "power",            None),
+    "energy_mj"             : ("NVML_FI_DEV_TOTAL_ENERGY_CONSUMPTION",   "energy",           None),
+    "sm_clock_mhz"          : (None,                                     "sm_clock",         None),
+    "memory_clock_mhz"      : (None,                                     "memory_clock",     None),
+    "throttle_reasons"      : (None,                                     "throttle_reasons", None),
+    "ecc_sbe_volatile"      : ("NVML_FI_DEV_ECC_SBE_VOL_TOTAL",          None,               None),
+    "ecc_dbe_volatile"      : ("NVML_FI_DEV_ECC_DBE_VOL_TOTAL",          None,               None),
+    "ecc_sbe_aggregate"     : ("NVML_FI_DEV_ECC_SBE_AGG_TOTAL",          None,               None),
+    "ecc_dbe_aggregate"     : ("NVML_FI_DEV_ECC_DBE_AGG_TOTAL",          None,               None),
+    "pcie_tx_kbps"          : (None,                                     "pcie_tx",          None),
+    "pcie_rx_kbps"          : (None,                                     "pcie_rx",          None),
+    "pcie_replay_counter"   : ("NVML_FI_DEV_PCIE_REPLAY_COUNTER",        None,               None),
+    "nvlink_bandwidth_total": ("NVML_FI_DEV_NVLINK_BANDWIDTH_C0_TOTAL",  None,               None),
+}
+
+# Per-process utilisation kept from the NVML process utilisation samples:
+# (attribute of the sample, field of the gpu/usage point), in the order of ProcessUsage.utilization
+PROCESS_UTILIZATION_FIELDS = (("smUtil",  "sm_util"),
+                              ("memUtil", "mem_util"),
+                              ("encUtil", "enc_util"),
+                              ("decUtil", "dec_util"))
+
+# Member of the nvmlValue_t union to read for each NVML_VALUE_TYPE of a field value
+NVML_VALUE_MEMBERS = {0: "dVal", 1: "uiVal", 2: "ulVal", 3: "ullVal", 4: "sllVal", 5: "siVal"}
+
+# Telemetry metrics that only ever grow, exposed as Prometheus counters so rate() and increase() apply
+PROMETHEUS_COUNTERS = ("energy_mj", "ecc_sbe_volatile", "ecc_dbe_volatile", "ecc_sbe_aggregate", "ecc_dbe_aggregate",
+                       "pcie_replay_counter")
+
+
+def nvml_string(value):
+    """Interned text of a string returned by NVML, older python-nvml bindings return bytes"""
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return sys.intern(value)
+
+
+# --------- Class StageHistogram : distribution of the duration of a stage, in fixed buckets -------- #
+class StageHistogram(object):
+    __slots__ = ("counts", "total", "count", "last")
+
+    def __init__(self):
+        """Constructor of StageHistogram class
+        Fields:
+            counts (array of int) : Durations in each bucket of STAGE_BUCKETS, plus one for +Inf (not cumulative)
+            total  (float)        : Sum of the durations, in seconds
+            count  (int)          : Number of durations
+            last   (float)        : Latest duration, in seconds
+        """
+        self.counts = array.array("L", bytes(array.array("L").itemsize * (len(STAGE_BUCKETS) + 1)))
+        self.total  = 0.0
+        self.count  = 0
+        self.last   = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(STAGE_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.last   = seconds
+
+
+# --------- Class AgentMetrics : timings and counters of the agent itself -------- #
+class AgentMetrics(object):
+    def __init__(self):
+        """Constructor of AgentMetrics class
+        Recording is a dictionary lookup and a few additions under a lock, cheap enough for every stage of
+        every sample; the histograms are only copied when a snapshot is taken.
+        Fields:
+            stages   (py dictionary) : StageHistogram of each stage, by stage name
+            counters (py dictionary) : Value of each AGENT_COUNTERS since the agent started
+        """
+        self.lock     = threading.Lock()
+        self.stages   = {}
+        self.counters = dict((counter, 0) for counter in AGENT_COUNTERS)
+
+    def observe(self, stage, seconds):
+        """Account the duration of a stage"""
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = StageHistogram()
+            histogram.observe(seconds)
+
+    def count(self, counter, value=1):
+        """Add value to one of AGENT_COUNTERS"""
+        with self.lock:
+            self.counters[counter] += value
+
+    def snapshot(self, counters=None, gauges=None):
+        """Copy the current timings and counters
+        Args:
+            counters (py dictionary) : Counters kept elsewhere (e.g. by the exporter), added to AGENT_COUNTERS
+            gauges   (py dictionary) : Current values such as the queue depth
+        Returns:
+            health (AgentHealth) : Immutable copy, safe to hand over to the exporter thread
+        """
+        with self.lock:
+            stages       = dict((stage, (tuple(histogram.counts), histogram.total, histogram.count, histogram.last))
+                                for stage, histogram in self.stages.items())
+            all_counters = dict(self.counters)
+        all_counters.update(counters or {})
+
+        return AgentHealth(stages, all_counters, dict(gauges or {}))
+
+
+# Timings and counters of this agent, recorded from every thread
+METRICS = AgentMetrics()
+
+
+# --------- Class NVMLSession : keep NVML initialised and device handles resolved across samples -------- #
+class NVMLSession(object):
+    def __init__(self):
+        """Constructor of NVMLSession class
+        Fields:
+            devices     (list of GPUDevice) : Handle, name and uuid of every GPU on the machine, then of every MIG device
+                                              of the GPUs in MIG mode
+            instances   (py dictionary)     : MIG devices of each GPU in MIG mode, by GPU uuid then by
+                                              (gpu instance id, compute instance id)
+            stale       (bool)              : Whether the MIG configuration changed since the GPUs were enumerated
+            initialized (bool)              : Whether nvmlInit() has been called for this session
+        """
+        self.devices     = []
+        self.instances   = {}
+        self.stale       = False
+        self.initialized = False
+
+    def open(self):
+        """Init the python-nvml driver and resolve the handle, name and uuid of each GPU once"""
+        N.nvmlInit()
+        self.initialized = True
+        self.enumerate()
+
+    def enumerate(self):
+        """Resolve the GPUs of the machine, and the MIG devices of the ones in MIG mode
+        The result is kept until the MIG configuration changes: a process listed in a GPU instance this enumeration
+        does not know (or in none while it knows some) marks the session stale, see instance().
+        """
+        METRICS.count("nvml_enumerations")
+        self.devices   = []
+        self.instances = {}
+        self.stale     = False
+
+        # detect all NVIDIA GPU in machine and keep their identity for the whole session
+        for index in range(N.nvmlDeviceGetCount()):
+            handle = N.nvmlDeviceGetHandleByIndex(index)
+            device = GPUDevice(index,
+                               handle,
+                               nvml_string(N.nvmlDeviceGetName(handle)),
+                               nvml_string(N.nvmlDeviceGetUUID(handle)))
+            self.devices.append(device)
+            if not self.mig_enabled(handle):
+                continue
+
+            # a MIG device per compute instance, the slots without one raise NVML_ERROR_NOT_FOUND
+            instances = {}
+            for mig_index in range(N.nvmlDeviceGetMaxMigDeviceCount(handle)):
+                try:
+                    mig_handle = N.nvmlDeviceGetMigDeviceHandleByIndex(handle, mig_index)
+                    mig        = MIGInstance(nvml_string(N.nvmlDeviceGetUUID(mig_handle)), device.uuid,
+                                             N.nvmlDeviceGetGpuInstanceId(mig_handle),
+                                             N.nvmlDeviceGetComputeInstanceId(mig_handle))
+                    name       = nvml_string(N.nvmlDeviceGetName(mig_handle))
+                except N.NVMLError:
+                    continue
+                instances[(mig.gpu_instance_id, mig.compute_instance_id)] = GPUDevice(index, mig_handle, name,
+                                                                                      mig.uuid, mig)
+            self.instances[device.uuid] = instances
+            LOGGER.debug("GPU %s in MIG mode with %d MIG device(s)", device.uuid, len(instances))
+
+        for uuid in self.instances:
+            self.devices.extend(self.instances[uuid][key] for key in sorted(self.instances[uuid]))
+
+    @staticmethod
+    def mig_enabled(handle):
+        """Whether a GPU is in MIG mode, never with a binding or a GPU without MIG support"""
+        if not hasattr(N, "nvmlDeviceGetMigMode"):
+            return False
+        try:
+            current, _ = N.nvmlDeviceGetMigMode(handle)
+        except N.NVMLError:
+            return False   # Not supported
+        return current == getattr(N, "NVML_DEVICE_MIG_ENABLE", 1)
+
+    def instance(self, device, nv_process):
+        """Device a process listed on a GPU runs in: the MIG device of its GPU and compute instances, or the GPU
+        A process the enumeration cannot place marks the session stale, it is left on its GPU for this sample.
+        Args:
+            device     (GPUDevice)     : GPU the process was listed on
+            nv_process (nvml process)  : Process listed by NVML, with its instance ids when the binding has them
+        Returns:
+            device (GPUDevice) : MIG device of the process, the GPU itself outside of MIG
+        """
+        gpu_instance_id = getattr(nv_process, "gpuInstanceId", None)
+        in_instance     = gpu_instance_id is not None and gpu_instance_id != NVML_NO_INSTANCE
+        instances       = self.instances.get(device.uuid)
+
+        if instances is None or not in_instance:
+            # MIG enabled, or disabled, since the enumeration; a binding without the ids cannot tell
+            if (instances is None) == in_instance and gpu_instance_id is not None:
+                self.stale = True
+            return device
+
+        mig_device = instances.get((gpu_instance_id, getattr(nv_process, "computeInstanceId", None)))
+        if mig_device is None:
+            self.stale = True
+            return device
+        return mig_device
+
+    def close(self):
+        """Close the python-nvml driver, if it was initialised by this session"""
+        if self.initialized:
+            self.initialized = False
+            self.devices     = []
+            self.instances   = {}
+            N.nvmlShutdown()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# --------- Class TelemetryCollector : per-GPU device telemetry, batched through NVML field values -------- #
+class TelemetryCollector(object):
+    def __init__(self, metrics=None, process_utilization=True, nvml=N):
+        """Constructor of TelemetryCollector class
+        Args:
+            metrics             (list of string) : Names of TELEMETRY_METRICS to collect, None for all of them
+            process_utilization (bool)           : Read the per-process utilisation samples of each GPU
+            nvml                (module)         : NVML binding, pynvml unless a fake one is given
+        Fields:
+            field_ids      (py dictionary) : NVML field id of each metric readable as a field value in this binding
+            fallback       (set)           : (gpu uuid, metric) pairs whose field is not supported, read by their call
+            unsupported    (set)           : (gpu uuid, metric) pairs the driver or the GPU does not support
+            last_seen      (py dictionary) : Timestamp of the newest process utilisation sample read, per gpu uuid
+        """
+        metrics = list(TELEMETRY_METRICS) if metrics is None else list(metrics)
+        unknown = [metric for metric in metrics if metric not in TELEMETRY_METRICS]
+        if unknown:
+            raise ValueError("Unknown telemetry_metrics %s, expected some of %s"
+                             % (", ".join(unknown), ", ".join(sorted(TELEMETRY_METRICS))))
+
+        self.nvml                = nvml
+        self.metrics             = metrics
+        self.process_utilization = process_utilization
+        self.fallback            = set()
+        self.unsupported         = set()
+        self.last_seen           = {}
+
+        # resolve field ids once, older bindings do not know the newer ones (nor nvmlDeviceGetFieldValues)
+        self.field_ids = {}
+        if hasattr(nvml, "nvmlDeviceGetFieldValues"):
+            for metric in metrics:
+                field = TELEMETRY_METRICS[metric][0]
+                if field is not None and hasattr(nvml, field):
+                    self.field_ids[metric] = getattr(nvml, field)
+
+    def read_fields(self, device, metrics):
+        """Read metrics with a single nvmlDeviceGetFieldValues call
+        Returns:
+            values (py dictionary) : Value of each metric the GPU supports
+        """
+        values = {}
+        if not metrics:
+            return values
+
+        try:
+            field_values = self.nvml.nvmlDeviceGetFieldValues(device.handle, [self.field_ids[m] for m in metrics])
+        except self.nvml.NVMLError as err:
+            LOGGER.warning("Field values not supported by GPU %s (%s), falling back to single queries", device.uuid, err)
+            # per GPU, the other GPUs may be collected at the same time by other workers
+            for metric in metrics:
+                self.fallback.add((device.uuid, metric))
+            return None
+
+        for metric, field_value in zip(metrics, field_values):
+            member = NVML_VALUE_MEMBERS.get(field_value.valueType)
+            if field_value.nvmlReturn != 0 or member is None:
+                self.fallback.add((device.uuid, metric))
+                continue
+            values[metric] = getattr(field_value.value, member)
+
+        return values
+
+    def collect(self, device):
+        """Collect the configured telemetry of a GPU
+        Args:
+            device (GPUDevice) : GPU resolved by the NVML session
+        Returns:
+            telemetry (py dictionary) : Value of each supported metric, keyed by metric name
+        """
+        metrics   = [metric for metric in self.metrics if (device.uuid, metric) not in self.unsupported]
+        fields    = [metric for metric in metrics
+                     if metric in self.field_ids and (device.uuid, metric) not in self.fallback]
+        # None when the driver has no field values at all, every metric then goes through its fallback call
+        telemetry = self.read_fields(device, fields) or {}
+
+        calls = {}
+        for metric in metrics:
+            if metric in telemetry:
+                continue
+
+            field, call, extract = TELEMETRY_METRICS[metric]
+            if call is None:
+                self.unsupported.add((device.uuid, metric))
+                continue
+
+            if call not in calls:
+                try:
+                    calls[call] = TELEMETRY_CALLS[call](self.nvml, device.handle)
+                except self.nvml.NVMLError:
+                    calls[call] = None
+            if calls[call] is None:
+                self.unsupported.add((device.uuid, metric))
+                continue
+
+            telemetry[metric] = extract(calls[call]) if extract else calls[call]
+
+        return telemetry
+
+    def collect_processes(self, device):
+        """Average the per-process utilisation samples NVML recorded since the previous call
+        Only the samples newer than the last one seen are returned by NVML, so each call covers the
+        time elapsed since the previous sample of the agent, whatever the sampling interval.
+        A process has no sample for the periods it was idle, so its average is taken over every sampling
+        period of the GPU in the window (the distinct timestamps of all processes), idle ones counting as 0.
+        Args:
+            device (GPUDevice) : GPU resolved by the NVML session
+        Returns:
+            utilization (py dictionary) : Per pid, the average of each PROCESS_UTILIZATION_FIELDS, as a tuple
+        """
+        if not self.process_utilization or (device.uuid, "process_utilization") in self.unsupported:
+            return {}
+
+        try:
+            samples = self.nvml.nvmlDeviceGetProcessUtilization(device.handle, self.last_seen.get(device.uuid, 0))
+        except self.nvml.NVMLError as err:
+            # no sample since the last one seen
+            if getattr(err, "value", None) == getattr(self.nvml, "NVML_ERROR_NOT_FOUND", None):
+                return {}
+            LOGGER.warning("Process utilization not supported by GPU %s: %s", device.uuid, err)
+            self.unsupported.add((device.uuid, "process_utilization"))
+            return {}
+
+        samples = [sample for sample in samples if sample.timeStamp > self.last_seen.get(device.uuid, 0)]
+        if not samples:
+            return {}
+
+        self.last_seen[device.uuid] = max(sample.timeStamp for sample in samples)
+        periods                     = len(set(sample.timeStamp for sample in samples))
+
+        totals = {}
+        for sample in samples:
+            total = totals.setdefault(sample.pid, [0] * len(PROCESS_UTILIZATION_FIELDS))
+            for position, (attribute, _) in enumerate(PROCESS_UTILIZATION_FIELDS):
+                total[position] += getattr(sample, attribute)
+
+        return dict((pid, tuple(float(value) / periods for value in total)) for pid, total in totals.items())
+
+
+def sum_pod_usage(gpu):
+    """Sum the processes of each pod's container in a gpu, they would otherwise overwrite each other's point
+    Args:
+        gpu (GPUSnapshot) : Statistics of one GPU, see GPUStat.new_query()
+    Returns:
+        pods (py dictionary) : (pod name, container name, namespace) -> (PodInfo of the first process,
+                               {"value": memory in MB, <util field>: percent})
+    """
+    pods = {}
+    for process in gpu.processes:
+        pod    = process.pod
+        key    = (pod.name, pod.container_name, pod.namespace)
+        if key not in pods:
+            pods[key] = (pod, {"value": 0})
+        fields = pods[key][1]
+        fields["value"] += process.memory
+        if process.utilization is not None:
+            for (_, field), value in zip(PROCESS_UTILIZATION_FIELDS, process.utilization):
+                fields[field] = fields.get(field, 0.0) + value
+
+    return pods
+
+
+def new_telemetry_collector(agent_cfg):
+    """Create the telemetry collector from the agent options
+    Returns:
+        collector (TelemetryCollector) : Collector of telemetry_metrics and per-process utilisation,
+                                         None when both are disabled
+    """
+    metrics = agent_cfg["telemetry_metrics"]
+    if metrics is not None and not metrics and not agent_cfg["process_utilization"]:
+        return None
+
+    return TelemetryCollector(metrics, agent_cfg["process_utilization"])
+
+
+def pod_from_labels(container_id, labels):
+    """Build the pod identity of a container from the labels set by the kubelet
+    Args:
+        container_id (string)        : Full id of the container
+        labels       (py dictionary) : Labels of the container
+    Returns:
+        pod (PodInfo) : Identity of the pod, None if the container is not managed by kubernetes
+    """
+    labels = labels or {}
+    if K8S_POD_NAME_LABEL not in labels:
+        return None
+
+    # interned: the same few names are the tags of every point of every snapshot
+    return PodInfo(sys.intern(labels.get(K8S_POD_UID_LABEL, "")),
+                   sys.intern(labels.get(K8S_CONTAINER_NAME_LABEL, "")),
+                   sys.intern(labels[K8S_POD_NAME_LABEL]),
+                   sys.intern(labels.get(K8S_POD_NAMESPACE_LABEL, "")),
+                   container_id)
+
+
+def gpu_tags(gpu):
+    """Tags of a GPU besides its name, uuid and index
+    Args:
+        gpu (GPUSnapshot) : Sample of a GPU, or of a MIG device
+    Returns:
+        tags (py dictionary) : mig_uuid, gpu_instance_id and compute_instance_id of a MIG device, none for a GPU
+    """
+    if gpu.mig is None:
+        return {}
+
+    return {"mig_uuid"            : gpu.mig.uuid,
+            "gpu_instance_id"     : gpu.mig.gpu_instance_id,
+            "compute_instance_id" : gpu.mig.compute_instance_id}
+
+
+def pod_tags(pod):
+    """Tags of a pod besides its name, container and namespace
+    Args:
+        pod (PodInfo) : Identity of the pod
+    Returns:
+        tags (py dictionary) : owner_kind, owner_name and label_<key> tags, those the backend knows
+    """
+    tags = {}
+    if pod.owner_kind:
+        tags["owner_kind"] = pod.owner_kind
+        tags["owner_name"] = pod.owner_name
+    for key, value in pod.labels:
+        tags[key] = value
+
+    return tags
+
+
+class ExportError(Exception):
+    """Raised when the metrics cannot be written into the backend"""
+    pass
+
+
+class RuntimeClientError(Exception):
+    """Raised when the container runtime cannot be reached or answers with an error"""
+    pass
+
+
+# --------- Class UnixHTTPConnection : HTTP/1.1 connection over a unix socket -------- #
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=5):
+        """Constructor of UnixHTTPConnection class
+        Args:
+            socket_path (string) : Path of the unix socket the HTTP server listens on
+            timeout     (float)  : Socket timeout in seconds
+        """
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+# --------- Class RuntimeClient : interface of the container runtime backends -------- #
+class RuntimeClient(object):
+    """A container runtime backend lists the running kubernetes containers in bulk"""
+
+    def list_containers(self):
+        """List the running containers
+        Returns:
+            containers (py dictionary) : PodInfo keyed by container id, non-kubernetes containers are either
+                                         left out or mapped to None
+        """
+        raise NotImplementedError
+
+    def gpu_assignments(self):
+        """List the GPUs allocated to a single container, by the device plugin of kubernetes
+        Returns:
+            assignments (py dictionary) : PodInfo keyed by GPU uuid, empty when the backend does not know
+        """
+        return {}
+
+    def close(self):
+        pass
+
+
+# --------- Class DockerRuntimeClient : Docker Engine API over its unix socket -------- #
+class DockerRuntimeClient(RuntimeClient):
+    def __init__(self, endpoint=AGENT_DEFAULTS["runtime_endpoint"], timeout=5):
+        """Constructor of DockerRuntimeClient class
+        Args:
+            endpoint (string) : Path of the docker daemon socket, optionally prefixed by unix://
+            timeout  (float)  : Socket timeout in seconds
+        Fields:
+            connection (UnixHTTPConnection) : Keep-alive connection reused by every request
+        """
+        if endpoint.startswith("unix://"):
+            endpoint = endpoint[len("unix://"):]
+
+        self.socket_path = endpoint
+        self.timeout     = timeout
+        self.connection  = None
+
+    def get(self, path):
+        """Send a GET request to the Engine API on the kept-alive connection and decode its JSON answer
+        The connection is re-opened once if the daemon closed it since the previous request.
+        """
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = UnixHTTPConnection(self.socket_path, self.timeout)
+            try:
+                self.connection.request("GET", path)
+                response = self.connection.getresponse()
+                body     = response.read()
+                break
+            except (http.client.HTTPException, socket.error) as err:
+                self.close()
+                if attempt == 2:
+                    raise RuntimeClientError("Cannot reach docker on %s: %s" % (self.socket_path, err))
+
+        if response.status != 200:
+            raise RuntimeClientError("docker answered %d to GET %s" % (response.status, path))
+
+        return json.loads(body.decode("utf-8"))
+
+    def list_containers(self):
+        # a single request lists every running container with its labels, filtered to the kubernetes ones
+        filters    = json.dumps({"label": [K8S_POD_NAME_LABEL]})
+        containers = self.get("/containers/json?" + urllib.parse.urlencode({"filters": filters}))
+
+        return dict((container["Id"], pod_from_labels(container["Id"], container.get("Labels")))
+                    for container in containers)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# --------- Class CRIRuntimeClient : containerd/CRI-O through crictl -------- #
+class CRIRuntimeClient(RuntimeClient):
+    def __init__(self, endpoint="unix:///run/containerd/containerd.sock", timeout=5):
+        """Constructor of CRIRuntimeClient class
+        Args:
+            endpoint (string) : CRI endpoint passed to crictl --runtime-endpoint
+            timeout  (float)  : Timeout in seconds of each crictl call
+        """
+        if not endpoint.startswith("unix://"):
+            endpoint = "unix://" + endpoint
+
+        self.endpoint = endpoint
+        self.timeout  = timeout
+
+    def crictl(self, *args):
+        """Run a crictl command and decode its JSON output"""
+        METRICS.count("subprocesses")
+        crictl   = subprocess.Popen(["crictl", "--runtime-endpoint", self.endpoint,
+                                     "--timeout", "%ds" % self.timeout] + list(args),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+        out, err = crictl.communicate()
+        if crictl.returncode != 0:
+            raise RuntimeClientError("crictl %s failed: %s" % (args[0], err.strip()))
+
+        return json.loads(out)
+
+    def list_containers(self):
+        containers = self.crictl("ps", "-o", "json")["containers"]
+
+        return dict((container["id"], pod_from_labels(container["id"], container.get("labels")))
+                    for container in containers)
+
+
+def decode_varint(data, offset):
+    """Decode a protobuf varint
+    Returns:
+        varint (tuple) : (value, offset of the byte following the varint)
+    """
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated protobuf varint")
+        byte    = data[offset]
+        offset += 1
+        value  |= (byte & 0x7f) << shift
+        shift  += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def decode_protobuf(data):
+    """Decode the fields of a protobuf message without its schema
+    Args:
+        data (bytes) : Serialized message
+    Returns:
+        fields (py dictionary) : Values of each field number, in order: int for varints and fixed numbers,
+                                 bytes for length-delimited fields (strings, embedded messages)
+    """
+    fields = {}
+    offset = 0
+    while offset < len(data):
+        key, offset       = decode_varint(data, offset)
+        number, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, offset = decode_varint(data, offset)
+        elif wire_type == 2:
+            length, offset = decode_varint(data, offset)
+            if offset + length > len(data):
+                raise ValueError("Truncated protobuf field %d" % number)
+            value   = data[offset:offset + length]
+            offset += length
+        elif wire_type == 1:
+            value   = struct.unpack_from("<Q", data, offset)[0]
+            offset += 8
+        elif wire_type == 5:
+            value   = struct.unpack_from("<I", data, offset)[0]
+            offset += 4
+        else:
+            raise ValueError("Unsupported protobuf wire type %d" % wire_type)
+        fields.setdefault(number, []).append(value)
+
+    return fields
+
+
+def parse_pod_resources(data):
+    """Read the devices allocated to each container from a ListPodResourcesResponse of the kubelet
+    Only the fields used here are decoded, from the v1 API:
+    pod_resources = 1 {name = 1, namespace = 2, containers = 3 {name = 1, devices = 2 {resource_name = 1, device_ids = 2}}}
+    Args:
+        data (bytes) : Serialized ListPodResourcesResponse
+    Returns:
+        devices (list of tuple) : (namespace, pod name, container name, resource name, list of device ids)
+    """
+    def string(fields, number):
+        return fields[number][0].decode("utf-8") if number in fields else ""
+
+    devices = []
+    for pod_resources in decode_protobuf(data).get(1, []):
+        pod = decode_protobuf(pod_resources)
+        for container_resources in pod.get(3, []):
+            container = decode_protobuf(container_resources)
+            for container_devices in container.get(2, []):
+                device = decode_protobuf(container_devices)
+                devices.append((string(pod, 2), string(pod, 1), string(container, 1), string(device, 1),
+                                [device_id.decode("utf-8") for device_id in device.get(2, [])]))
+
+    return devices
+
+
+def pod_owner(metadata):
+    """Get the workload controlling a pod, a ReplicaSet is reported as the Deployment that created it
+    Args:
+        metadata (py dictionary) : Metadata of the pod, as listed by the kubelet
+    Returns:
+        owner (tuple) : (kind, name) of the controller (e.g. ("Deployment", "trainer"), ("Job", "etl-27")),
+                        ("", "") for a bare pod
+    """
+    for reference in metadata.get("ownerReferences") or []:
+        if not reference.get("controller"):
+            continue
+
+        kind, name    = reference.get("kind", ""), reference.get("name", "")
+        template_hash = (metadata.get("labels") or {}).get(K8S_POD_TEMPLATE_HASH_LABEL)
+        if kind == "ReplicaSet" and template_hash and name.endswith("-" + template_hash):
+            return "Deployment", name[:-len(template_hash) - 1]
+        return kind, name
+
+    return "", ""
+
+
+# --------- Class KubeletRuntimeClient : pod list and GPU allocations of the local kubelet -------- #
+class KubeletRuntimeClient(RuntimeClient):
+    def __init__(self, endpoint="https://127.0.0.1:10250", timeout=5, token_file="", ca_file="", label_tags=(),
+                 pod_resources_socket=AGENT_DEFAULTS["pod_resources_socket"]):
+        """Constructor of KubeletRuntimeClient class
+        The pods of the node come from the kubelet itself rather than from the container runtime, whatever the
+        runtime: a single GET /pods lists them with their containers, labels and owner. The kubelet also knows
+        which GPU it allocated to which container, through its pod-resources API.
+        Args:
+            endpoint             (string)         : Base URL of the kubelet, https://<node>:10250 or the read-only
+                                                    http://<node>:10255
+            timeout              (float)          : Timeout in seconds of each request
+            token_file           (string)         : File of the bearer token sent to the kubelet (e.g. the service
+                                                    account token of the agent), empty to send none
+            ca_file              (string)         : CA bundle verifying the kubelet certificate, empty to not verify it
+                                                    (kubelet serving certificates are often self-signed)
+            label_tags           (list of string) : Pod labels attached to the pod identities, as label_<key> tags
+            pod_resources_socket (string)         : Unix socket of the pod-resources API, empty to not ask which GPU
+                                                    is allocated to which container
+        Fields:
+            connection   (HTTPConnection) : Keep-alive connection reused by every request
+            etag         (string)         : ETag of the last pod list, sent back in If-None-Match
+            digest       (string)         : sha1 of the last pod list, an unchanged list is not decoded again
+            containers   (py dictionary)  : PodInfo by id of the running containers, from the last pod list
+            by_container (py dictionary)  : The same PodInfo by (namespace, pod name, container name)
+            channel      (grpc.Channel)   : Channel to the pod-resources API, opened by the first call
+        """
+        url = urllib.parse.urlsplit(endpoint)
+        if url.scheme not in ("http", "https"):
+            raise ValueError("The kubelet runtime_endpoint must be an http(s) URL, got %r" % endpoint)
+
+        self.url                  = url
+        self.timeout              = timeout
+        self.token_file           = token_file
+        self.ca_file              = ca_file
+        self.label_tags           = [(key, sys.intern("label_" + LABEL_TAG_RE.sub("_", key))) for key in label_tags]
+        self.pod_resources_socket = pod_resources_socket
+        self.connection           = None
+        self.etag                 = None
+        self.digest               = None
+        self.containers           = {}
+        self.by_container         = {}
+        self.channel              = None
+        self.list_pod_resources   = None
+
+    def connect(self):
+        if self.url.scheme == "http":
+            return http.client.HTTPConnection(self.url.hostname, self.url.port or 10255, timeout=self.timeout)
+
+        context = ssl.create_default_context(cafile=self.ca_file or None)
+        if not self.ca_file:
+            context.check_hostname = False
+            context.verify_mode    = ssl.CERT_NONE
+        return http.client.HTTPSConnection(self.url.hostname, self.url.port or 10250, timeout=self.timeout,
+                                           context=context)
+
+    def get(self, path):
+        """Send a conditional GET request to the kubelet on the kept-alive connection
+        The connection is re-opened once if the kubelet closed it since the previous request.
+        Returns:
+            response (tuple) : (HTTP status, ETag header, body)
+        """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.token_file:
+            # read every time: projected service account tokens are rotated
+            try:
+                with open(self.token_file, "r") as token:
+                    headers["Authorization"] = "Bearer " + token.read().strip()
+            except (IOError, OSError) as err:
+                raise RuntimeClientError("Cannot read the kubelet token: %s" % err)
+
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = self.connect()
+            try:
+                self.connection.request("GET", self.url.path.rstrip("/") + path, headers=headers)
+                response = self.connection.getresponse()
+                body     = response.read()
+                break
+            except (http.client.HTTPException, socket.error) as err:
+                self.close_connection()
+                if attempt == 2:
+                    raise RuntimeClientError("Cannot reach the kubelet on %s: %s" % (self.url.netloc, err))
+
+        return response.status, response.getheader("ETag"), body
+
+    def pod_info(self, metadata, container_name, container_id):
+        """Build the identity of a container of a pod listed by the kubelet"""
+        labels            = metadata.get("labels") or {}
+        owner_kind, owner = pod_owner(metadata)
+
+        # interned: the same few names are the tags of every point of every snapshot
+        return PodInfo(sys.intern(metadata.get("uid", "")),
+                       sys.intern(container_name),
+                       sys.intern(metadata.get("name", "")),
+                       sys.intern(metadata.get("namespace", "")),
+                       container_id,
+                       sys.intern(owner_kind),
+                       sys.intern(owner),
+                       tuple((tag, sys.intern(labels[key])) for key, tag in self.label_tags if key in labels))
+
+    def list_containers(self):
+        status, etag, body = self.get("/pods")
+        if status == 304:
+            return dict(self.containers)
+        if status != 200:
+            raise RuntimeClientError("kubelet answered %d to GET /pods" % status)
+        self.etag = etag
+
+        # the kubelet rarely sends an ETag: an identical pod list is recognised by its digest instead
+        digest = hashlib.sha1(body).hexdigest()
+        if digest == self.digest:
+            return dict(self.containers)
+
+        containers   = {}
+        by_container = {}
+        for pod in json.loads(body.decode("utf-8")).get("items") or []:
+            metadata   = pod.get("metadata") or {}
+            pod_status = pod.get("status") or {}
+            for container in (pod_status.get("initContainerStatuses") or []) + \
+                             (pod_status.get("containerStatuses") or []):
+                # "containerd://<id>", "docker://<id>", "cri-o://<id>": the id alone is found in the cgroups
+                container_id = container.get("containerID", "").split("://")[-1]
+                if not container_id or "running" not in (container.get("state") or {}):
+                    continue
+                pod_info = self.pod_info(metadata, container.get("name", ""), container_id)
+                containers[container_id] = pod_info
+                by_container[(pod_info.namespace, pod_info.name, pod_info.container_name)] = pod_info
+
+        self.containers   = containers
+        self.by_container = by_container
+        self.digest       = digest
+        return dict(containers)
+
+    def gpu_assignments(self):
+        if not self.pod_resources_socket:
+            return {}
+
+        if self.list_pod_resources is None:
+            try:
+                import grpc
+            except ImportError:
+                LOGGER.warning("grpcio is not installed, the GPU allocations of the kubelet are not used")
+                self.pod_resources_socket = ""
+                return {}
+            self.channel            = grpc.insecure_channel("unix://" + self.pod_resources_socket)
+            # no (de)serializer: the empty ListPodResourcesRequest is sent and the response decoded as bytes
+            self.list_pod_resources = self.channel.unary_unary(POD_RESOURCES_LIST_METHOD)
+            self.rpc_error          = grpc.RpcError
+
+        try:
+            devices = parse_pod_resources(self.list_pod_resources(b"", timeout=self.timeout))
+        except (self.rpc_error, ValueError) as err:
+            raise RuntimeClientError("Cannot list the pod resources on %s: %s" % (self.pod_resources_socket, err))
+
+        assignments = {}
+        shared      = set()
+        for namespace, name, container_name, resource_name, device_ids in devices:
+            if resource_name != NVIDIA_GPU_RESOURCE and not resource_name.startswith(NVIDIA_MIG_RESOURCE_PREFIX):
+                continue
+            pod = self.by_container.get((namespace, name, container_name)) or \
+                  PodInfo("", sys.intern(container_name), sys.intern(name), sys.intern(namespace), "")
+            for device_id in device_ids:
+                # a time-sliced GPU is advertised as several <uuid>::<n> devices, possibly allocated to several pods
+                uuid = device_id.split("::")[0]
+                if assignments.get(uuid, pod) != pod:
+                    shared.add(uuid)
+                assignments[uuid] = pod
+
+        for uuid in shared:
+            del assignments[uuid]
+
+        return assignments
+
+    def close_connection(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def close(self):
+        self.close_connection()
+        if self.channel is not None:
+            self.channel.close()
+            self.channel            = None
+            self.list_pod_resources = None
+
+
+# Container runtime backends selectable with container_runtime in conf.yaml
+RUNTIME_CLIENTS = {
+    "docker" : DockerRuntimeClient,
+    "cri"    : CRIRuntimeClient,
+    "kubelet": KubeletRuntimeClient,
+}
+
+
+def new_runtime_client(container_runtime=AGENT_DEFAULTS["container_runtime"],
+                       runtime_endpoint=AGENT_DEFAULTS["runtime_endpoint"], **options):
+    """Create the client of the configured container runtime
+    Args:
+        options (keyword arguments) : Options of the backend besides its endpoint
+    Returns:
+        client (RuntimeClient) : Backend registered under container_runtime in RUNTIME_CLIENTS
+    """
+    if container_runtime not in RUNTIME_CLIENTS:
+        raise ValueError("Unknown container_runtime %r, expected one of %s"
+                         % (container_runtime, ", ".join(sorted(RUNTIME_CLIENTS))))
+
+    return RUNTIME_CLIENTS[container_runtime](runtime_endpoint, **options)
+
+
+def parse_cgroup(content):
+    """Find the container of a process in the content of /proc/<pid>/cgroup
+    Each line is "hierarchy-ID:controller-list:cgroup-path", the cgroup v2 unified hierarchy is "0::cgroup-path".
+    Handles the cgroupfs (/kubepods/burstable/pod<uid>/<id>) and systemd
+    (/kubepods.slice/kubepods-burstable.slice/kubepods-burstable-pod<uid>.slice/<runtime>-<id>.scope) drivers.
+    Args:
+        content (string) : Content of /proc/<pid>/cgroup
+    Returns:
+        container (ContainerRef) : Pod uid (None outside kubernetes) and container id, None if not in a container
+    """
+    for line in content.splitlines():
+        path          = line.split(":", 2)[-1]
+        container_ids = CGROUP_CONTAINER_ID_RE.findall(path)
+        if not container_ids:
+            continue
+
+        pod_uid = CGROUP_POD_UID_RE.search(path)
+        if pod_uid is not None:
+            pod_uid = pod_uid.group(1).replace("_", "-")
+
+        # the innermost container, in case of nested cgroups
+        return ContainerRef(pod_uid, container_ids[-1])
+
+    return None
+
+
+# --------- Class CgroupResolver : pid to container resolution from /proc/<pid>/cgroup -------- #
+class CgroupResolver(object):
+    def __init__(self, proc_root="/proc"):
+        """Constructor of CgroupResolver class
+        Args:
+            proc_root (string) : Mount point of procfs
+        Fields:
+            cache (py dictionary) : (start time, ContainerRef) keyed by pid
+        """
+        self.proc_root = proc_root
+        self.cache     = {}
+
+    def start_time(self, pid):
+        """Read the start time of a process, in clock ticks since boot (field 22 of /proc/<pid>/stat)
+        Together with the pid, it identifies a process even when the pid is reused.
+        """
+        with open(os.path.join(self.proc_root, str(pid), "stat"), "r") as stat:
+            # the command name (field 2) may contain spaces and parentheses, fields are counted after it
+            return int(stat.read().rsplit(")", 1)[1].split()[19])
+
+    def resolve(self, pid):
+        """Get the container a process runs in
+        Args:
+            pid (int) : Pid of the process
+        Returns:
+            container (ContainerRef) : Pod uid and container id, None if the process is gone or not in a container
+        """
+        try:
+            start_time = self.start_time(pid)
+        except (IOError, OSError, IndexError, ValueError):
+            self.cache.pop(pid, None)
+            return None
+
+        cached = self.cache.get(pid)
+        if cached is not None and cached[0] == start_time:
+            METRICS.count("cgroup_cache_hits")
+            return cached[1]
+        METRICS.count("cgroup_cache_misses")
+
+        try:
+            with open(os.path.join(self.proc_root, str(pid), "cgroup"), "r") as cgroup:
+                container = parse_cgroup(cgroup.read())
+        except (IOError, OSError):
+            self.cache.pop(pid, None)
+            return None
+
+        self.cache[pid] = (start_time, container)
+        return container
+
+    def prune(self, live_pids):
+        """Forget the processes that are not in live_pids anymore"""
+        for pid in set(self.cache) - set(live_pids):
+            del self.cache[pid]
+
+
+# --------- Class PodIndex : in-process mapping of containers and their processes to pod identity -------- #
+class PodIndex(object):
+    def __init__(self, runtime_client, refresh_interval=AGENT_DEFAULTS["pod_index_refresh"], min_refresh_interval=1,
+                 cgroup_resolver=None):
+        """Constructor of PodIndex class
+        Args:
+            runtime_client       (RuntimeClient)  : Backend listing the containers of the node
+            refresh_interval     (float)          : Seconds after which the containers are listed again
+            min_refresh_interval (float)          : Minimum seconds between two refreshes triggered by unknown containers
+            cgroup_resolver      (CgroupResolver) : Pid to container resolver, a new one if omitted
+        Fields:
+            by_container_id (py dictionary) : PodInfo keyed by container id, None for containers unknown to the
+                                              runtime or not managed by kubernetes, until the next periodic refresh
+            assignments     (py dictionary) : PodInfo of the single container each GPU is allocated to, by GPU uuid
+            last_refresh    (float)         : monotonic() time of the last refresh, None before the first one
+            lock            (threading.Lock): Serialises the lookups, processes are resolved from several workers
+        """
+        self.runtime_client       = runtime_client
+        self.refresh_interval     = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.cgroup_resolver      = cgroup_resolver or CgroupResolver()
+        self.by_container_id      = {}
+        self.assignments          = {}
+        self.last_refresh         = None
+        self.lock                 = threading.Lock()
+
+    def refresh(self):
+        """Replace the index with the running containers, stopped containers are evicted along the way
+        Returns:
+            refreshed (bool) : False if the runtime could not be reached and the previous index is kept
+        """
+        self.last_refresh = monotonic()
+        METRICS.count("runtime_refreshes")
+
+        # a single bulk call lists the running containers and their pod identity
+        try:
+            running = self.runtime_client.list_containers()
+        except RuntimeClientError as err:
+            LOGGER.error(err)
+            return False
+        finally:
+            METRICS.observe("runtime_list", monotonic() - self.last_refresh)
+
+        LOGGER.debug("Pod index refreshed: %d container(s) started, %d stopped",
+                     len(set(running) - set(self.by_container_id)),
+                     len(set(self.by_container_id) - set(running)))
+        self.by_container_id = running
+
+        # which GPU the kubelet allocated to which container, identifies the processes that cannot be resolved
+        try:
+            self.assignments = self.runtime_client.gpu_assignments()
+        except RuntimeClientError as err:
+            LOGGER.error(err)
+
+        return True
+
+    def lookup(self, container_id):
+        """Get the pod information of a container
+        The index is refreshed when it is older than refresh_interval, or when the container is unknown
+        and the last refresh is older than min_refresh_interval (the container may have just started).
+        A container still unknown after such a refresh is remembered as a negative entry, so a process
+        outside kubernetes does not trigger a runtime relist every sample.
+        Args:
+            container_id (string) : Full id of the container
+        Returns:
+            pod (PodInfo) : Identity of the pod, None if the container is not managed by kubernetes
+        """
+        with self.lock:
+            age = None if self.last_refresh is None else monotonic() - self.last_refresh
+            if age is None or age >= self.refresh_interval or \
+               (container_id not in self.by_container_id and age >= self.min_refresh_interval):
+                # the runtime does not list it, stop asking until the periodic refresh replaces the index
+                METRICS.count("pod_index_misses")
+                if self.refresh():
+                    self.by_container_id.setdefault(container_id, None)
+            else:
+                METRICS.count("pod_index_hits")
+
+            return self.by_container_id.get(container_id)
+
+    def resolve(self, pid):
+        """Get the pod information of a process running in a kubernetes container
+        When the runtime does not know the container, the pod uid read from the cgroup of the process is
+        used as pod name, with empty container name and namespace.
+        Args:
+            pid (int) : Pid of the process on the host
+        Returns:
+            pod (PodInfo) : Identity of the pod, None if the process does not run in a kubernetes container
+        """
+        container = self.cgroup_resolver.resolve(pid)
+        if container is None:
+            return None
+
+        pod = self.lookup(container.container_id)
+        if pod is None and container.pod_uid is not None:
+            LOGGER.debug("Container %s unknown to the runtime, identifying pid %d by pod uid %s",
+                         container.container_id, pid, container.pod_uid)
+            pod_uid = sys.intern(container.pod_uid)
+            pod     = PodInfo(pod_uid, "", pod_uid, "", container.container_id)
+
+        return pod
+
+    def assignment(self, gpu_uuid):
+        """Get the pod of the container a GPU is allocated to
+        Args:
+            gpu_uuid (string) : Uuid of the GPU
+        Returns:
+            pod (PodInfo) : Identity of the pod, None if the backend does not know or the GPU is shared
+        """
+        with self.lock:
+            if self.last_refresh is None or monotonic() - self.last_refresh >= self.refresh_interval:
+                self.refresh()
+
+            return self.assignments.get(gpu_uuid)
+
+    def prune(self, live_pids):
+        """Forget the memoized processes that are not in live_pids anymore"""
+        self.cgroup_resolver.prune(live_pids)
+
+
+def new_collector_pool(agent_cfg):
+    """Create the workers querying the GPUs and resolving their processes concurrently
+    Args:
+        agent_cfg (py dictionary) : Agent options, see AGENT_DEFAULTS
+    Returns:
+        pool (ThreadPoolExecutor) : Pool of collector_threads workers, None to collect one GPU after the other
+    """
+    if int(agent_cfg["collector_threads"]) <= 1:
+        return None
+
+    return concurrent.futures.ThreadPoolExecutor(max_workers=int(agent_cfg["collector_threads"]),
+                                                 thread_name_prefix="nvml-agent-collector")
+
+
+def new_pod_index(agent_cfg):
+    """Create the pid to pod index from the agent options
+    Args:
+        agent_cfg (py dictionary) : Agent options, see AGENT_DEFAULTS
+    Returns:
+        pod_index (PodIndex) : Empty index backed by the configured container runtime
+    """
+    options = {}
+    if agent_cfg["container_runtime"] == "kubelet":
+        options = {
+            "token_file"          : agent_cfg["kubelet_token_file"],
+            "ca_file"             : agent_cfg["kubelet_ca_file"],
+            "label_tags"          : agent_cfg["pod_label_tags"],
+            "pod_resources_socket": agent_cfg["pod_resources_socket"]
+        }
+    runtime_client = new_runtime_client(agent_cfg["container_runtime"], agent_cfg["runtime_endpoint"], **options)
+
+    return PodIndex(runtime_client, agent_cfg["pod_index_refresh"])
+
+
+# --------- Class ProcessUsage : a process of a pod running on a GPU, as sampled -------- #
+class ProcessUsage(object):
+    __slots__ = ("pid", "username", "memory", "pod", "utilization")
+
+    def __init__(self, pid, username, memory, pod, utilization=None):
+        """Constructor of ProcessUsage class
+        Fields:
+            pid         (int)            : Pid of the process on the host
+            username    (string)         : Owner of the process
+            memory      (int)            : GPU memory used by the process on this GPU, in MB
+            pod         (PodInfo)        : Identity of the pod running the process, shared by all its processes
+            utilization (tuple of float) : SM, memory, encoder and decoder utilisation (percent), in the order of
+                                           PROCESS_UTILIZATION_FIELDS; None when NVML did not sample the process
+        """
+        self.pid         = pid
+        self.username    = username
+        self.memory      = memory
+        self.pod         = pod
+        self.utilization = utilization
+
+    def __repr__(self):
+        return "ProcessUsage(pid=%d, pod=%s/%s, container=%s, memory=%dMB, utilization=%r)" % (
+            self.pid, self.pod.namespace, self.pod.name, self.pod.container_name, self.memory, self.utilization)
+
+
+# --------- Class GPUSnapshot : the processes and the telemetry of a GPU, as sampled -------- #
+class GPUSnapshot(object):
+    __slots__ = ("index", "name", "uuid", "processes", "telemetry", "mig")
+
+    def __init__(self, index, name, uuid, processes=(), telemetry=None, mig=None):
+        """Constructor of GPUSnapshot class
+        Fields:
+            index     (int)                  : Index of the GPU on the machine
+            name      (string)               : Product name of the GPU, or of the profile of the MIG device
+            uuid      (string)               : UUID of the GPU, also for its MIG devices
+            processes (list of ProcessUsage) : Processes of kubernetes pods running on the GPU (in the MIG device)
+            telemetry (py dictionary)        : Device telemetry, metric name -> value
+            mig       (MIGInstance)          : MIG device this sample is of, None for the GPU itself
+        """
+        self.index     = index
+        self.name      = name
+        self.uuid      = uuid
+        self.processes = list(processes)
+        self.telemetry = telemetry or {}
+        self.mig       = mig
+
+    def __repr__(self):
+        return "GPUSnapshot(index=%d, name=%s, uuid=%s, mig=%r, processes=%r, telemetry=%r)" % (
+            self.index, self.name, self.uuid, self.mig, self.processes, self.telemetry)
+
+
+# --------- Class ProcessTracker : GPU processes followed across samples, only the new ones are inspected -------- #
+class ProcessTracker(object):
+    def __init__(self, pod_index, retry_delay=POD_RETRY_DELAY, max_retry_delay=POD_RETRY_MAX_DELAY):
+        """Constructor of ProcessTracker class
+        A process is identified by its pid and its creation time, a reused pid is a new process. Only the new
+        processes are inspected (username, command) and resolved to their pod, the ones already seen cost a
+        single read of their creation time; the processes gone from the GPUs are retired. A process outside any
+        pod stays so for its lifetime, a pod known by its uid only is resolved again on a bounded backoff until
+        the runtime lists its container.
+        Args:
+            pod_index       (PodIndex) : Pid to pod index resolving the new processes
+            retry_delay     (float)    : Seconds before a pod known by its uid only is first resolved again
+            max_retry_delay (float)    : Maximum seconds between two resolutions of a pod known by its uid only
+        Fields:
+            processes (py dictionary) : TrackedProcess of each process running on a GPU, by pid
+        """
+        self.pod_index       = pod_index
+        self.retry_delay     = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.processes       = {}
+
+    def inspect(self, pid):
+        """Get a process, inspecting it only if it was not seen in the previous sample
+        Args:
+            pid (int) : Pid of a process found on a GPU
+        Returns:
+            process (TrackedProcess) : Process and its pod (None outside kubernetes), None when it cannot be inspected
+        """
+        start = monotonic()
+        known = self.processes.get(pid)
+        try:
+            ps_process  = psutil.Process(pid = pid)
+            create_time = ps_process.create_time()
+
+            if known is not None and known.create_time == create_time:
+                # a pod known by its uid only is resolved again once its backoff is over, until the runtime lists
+                # its container; a process outside kubernetes is not resolved again
+                if known.pod is None or known.pod.container_name or start < known.retry_at:
+                    METRICS.count("process_tracker_hits")
+                    return known
+                username, command = known.username, known.command
+            else:
+                known = None
+                METRICS.count("process_tracker_new")
+                username = sys.intern(ps_process.username())
+
+                # figure out OS command that execute the process
+                # cmdline returns full path; as in `ps -o comm`, get short cmdnames.
+                # sometimes, zombie or unknown (e.g. [kworker/8:2H])
+                cmdline  = ps_process.cmdline()
+                command  = os.path.basename(cmdline[0]) if cmdline else '?'
+        except psutil.NoSuchProcess:
+            LOGGER.error("PSutil No Such Process")
+            return None
+        except psutil.Error:
+            # a process already followed keeps its last known identity through a transient error
+            LOGGER.error("PSutil General Error")
+            return known
+        finally:
+            METRICS.observe("process_lookup", monotonic() - start)
+
+        # get pod detail from the cgroup of the process
+        start = monotonic()
+        pod   = self.pod_index.resolve(pid)
+        METRICS.observe("pod_resolution", monotonic() - start)
+        if pod is None and known is None:
+            LOGGER.warning("No kubernetes container found for pid %d", pid)
+
+        if pod is None or pod.container_name:
+            return TrackedProcess(create_time, username, command, pod)
+
+        # known by its uid only, resolved again after a delay doubled on each attempt
+        delay = min(known.retry_delay * 2, self.max_retry_delay) if known is not None else self.retry_delay
+        return TrackedProcess(create_time, username, command, pod, start + delay, delay)
+
+    def update(self, pids, run=map):
+        """Follow the processes found on the GPUs in a sample
+        Args:
+            pids (list of int) : Distinct pids found on the GPUs
+            run  (function)    : map, or the map of a pool of workers inspecting the processes concurrently
+        Returns:
+            processes (py dictionary) : TrackedProcess (None when it cannot be inspected) by pid
+        """
+        processes = dict(zip(pids, run(self.inspect, pids)))
+
+        retired   = [pid for pid in self.processes if pid not in processes]
+        if retired:
+            LOGGER.debug("%d process(es) left the GPUs: %s", len(retired), retired)
+
+        self.processes = dict((pid, process) for pid, process in processes.items() if process is not None)
+
+        # pids seen on any GPU, the others are forgotten by the pod index
+        self.pod_index.prune(set(self.processes))
+
+        return processes
+
+
 # --------- Class GPUStat : query, functions and process needed to obtain the culprit (pods) that execute jobs in GPU -------- #
 class GPUStat(object):
-    def __init__(self, gpus_pod_usage={}):
+    __slots__ = ("gpus_pod_usage", "hostname", "query_time", "health")
+
+    def __init__(self, gpus_pod_usage=None):
         """Constructor of GPUStat class
         Args:
-            gpus_pod_usage (py dictionary, default empty): Information of GPU usage by Pods (should be dict)
-        Fields: 
-            gpus_pod_usage (py dictionary) : A detailed information of per-container GPU utilization in each GPU on a machine
-            hostname       (string)        : The hostname of current machine
-            query_time     (datetime)      : Time information when the object created
+            gpus_pod_usage (list of GPUSnapshot, default empty): Information of GPU usage by Pods
+        Fields: 
+            gpus_pod_usage (list of GPUSnapshot) : A detailed information of per-container GPU utilization in each GPU on a machine
+            hostname       (string)              : The hostname of current machine
+            query_time     (datetime)            : Time information when the object created
+            health         (AgentHealth)         : Timings and counters of the agent, None when not attached
+        """
+        self.gpus_pod_usage = gpus_pod_usage if gpus_pod_usage is not None else []
+
+        # attach host and time information of each GPUStat
+        self.hostname       = sys.intern(socket.gethostname())
+        self.query_time     = datetime.now()
+        self.health         = None
+
+    def __repr__(self):
+        return "GPUStat(hostname=%s, query_time=%s, gpus=%r)" % (self.hostname, self.query_time, self.gpus_pod_usage)
+
+    @staticmethod
+    def new_query(session=None, pod_index=None, telemetry=None, pool=None, tracker=None):
+        """Query the information of all the GPUs on the machine & Trace Pod Processes that utilize them
+        Args:
+            session   (NVMLSession, optional)        : An opened NVML session to reuse; if omitted, NVML is initialised
+                                                       and shut down around this single query
+            pod_index (PodIndex, optional)           : Pid to pod index kept across queries; if omitted, a new one is built
+            telemetry (TelemetryCollector, optional) : Collector of the device telemetry; if omitted, none is collected
+            pool      (ThreadPoolExecutor, optional) : Workers querying the GPUs and resolving the processes
+                                                       concurrently; if omitted, one after the other
+            tracker   (ProcessTracker, optional)     : GPU processes followed across queries, only the new ones are
+                                                       inspected; if omitted, every process is inspected
+        Returns:
+        GPUStat Object : Statistics and details to account GPU usage by Pods
+        """
+        
+        def query_device(device):
+            """Read the running processes, their utilisation and the telemetry of a GPU: the NVML part of a sample
+            Args:
+                device (GPUDevice) : GPU resolved by the NVML session
+            Returns:
+                query (tuple) : (device, NVML processes or None when not supported, utilisation per pid, telemetry)
+            """
+            start = monotonic()
+
+            # the processes of a MIG device are listed on its GPU, with the instance they run in
+            if device.mig is not None:
+                gpu_telemetry = telemetry.collect(device) if telemetry else {}
+                METRICS.observe("nvml_query", monotonic() - start)
+                return device, None, {}, gpu_telemetry
+
+            # Get running processes in each GPU
+            try:
+                nv_comp_processes = N.nvmlDeviceGetComputeRunningProcesses(device.handle)
+            except N.NVMLError:
+                nv_comp_processes = None  # Not supported
+
+            # Get running graphics processes in each GPU                
+            try:
+                nv_graphics_processes = N.nvmlDeviceGetGraphicsRunningProcesses(device.handle)
+            except N.NVMLError:
+                nv_graphics_processes = None  # Not supported
+
+            # Check if process is found or not
+            if nv_comp_processes is None and nv_graphics_processes is None:
+                nv_processes = None   # Not supported (in both cases)
+            else:
+                nv_processes = (nv_comp_processes or []) + (nv_graphics_processes or [])
+
+            # utilisation of each process since the previous sample, and telemetry of the device
+            utilization   = telemetry.collect_processes(device) if telemetry else {}
+            gpu_telemetry = telemetry.collect(device) if telemetry else {}
+
+            METRICS.observe("nvml_query", monotonic() - start)
+            return device, nv_processes, utilization, gpu_telemetry
+
+        def benchmark_gpu(devices):
+            """Query all utilizations in each GPU and resolve them to pod information and identity
+            The GPUs are queried concurrently, then every distinct pid is resolved concurrently, and both
+            are merged into one result; the sample takes about as long as the slowest GPU.
+            Args:
+                devices (list of GPUDevice) : GPUs resolved by the NVML session
+            """
+            run     = pool.map if pool is not None else map
+
+            # NVML queries of each GPU
+            queries = list(run(query_device, devices))
+
+            # a process using several GPUs is inspected and resolved to its pod only once
+            pids     = []
+            for _, nv_processes, _, _ in queries:
+                for nv_process in (nv_processes or []):
+                    if nv_process.pid not in pids:
+                        pids.append(nv_process.pid)
+            resolved = tracker.update(pids, run)
+
+            # Init empty list to store usage by each GPU, and by each MIG device
+            gpus_usage   = []
+            by_device    = {}
+            for device, _, _, gpu_telemetry in queries:
+                mig = device.mig
+                by_device[device.uuid] = GPUSnapshot(device.index, device.name,
+                                                     mig.parent_uuid if mig is not None else device.uuid, (),
+                                                     gpu_telemetry, mig)
+                gpus_usage.append(by_device[device.uuid])
+
+            # merge the processes of each GPU with their pod
+            for device, nv_processes, utilization, _ in queries:
+                # iterate throught the process (container) and find corresponding pod that run the process
+                for nv_process in (nv_processes or []):
+                    process = resolved[nv_process.pid]
+                    if process is None:
+                        continue
+                    # a process of a GPU in MIG mode is accounted in its MIG device
+                    owner   = session.instance(device, nv_process)
+                    pod     = process.pod
+                    if pod is None or not pod.container_name:
+                        # the container the kubelet allocated the GPU (or MIG device) to, when the process cannot tell
+                        pod = pod_index.assignment(owner.uuid) or pod
+                    if pod is None:
+                        continue
+                    # the pod and the username are shared with the other GPUs of the process, not copied;
+                    # the utilisation is the SM, memory, encoder and decoder percent when NVML sampled the process;
+                    # NVML may not know the memory of a process in a MIG device without the right privileges
+                    by_device[owner.uuid].processes.append(
+                        ProcessUsage(nv_process.pid,
+                                     process.username,
+                                     int((nv_process.usedGpuMemory or 0) / 1024 / 1024), # Bytes to MBytes
+                                     pod,
+                                     utilization.get(nv_process.pid)))
+
+            return gpus_usage
+        
+        # init the python-nvml driver, unless the caller keeps a session open across queries
+        own_session = session is None
+        if own_session:
+            session = NVMLSession()
+            session.open()
+
+        own_pod_index = pod_index is None
+        if own_pod_index:
+            pod_index = PodIndex(new_runtime_client())
+
+        # a tracker of this query only: every process is new
+        if tracker is None:
+            tracker = ProcessTracker(pod_index)
+
+        # the MIG devices are enumerated again once a sample found them reconfigured, or on SIGHUP
+        if session.stale:
+            LOGGER.info("MIG configuration changed, enumerating the GPUs again")
+            session.enumerate()
+
+        try:
+            # get current utilization in each GPU and corresponding pods details
+            start          = monotonic()
+            gpus_pod_usage = benchmark_gpu(session.devices)
+            METRICS.observe("sample", monotonic() - start)
+        finally:
+            # close the python-nvml driver
+            if own_session:
+                session.close()
+            if own_pod_index:
+                pod_index.runtime_client.close()
+
+        # return query result as GPUStat object
+        return GPUStat(gpus_pod_usage)        
+
+
+# --------- Class DeltaFilter : only write the fields that changed since they were last written -------- #
+class DeltaFilter(object):
+    # Measurement of the pod start/stop events, with the tags of the gpu/usage point and an "event" field
+    EVENT_MEASUREMENT = "gpu/pod_event"
+
+    # Samples in a row a series must be missing from before it is forgotten (and a gpu/usage one reported stopped):
+    # a pod missing from a single sample, e.g. while its container is resolved again, keeps its series
+    STOP_MISSING_SAMPLES = 2
+
+    def __init__(self, deadband=AGENT_DEFAULTS["delta_deadband"], heartbeat=AGENT_DEFAULTS["delta_heartbeat"]):
+        """Constructor of DeltaFilter class
+        The state of the filter follows the points it returned, it is only final once they are written: commit()
+        is called after a successful flush or once they are spooled, rollback() when they are dropped instead.
+        Args:
+            deadband  (float) : Relative change of a numeric field (fraction of the value last written) below which
+                                the field is not written again, 0 writes any change
+            heartbeat (float) : Seconds after which every field of a series is written again, even unchanged
+        Fields:
+            last        (py dictionary) : (fields written, time of the last full write) keyed by (measurement, tags)
+            missing     (py dictionary) : Samples in a row a series of last was missing from, by (measurement, tags)
+            primed      (bool)          : A first sample was filtered, the pods seen afterwards are new ones
+            undo        (py dictionary) : (last, missing) of each series changed since the last commit, None when
+                                          unknown then
+            undo_primed (bool)          : primed at the last commit, None when no sample was filtered since
+        """
+        self.deadband    = float(deadband)
+        self.heartbeat   = float(heartbeat)
+        self.last        = {}
+        self.missing     = {}
+        self.primed      = False
+        self.undo        = {}
+        self.undo_primed = None
+        # the exporter thread encodes the samples, the main thread may encode the queue left at shutdown
+        self.lock        = threading.Lock()
+
+    def changed(self, previous, value):
+        """Whether a field moved out of the deadband around the value last written"""
+        numeric = (int, float)
+        if isinstance(value, bool) or not isinstance(value, numeric) or not isinstance(previous, numeric):
+            return value != previous
+
+        return abs(value - previous) > self.deadband * abs(previous) if self.deadband else value != previous
+
+    def journal(self, key):
+        """Keep the state of a series as of the last commit, before the first change since"""
+        if key not in self.undo:
+            self.undo[key] = (self.last.get(key), self.missing.get(key))
+
+    def filter(self, points, timestamp):
+        """Reduce the points of a sample to the fields that changed
+        A series seen for the first time, or not fully written for heartbeat seconds, is written with all its
+        fields. A gpu/usage series appearing, or missing from STOP_MISSING_SAMPLES samples in a row, also writes
+        a start or stop event.
+        Args:
+            points    (list of tuple) : (measurement, tags, fields) of a sample
+            timestamp (float)         : Time of the sample, in seconds since epoch
+        Returns:
+            points (list of tuple) : (measurement, tags, fields) to write
+        """
+        changed = []
+        seen    = set()
+
+        with self.lock:
+            if self.undo_primed is None:
+                self.undo_primed = self.primed
+
+            for measurement, tags, fields in points:
+                key  = (measurement, tuple(sorted(tags.items())))
+                last = self.last.get(key)
+                seen.add(key)
+                if key in self.missing:
+                    self.journal(key)
+                    del self.missing[key]
+
+                if last is None or timestamp - last[1] >= self.heartbeat:
+                    self.journal(key)
+                    self.last[key] = (dict(fields), timestamp)
+                    changed.append((measurement, tags, fields))
+                    if last is None and self.primed and measurement == "gpu/usage":
+                        changed.append((self.EVENT_MEASUREMENT, tags, {"event": "start"}))
+                    continue
+
+                written = last[0]
+                delta   = dict((field, value) for field, value in fields.items()
+                               if field not in written or self.changed(written[field], value))
+                if delta:
+                    # a new dictionary, the one of the last commit is kept by the journal
+                    self.journal(key)
+                    written = dict(written)
+                    written.update(delta)
+                    self.last[key] = (written, last[1])
+                    changed.append((measurement, tags, delta))
+
+            # series gone since the previous samples: the pod's container stopped using the GPU
+            for key in set(self.last) - seen:
+                self.journal(key)
+                missing = self.missing.get(key, 0) + 1
+                if missing < self.STOP_MISSING_SAMPLES:
+                    self.missing[key] = missing
+                    continue
+
+                measurement, tags = key
+                if measurement == "gpu/usage":
+                    changed.append((self.EVENT_MEASUREMENT, dict(tags), {"event": "stop"}))
+                del self.last[key]
+                self.missing.pop(key, None)
+
+            self.primed = True
+
+        return changed
+
+    def commit(self):
+        """Make the state of the points filtered since the last commit final, once they are written"""
+        with self.lock:
+            self.undo.clear()
+            self.undo_primed = None
+
+    def rollback(self):
+        """Restore the state of the last commit, the points filtered since were not written
+        The fields they changed are written again by the next sample, as are the series they started or stopped.
+        """
+        with self.lock:
+            for key, (last, missing) in self.undo.items():
+                if last is None:
+                    self.last.pop(key, None)
+                else:
+                    self.last[key] = last
+                if missing is None:
+                    self.missing.pop(key, None)
+                else:
+                    self.missing[key] = missing
+            if self.undo_primed is not None:
+                self.primed = self.undo_primed
+            self.undo.clear()
+            self.undo_primed = None
+
+
+def new_delta_filter(agent_cfg):
+    """Create the change detection of the exported points from the agent options
+    Returns:
+        delta (DeltaFilter) : Filter of the points, None when delta_export is disabled
+    """
+    if not agent_cfg["delta_export"]:
+        return None
+
+    return DeltaFilter(agent_cfg["delta_deadband"], agent_cfg["delta_heartbeat"])
+
+
+# --------- Class RollupSeries : fixed-size ring of the values of one field over the current window -------- #
+class RollupSeries(object):
+    __slots__ = ("ring", "head", "count", "total", "minimum", "maximum", "last")
+
+    def __init__(self, capacity):
+        """Constructor of RollupSeries class
+        Args:
+            capacity (int) : Number of values kept for the quantiles, the newest ones when the window has more
+        Fields:
+            ring    (array of double) : Values of the window, preallocated and overwritten in place
+            head    (int)             : Index of the next value in the ring
+            count   (int)             : Values added in the window, min, max, mean and last account all of them
+        """
+        self.ring = array.array("d", bytes(8 * max(1, int(capacity))))
+        self.reset()
+
+    def reset(self):
+        self.head    = 0
+        self.count   = 0
+        self.total   = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.last    = None
+
+    def add(self, value):
+        value                = float(value)
+        self.ring[self.head] = value
+        self.head            = (self.head + 1) % len(self.ring)
+        self.count          += 1
+        self.total          += value
+        self.minimum         = value if self.minimum is None else min(self.minimum, value)
+        self.maximum         = value if self.maximum is None else max(self.maximum, value)
+        self.last            = value
+
+    def quantiles(self, quantiles):
+        """Nearest-rank quantiles of the values in the ring
+        Args:
+            quantiles (list of float) : Quantiles between 0 and 1
+        Returns:
+            values (list of float) : Value of each quantile
+        """
+        values = sorted(self.ring[:self.count] if self.count < len(self.ring) else self.ring)
+        return [values[max(0, min(len(values) - 1, int(math.ceil(q * len(values))) - 1))] for q in quantiles]
+
+
+# Aggregates of a rollup window, exported instead of the raw snapshots: a list of (measurement, tags, fields)
+RollupSnapshot = namedtuple("RollupSnapshot", ["hostname", "query_time", "points"])
+
+# Points of NVML events, exported as they happen instead of with the next sample
+EventSnapshot  = namedtuple("EventSnapshot", ["hostname", "query_time", "points"])
+
+
+# --------- Class Rollup : aggregate the snapshots per pod and per GPU over fixed windows -------- #
+class Rollup(object):
+    def __init__(self, window, quantiles=AGENT_DEFAULTS["rollup_quantiles"],
+                 capacity=AGENT_DEFAULTS["rollup_capacity"]):
+        """Constructor of Rollup class
+        Args:
+            window    (float)          : Length of a window in seconds, windows are aligned on multiples of it
+            quantiles (list of float)  : Quantiles computed for each field, between 0 and 1
+            capacity  (int)            : Values kept per field and window for the quantiles
+        Fields:
+            series  (py dictionary) : (tags, RollupSeries per field) keyed by (measurement, tags); series are reused
+                                      from window to window and forgotten once a window did not see them
+            current (int)           : Number of the current window since epoch, None before the first snapshot
+        """
+        for quantile in quantiles:
+            if not 0 <= quantile <= 1:
+                raise ValueError("rollup_quantiles must be between 0 and 1, got %r" % quantile)
+
+        self.window    = float(window)
+        self.quantiles = list(quantiles)
+        self.capacity  = int(capacity)
+        self.series    = {}
+        self.current   = None
+        self.hostname  = None
+
+    def add(self, gpu_stats):
+        """Account a snapshot in its window
+        Args:
+            gpu_stats (GPUStat Obj) : Statistics and details to account GPU usage by Pods.
+        Returns:
+            rollup (RollupSnapshot) : Aggregates of the previous window when the snapshot starts a new one, else None
+        """
+        window = int(gpu_stats.query_time.timestamp() // self.window)
+        rollup = None
+        if self.current is not None and window != self.current:
+            rollup = self.flush()
+
+        self.current  = window
+        self.hostname = gpu_stats.hostname
+        for measurement, tags, fields in ExportDriver.points(gpu_stats):
+            key = (measurement, tuple(sorted(tags.items())))
+            if key not in self.series:
+                self.series[key] = (tags, {})
+            series = self.series[key][1]
+
+            for field, value in fields.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if field not in series:
+                    series[field] = RollupSeries(self.capacity)
+                series[field].add(value)
+
+        return rollup
+
+    def flush(self):
+        """Aggregate the current window and start a new one
+        Returns:
+            rollup (RollupSnapshot) : min, max, mean, last and quantiles of every field, None if nothing was accounted
+        """
+        if self.current is None:
+            return None
+
+        points = []
+        for key in list(self.series):
+            measurement = key[0]
+            tags, series = self.series[key]
+
+            fields = {}
+            for field, values in series.items():
+                if not values.count:
+                    continue
+                fields[field + "_min"]  = values.minimum
+                fields[field + "_max"]  = values.maximum
+                fields[field + "_mean"] = values.total / values.count
+                fields[field + "_last"] = values.last
+                for quantile, value in zip(self.quantiles, values.quantiles(self.quantiles)):
+                    fields["%s_p%g" % (field, quantile * 100)] = value
+                fields["samples"] = max(fields.get("samples", 0), values.count)
+                values.reset()
+
+            # not seen during the window: the pod or the GPU is gone
+            if not fields:
+                del self.series[key]
+                continue
+            points.append((measurement, tags, fields))
+
+        rollup       = RollupSnapshot(self.hostname, datetime.fromtimestamp(self.current * self.window), points)
+        self.current = None
+        return rollup if points else None
+
+
+def new_rollup(agent_cfg):
+    """Create the on-node aggregation from the agent options
+    Returns:
+        rollup (Rollup) : Aggregation over rollup_window seconds, None to export every snapshot
+    """
+    if not agent_cfg["rollup_window"]:
+        return None
+
+    return Rollup(agent_cfg["rollup_window"], agent_cfg["rollup_quantiles"], agent_cfg["rollup_capacity"])
+
+
+# --------- Class RingStore : recent samples of each GPU and pod in a fixed-size memory-mapped file -------- #
+class RingStore(object):
+    def __init__(self, path, series=AGENT_DEFAULTS["ring_store_series"], records=AGENT_DEFAULTS["ring_store_records"],
+                 readonly=False):
+        """Constructor of RingStore class
+        Each series (a GPU, or a pod on a GPU) has its own ring of fixed-size records, oldest overwritten first, so
+        the file never grows and reading a GPU or a pod only touches the pages of its series. Records are in time
+        order within a ring, a time range is found by bisection: a record is never stamped earlier than the last one
+        of its series, a clock stepped backwards (NTP) repeats that time until it catches up rather than breaking the
+        order. The file outlives the agent: a restarted agent appends to the series it finds, a file of another
+        geometry is reset.
+        Args:
+            path     (string) : File of the store, created sparse
+            series   (int)    : Number of series kept, the one written the longest ago is replaced by a new one
+            records  (int)    : Records kept per series, 86400 is a day of samples every second
+            readonly (bool)   : Open an existing store for queries, its geometry is read from the file
+        Fields:
+            map    (mmap.mmap)     : Mapping of the whole file
+            slots  (py dictionary) : Directory entry of each series, by (kind, key)
+        """
+        self.path     = path
+        self.readonly = readonly
+        self.map      = None
+
+        fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR | os.O_CREAT, 0o640)
+        try:
+            header = os.pread(fd, RING_STORE_HEADER.size, 0)
+            if len(header) == RING_STORE_HEADER.size:
+                magic, version, stored_series, stored_records = RING_STORE_HEADER.unpack(header)
+            else:
+                magic, version, stored_series, stored_records = b"", 0, 0, 0
+
+            if readonly:
+                if magic != RING_STORE_MAGIC or version != RING_STORE_VERSION:
+                    raise ValueError("%s is not a ring store of this agent" % path)
+                series, records = stored_series, stored_records
+            elif (magic, version, stored_series, stored_records) != (RING_STORE_MAGIC, RING_STORE_VERSION,
+                                                                     series, records):
+                if magic:
+                    LOGGER.warning("Ring store %s has another geometry, starting it over", path)
+                os.ftruncate(fd, 0)
+
+            self.series      = int(series)
+            self.records     = int(records)
+            self.data_offset = -(-(RING_STORE_HEADER.size + self.series * RING_STORE_ENTRY.size) // mmap.PAGESIZE) * \
+                mmap.PAGESIZE
+            size             = self.data_offset + self.series * self.records * RING_STORE_RECORD.size
+
+            if readonly:
+                self.map = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+            else:
+                os.ftruncate(fd, size)
+                self.map = mmap.mmap(fd, size)
+                RING_STORE_HEADER.pack_into(self.map, 0, RING_STORE_MAGIC, RING_STORE_VERSION, self.series,
+                                            self.records)
+        finally:
+            os.close(fd)
+
+        self.slots = {}
+        for slot in range(self.series):
+            kind, _, count, _, key = self.entry(slot)
+            if count:
+                self.slots[(kind, key)] = slot
+
+    def entry(self, slot):
+        """Directory entry of a series
+        Returns:
+            entry (tuple) : (kind, index of the next record, records written, time of the last record, key)
+        """
+        kind, head, count, last, key = RING_STORE_ENTRY.unpack_from(
+            self.map, RING_STORE_HEADER.size + slot * RING_STORE_ENTRY.size)
+        return kind, head, count, last, key.rstrip(b"\0").decode("utf-8", "ignore")
+
+    def record(self, slot, index):
+        """Record at index of the ring of a series: (time, value, ...)"""
+        return RING_STORE_RECORD.unpack_from(
+            self.map, self.data_offset + (slot * self.records + index) * RING_STORE_RECORD.size)
+
+    def write(self, kind, key, timestamp, values):
+        """Append a record to a series, the series is created when new
+        Args:
+            kind      (int)           : RING_STORE_GPU or RING_STORE_POD
+            key       (string)        : Identity of the series, tab separated
+            timestamp (float)         : Epoch time of the sample, clamped to the time of the last record of the series
+            values    (list of float) : Values of RING_STORE_FIELDS[kind]
+        """
+        # the key as found in the directory once truncated to its entry
+        key  = key.encode("utf-8")[:RING_STORE_ENTRY.size - 20].decode("utf-8", "ignore")
+        slot = self.slots.get((kind, key))
+        if slot is None:
+            # a free entry, else the series written the longest ago, unless it was written by this very sample
+            entries = [self.entry(slot) for slot in range(self.series)]
+            slot    = min(range(self.series), key=lambda slot: (entries[slot][2] != 0, entries[slot][3]))
+            if entries[slot][2]:
+                if entries[slot][3] >= timestamp:
+                    LOGGER.debug("Ring store full, series %s not kept", key.replace("\t", " "))
+                    return
+                del self.slots[(entries[slot][0], entries[slot][4])]
+            self.slots[(kind, key)] = slot
+            head, count = 0, 0
+        else:
+            _, head, count, last, _ = self.entry(slot)
+            # the ring stays in time order for the bisection of query() when the clock steps backwards
+            timestamp = max(timestamp, last)
+
+        # the record first, a reader never sees an entry pointing to a record not written yet
+        RING_STORE_RECORD.pack_into(self.map, self.data_offset + (slot * self.records + head) * RING_STORE_RECORD.size,
+                                    timestamp, *values)
+        RING_STORE_ENTRY.pack_into(self.map, RING_STORE_HEADER.size + slot * RING_STORE_ENTRY.size, kind,
+                                   (head + 1) % self.records, min(count + 1, self.records), timestamp,
+                                   key.encode("utf-8"))
+
+    def append(self, gpu_stats):
+        """Write a sample: one record for each GPU, and for each pod on each GPU
+        Args:
+            gpu_stats (GPUStat) : Sample of the daemon
+        """
+        timestamp = gpu_stats.query_time.timestamp()
+        nan       = float("nan")
+
+        for gpu in gpu_stats.gpus_pod_usage:
+            values = []
+            for _, metric, scale in RING_STORE_FIELDS[RING_STORE_GPU]:
+                value = gpu.telemetry.get(metric)
+                values.append(value * scale if value is not None else nan)
+            # a MIG device is a series of its own
+            uuid = gpu.mig.uuid if gpu.mig is not None else gpu.uuid
+            self.write(RING_STORE_GPU, "%s\t%d" % (uuid, gpu.index), timestamp, values)
+
+            # the processes of a container on the GPU add up
+            pods = {}
+            for process in gpu.processes:
+                pod    = process.pod
+                key    = "%s\t%d\t%s\t%s\t%s" % (uuid, gpu.index, pod.namespace, pod.name, pod.container_name)
+                values = pods.setdefault(key, [nan] * len(RING_STORE_FIELDS[RING_STORE_POD]))
+                for position, (_, index, _) in enumerate(RING_STORE_FIELDS[RING_STORE_POD]):
+                    if index is None:
+                        value = process.memory
+                    elif process.utilization is not None:
+                        value = process.utilization[index]
+                    else:
+                        continue
+                    values[position] = value if math.isnan(values[position]) else values[position] + value
+            for key, values in pods.items():
+                self.write(RING_STORE_POD, key, timestamp, values)
+
+    def query(self, gpu=None, pod=None, since=None, until=None):
+        """Records of the series matching a GPU and a pod, within a time range
+        Only the directory, a bisection of each matching ring and the records in the range are read from the file.
+        Args:
+            gpu   (string) : Index or uuid (or a prefix of it) of the GPU, None for all of them
+            pod   (string) : Pattern of the pod name or namespace/name (fnmatch), None for the GPUs and every pod
+            since (float)  : Epoch time of the first record, None for the oldest
+            until (float)  : Epoch time of the last record, None for the newest
+        Returns:
+            records (list of tuple) : (time, kind, key fields, values) in time order
+        """
+        from fnmatch import fnmatchcase
+
+        matches = []
+        for slot in range(self.series):
+            kind, head, count, _, key = self.entry(slot)
+            if not count:
+                continue
+            fields = key.split("\t")
+            if gpu is not None and gpu != fields[1] and not fields[0].startswith(gpu):
+                continue
+            if pod is not None and (kind != RING_STORE_POD or not (
+                    fnmatchcase(fields[3], pod) or fnmatchcase("%s/%s" % (fields[2], fields[3]), pod))):
+                continue
+            matches.append((slot, kind, head, count, tuple(fields)))
+
+        records = []
+        for slot, kind, head, count, fields in matches:
+            oldest = (head - count) % self.records
+
+            def time_at(position):
+                return self.record(slot, (oldest + position) % self.records)[0]
+
+            # first record at or after since: the records of a ring are in time order from the oldest
+            low, high = 0, count
+            while since is not None and low < high:
+                middle = (low + high) // 2
+                if time_at(middle) < since:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            for position in range(low, count):
+                record = self.record(slot, (oldest + position) % self.records)
+                if until is not None and record[0] > until:
+                    break
+                records.append((record[0], kind, fields, record[1:]))
+
+        records.sort(key=lambda record: record[0])
+        return records
+
+    def close(self):
+        if self.map is not None:
+            if not self.readonly:
+                self.map.flush()
+            self.map.close()
+            self.map = None
+
+
+def new_ring_store(agent_cfg):
+    """Create the ring store of the daemon from the agent options
+    Returns:
+        store (RingStore) : Store of the recent samples, None when ring_store_path is empty or cannot be opened
+    """
+    if not agent_cfg["ring_store_path"]:
+        return None
+
+    try:
+        return RingStore(agent_cfg["ring_store_path"], agent_cfg["ring_store_series"], agent_cfg["ring_store_records"])
+    except (IOError, OSError, ValueError) as err:
+        LOGGER.error("Cannot open the ring store %s, not keeping the samples: %s", agent_cfg["ring_store_path"], err)
+        return None
+
+
+# --------- Class ExportDriver : buffering and batching shared by the export sinks -------- #
+class ExportDriver(object):
+    # Name of the backend in the log messages
+    backend = "sink"
+
+    def __init__(self, batch_size=5000, flush_interval=0, delta=None):
+        """Constructor of ExportDriver class
+        A driver turns the snapshots into points, serializes them into records (one string per point, the unit
+        kept in the spool) and sends the buffered records in batches.
+        Args:
+            batch_size     (int)         : Flush as soon as this many records are buffered.
+            flush_interval (float)       : Flush when the oldest buffered record is older than this many seconds,
+                                           0 flushes every sample in a single request.
+            delta          (DeltaFilter) : Only write what changed since it was last written, None to write every
+                                           point of every sample.
+        Fields:
+            buffer       (list of string) : Records waiting for the next flush
+            buffer_since (float)          : monotonic() time the oldest buffered record was added
+        """
+        self.batch_size     = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.delta          = delta
+        self.buffer         = []
+        self.buffer_since   = None
+
+    @staticmethod
+    def points(gpu_stats):
+        """List the points of the gpus' usage statistics
+        Args:
+            gpu_stats (GPUStat Obj) : Statistics and details to account GPU usage by Pods.
+        Returns:
+            points (list of tuple) : (measurement, tags, fields) of one point per pod's container in each GPU,
+                                     of one telemetry point per GPU, and of the agent/health point when attached
+        """
+        # a rollup window is already aggregated into points, and so are events
+        if isinstance(gpu_stats, (RollupSnapshot, EventSnapshot)):
+            return list(gpu_stats.points)
+
+        # get hostname of the query
+        nodename = gpu_stats.hostname
+
+        points   = []
+
+        # iterate though all available GPU in machine
+        for gpu in gpu_stats.gpus_pod_usage:
+            if gpu.telemetry:
+                tags = {
+                    "nodename" : nodename,
+                    "gpu_name" : gpu.name,
+                    "gpu_uuid" : gpu.uuid,
+                    "gpu_index": gpu.index
+                }
+                tags.update(gpu_tags(gpu))
+                points.append(("gpu/telemetry", tags, gpu.telemetry))
+
+            # iterate through all pods' containers in each gpu     
+            for (pod_name, pod_container_name, namespace_name), (pod, fields) in sum_pod_usage(gpu).items():
+                tags = {
+                    "nodename"       : nodename,
+                    "gpu_name"       : gpu.name,
+                    "gpu_uuid"       : gpu.uuid,
+                    "gpu_index"      : gpu.index,
+                    "pod_name"       : pod_name,
+                    "container_name" : pod_container_name,
+                    "namespace_name" : namespace_name
+                }
+                tags.update(gpu_tags(gpu))
+                tags.update(pod_tags(pod))
+                points.append(("gpu/usage", tags, fields))
+
+        # timings and counters of the agent itself
+        if gpu_stats.health is not None:
+            health = gpu_stats.health
+            fields = dict(health.counters)
+            fields.update(health.gauges)
+            for stage, (_, total, count, last) in health.stages.items():
+                fields[stage + "_count"]        = count
+                fields[stage + "_seconds_sum"]  = total
+                fields[stage + "_seconds_last"] = last
+            points.append(("agent/health", {"nodename": nodename}, fields))
+
+        return points
+
+    def encode(self, gpu_stats):
+        """Serialize the gpus' usage statistics into the records of the backend
+        With delta export, only the fields that changed since they were last written are encoded.
+        Args:
+            gpu_stats (GPUStat Obj) : Statistics and details to account GPU usage by Pods.
+        Returns:
+            records (list of string) : One per pod's container in each GPU, per GPU telemetry, per event...
+        """
+        # the timestamp of the query is shared by all points of the sample
+        start      = monotonic()
+        query_time = gpu_stats.query_time.timestamp()
+
+        points     = self.points(gpu_stats)
+        # every event is written, even the same Xid twice in a row
+        if self.delta is not None and not isinstance(gpu_stats, EventSnapshot):
+            points = self.delta.filter(points, query_time)
+
+        records    = self.serialize(points, query_time)
+        METRICS.observe("serialisation", monotonic() - start)
+        return records
+
+    def serialize(self, points, query_time):
+        """Serialize points into records of the backend
+        Args:
+            points     (list of tuple) : (measurement, tags, fields) of each point
+            query_time (float)         : Time of the sample, in seconds since the epoch
+        Returns:
+            records (list of string) : Serialized points
+        """
+        raise NotImplementedError
+
+    def add(self, gpu_stats):
+        """Buffer the gpus' usage statistics until the next flush
+        Args:
+            gpu_stats (GPUStat Obj) : Statistics and details to account GPU usage by Pods.
+        """
+        records = self.encode(gpu_stats)
+        if records and not self.buffer:
+            self.buffer_since = monotonic()
+        self.buffer.extend(records)
+
+    def write(self, gpu_stats):
+        """Buffer the gpus' usage statistics and flush them to the backend when a threshold is reached
+        Args:
+            gpu_stats (GPUStat Obj) : Statistics and details to account GPU usage by Pods.
+        Returns: 
+            None
+        """
+        self.add(gpu_stats)
+
+        # a sample with nothing to write is flushed too, the state of the delta filter is committed
+        if not self.buffer or len(self.buffer) >= self.batch_size or \
+           monotonic() - self.buffer_since >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered records into the backend, batch_size records per request
+        Once they are all written, the state of the delta filter is committed.
+        Raises:
+            ExportError : The records could not be written, those not written are kept in the buffer
+        """
+        while self.buffer:
+            self.send(self.buffer[:self.batch_size])
+            del self.buffer[:self.batch_size]
+        self.buffer_since = None
+        if self.delta is not None:
+            self.delta.commit()
+
+    def send(self, records):
+        """Write records into the backend with a single request
+        Args:
+            records (list of string) : Records serialized by this driver
+        Raises:
+            ExportError : The records could not be written
+        """
+        raise NotImplementedError
+
+    def take(self):
+        """Remove the buffered records from the driver
+        Returns:
+            records (list of string) : Records that were waiting for the next flush
+        """
+        records, self.buffer, self.buffer_since = self.buffer, [], None
+        return records
+
+    def close(self):
+        """Release the connection to the backend, buffered records are flushed by the exporter"""
+        pass
+
+
+def import_influxdb():
+    """Import the influxdb client and the exceptions of its requests, the first time they are needed"""
+    global InfluxDBClient, InfluxDBClientError, InfluxDBServerError, RequestException
+
+    if InfluxDBClient is None:
+        from influxdb import InfluxDBClient
+    if InfluxDBServerError is None:
+        from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+        from requests import RequestException
+
+
+# --------- Class InfluxdbDriver : handle write process of GPU stats into Influxdb server -------- #
+class InfluxDBDriver(ExportDriver):
+    backend = "Influxdb"
+
+    def __init__(self, influxdb_host, influxdb_port, influxdb_user, influxdb_pass, influxdb_db,
+                 influxdb_precision="s", influxdb_gzip=False, influxdb_batch_size=5000, influxdb_flush_interval=0,
+                 influxdb_timeout=10, delta=None, *args):
+        """Constructor of InfluxDBDriver class
+        Args:
+            influxdb_host           (string) : Hostname (URL) of influxdb server, to store the data for.
+            influxdb_port           (string) : Port which infludb server is running on.
+            influxdb_user           (string) : Access username.
+            influxdb_pass           (string) : Access password.
+            influxdb_db             (string) : db name to write the GPU stats for.
+            influxdb_precision      (string) : Precision of the point timestamps, one of INFLUX_PRECISIONS.
+            influxdb_gzip           (bool)   : Compress the body of the write requests.
+            influxdb_batch_size     (int)    : Flush as soon as this many points are buffered.
+            influxdb_flush_interval (float)  : Flush when the oldest buffered point is older than this many seconds,
+                                               0 flushes every sample in a single request.
+            influxdb_timeout        (float)  : Seconds to wait for the server, an unreachable one must not block
+                                               the exporter forever.
+            delta                   (DeltaFilter) : Only write what changed since it was last written, None to
+                                                    write every point of every sample.
+        Fields: 
+            client       (InfluxDBClient) : Connection object for the given Influxdb
+        """
+
+        if influxdb_precision not in INFLUX_PRECISIONS:
+            raise ValueError("influxdb_precision must be one of %s" % ", ".join(sorted(INFLUX_PRECISIONS)))
+
+        # Try connecting to influxdb instance
+        import_influxdb()
+        try:
+            client = InfluxDBClient(influxdb_host,
+                                    influxdb_port,
+                                    influxdb_user,
+                                    influxdb_pass,
+                                    influxdb_db,
+                                    timeout=float(influxdb_timeout)
+                                   )
+        except InfluxDBClientError:
+            client = None
+            LOGGER.error("Influxdb connection does not working") 
+
+        ExportDriver.__init__(self, influxdb_batch_size, influxdb_flush_interval, delta)
+
+        # this->object->client
+        self.client         = client
+        self.database       = influxdb_db
+        self.precision      = influxdb_precision
+        self.gzip           = bool(influxdb_gzip)
+
+    def serialize(self, points, query_time):
+        # points in line protocol, in the precision of this driver
+        timestamp = int(query_time * INFLUX_PRECISIONS[self.precision])
+
+        return [encode_line(measurement, tags, fields, timestamp) for measurement, tags, fields in points]
+
+    def send(self, lines):
+        """Write points in line protocol into influxdb server with a single request
+        Args:
+            lines (list of string) : Points to write, in the precision of this driver
+        Raises:
+            ExportError : The points could not be written
+        """
+        if self.client is None:
+            raise ExportError("Influxdb connection does not working")
+
+        body    = ("\n".join(lines) + "\n").encode("utf-8")
+        headers = {"Content-Type": "application/octet-stream"}
+        if self.gzip:
+            body                        = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        # attempt writing into influxdb
+        start = monotonic()
+        try:
+            self.client.request(url="write",
+                                method="POST",
+                                params={"db": self.database, "precision": self.precision},
+                                data=body,
+                                expected_response_code=204,
+                                headers=headers)
+        except (InfluxDBClientError, InfluxDBServerError, RequestException, IOError) as err:
+            raise ExportError("Cannot write %d point(s) into influxdb: %s" % (len(lines), err))
+        finally:
+            METRICS.observe("write", monotonic() - start)
+
+    def close(self):
+        """Release the HTTP session held by the influxdb client, buffered points are flushed by the exporter"""
+        if self.client is not None and hasattr(self.client, "close"):
+            self.client.close()
+
+
+# --------- Class HTTPEndpoint : kept-alive HTTP(S) connection posting to a single URL -------- #
+class HTTPEndpoint(object):
+    def __init__(self, url, timeout=10):
+        """Constructor of HTTPEndpoint class
+        Args:
+            url     (string) : http(s) URL the requests are posted to
+            timeout (float)  : Socket timeout in seconds
+        Fields:
+            connection (HTTPConnection) : Keep-alive connection reused by every request
+        """
+        self.url = urllib.parse.urlsplit(url)
+        if self.url.scheme not in ("http", "https"):
+            raise ValueError("Expected an http(s) URL, got %r" % url)
+
+        self.timeout    = float(timeout)
+        self.connection = None
+
+    def post(self, body, headers, query=""):
+        """POST a body on the kept-alive connection, re-opened once if the server closed it since the previous one
+        Returns:
+            response (tuple) : (HTTP status, body of the answer)
+        Raises:
+            ExportError : The server cannot be reached
+        """
+        path = (self.url.path or "/") + ("?" + query if query else "")
+        for attempt in (1, 2):
+            if self.connection is None:
+                if self.url.scheme == "https":
+                    self.connection = http.client.HTTPSConnection(self.url.hostname, self.url.port,
+                                                                  timeout=self.timeout)
+                else:
+                    self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port,
+                                                                 timeout=self.timeout)
+            try:
+                self.connection.request("POST", path, body, headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, socket.error) as err:
+                self.close()
+                if attempt == 2:
+                    raise ExportError("Cannot reach %s: %s" % (self.url.netloc, err))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def new_influxdb_driver(host="localhost", port=8086, user="root", password="root", db="k8s", precision="s",
+                        gzip=False, batch_size=5000, flush_interval=0, timeout=10, delta=None):
+    """Create the driver of an influxdb (1.x) sink of the sinks list, the options are those of InfluxDBDriver
+    without their influxdb_ prefix
+    Returns:
+        driver (InfluxDBDriver) : Driver of the sink
+    """
+    return InfluxDBDriver(host, port, user, password, db, precision, gzip, batch_size, flush_interval, timeout, delta)
+
+
+# --------- Class InfluxDB2Driver : write line protocol into the v2 API of InfluxDB 2.x/3.x -------- #
+class InfluxDB2Driver(InfluxDBDriver):
+    def __init__(self, url="http://localhost:8086", org="", bucket="k8s", token="", precision="s", gzip=False,
+                 batch_size=5000, flush_interval=0, timeout=10, delta=None):
+        """Constructor of InfluxDB2Driver class
+        Args:
+            url            (string)      : Base URL of the server
+            org            (string)      : Organization of the bucket
+            bucket         (string)      : Bucket to write the GPU stats into
+            token          (string)      : API token allowed to write into the bucket
+            precision      (string)      : Precision of the point timestamps, one of INFLUX_PRECISIONS
+            gzip           (bool)        : Compress the body of the write requests
+            batch_size     (int)         : Flush as soon as this many points are buffered
+            flush_interval (float)       : Flush when the oldest buffered point is older than this many seconds
+            timeout        (float)       : Seconds to wait for the server
+            delta          (DeltaFilter) : Only write what changed since it was last written, None to write all
+        """
+        if precision not in INFLUX_PRECISIONS:
+            raise ValueError("precision must be one of %s" % ", ".join(sorted(INFLUX_PRECISIONS)))
+
+        ExportDriver.__init__(self, batch_size, flush_interval, delta)
+        self.endpoint  = HTTPEndpoint(url.rstrip("/") + "/api/v2/write", timeout)
+        # the v2 API spells microseconds "us"
+        self.query     = urllib.parse.urlencode({"org": org, "bucket": bucket,
+                                                 "precision": "us" if precision == "u" else precision})
+        self.token     = token
+        self.precision = precision
+        self.gzip      = bool(gzip)
+
+    def send(self, lines):
+        body    = ("\n".join(lines) + "\n").encode("utf-8")
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if self.token:
+            headers["Authorization"] = "Token " + self.token
+        if self.gzip:
+            body                        = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        start = monotonic()
+        try:
+            status, answer = self.endpoint.post(body, headers, self.query)
+        finally:
+            METRICS.observe("write", monotonic() - start)
+        if status != 204:
+            raise ExportError("Cannot write %d point(s) into influxdb: %d %s"
+                              % (len(lines), status, answer[:200].decode("utf-8", "replace")))
+
+    def close(self):
+        self.endpoint.close()
+
+
+# --------- Class OTLPDriver : push the points as OpenTelemetry gauges over OTLP/HTTP (JSON encoding) -------- #
+class OTLPDriver(ExportDriver):
+    backend = "OTLP collector"
+
+    # ExportMetricsServiceRequest around the metrics of a batch, the tags of each point are its attributes
+    REQUEST = ('{"resourceMetrics":[{"resource":{"attributes":[{"key":"service.name","value":'
+               '{"stringValue":"nvml-agent"}}]},"scopeMetrics":[{"scope":{"name":"nvml-agent"},"metrics":[%s]}]}]}')
+
+    def __init__(self, endpoint="http://localhost:4318/v1/metrics", headers=None, gzip=False, batch_size=5000,
+                 flush_interval=0, timeout=10, delta=None):
+        """Constructor of OTLPDriver class
+        Args:
+            endpoint       (string)        : Metrics URL of the OTLP/HTTP receiver
+            headers        (py dictionary) : Extra headers of each request, e.g. authentication
+            gzip           (bool)          : Compress the body of the requests
+            batch_size     (int)           : Flush as soon as this many gauges are buffered
+            flush_interval (float)         : Flush when the oldest buffered gauge is older than this many seconds
+            timeout        (float)         : Seconds to wait for the receiver
+            delta          (DeltaFilter)   : Only write what changed since it was last written, None to write all
+        """
+        ExportDriver.__init__(self, batch_size, flush_interval, delta)
+        self.endpoint = HTTPEndpoint(endpoint, timeout)
+        self.headers  = dict(headers or {}, **{"Content-Type": "application/json"})
+        self.gzip     = bool(gzip)
+
+    def serialize(self, points, query_time):
+        # one gauge per field, named <measurement>.<field> with / replaced by dots, e.g. gpu.usage.value
+        time_unix_nano = str(int(query_time * 10 ** 9))
+        records        = []
+        for measurement, tags, fields in points:
+            attributes = [{"key": key, "value": {"stringValue": str(tags[key])}}
+                          for key in sorted(tags) if tags[key] != ""]
+            prefix     = measurement.replace("/", ".") + "."
+            for key in sorted(fields):
+                value = fields[key]
+                if isinstance(value, (bool, int)):
+                    data_point = {"asInt": str(int(value))}
+                elif isinstance(value, float) and math.isfinite(value):
+                    data_point = {"asDouble": value}
+                else:
+                    continue
+                data_point["timeUnixNano"] = time_unix_nano
+                data_point["attributes"]   = attributes
+                records.append(json.dumps({"name": prefix + key, "gauge": {"dataPoints": [data_point]}},
+                                          separators=(",", ":")))
+
+        return records
+
+    def send(self, records):
+        body    = (self.REQUEST % ",".join(records)).encode("utf-8")
+        headers = self.headers
+        if self.gzip:
+            body    = gzip.compress(body)
+            headers = dict(headers, **{"Content-Encoding": "gzip"})
+
+        start = monotonic()
+        try:
+            status, answer = self.endpoint.post(body, headers)
+        finally:
+            METRICS.observe("write", monotonic() - start)
+        if status != 200:
+            raise ExportError("Cannot write %d gauge(s) into the OTLP collector: %d %s"
+                              % (len(records), status, answer[:200].decode("utf-8", "replace")))
+
+    def close(self):
+        self.endpoint.close()
+
+
+# --------- Class StatsdDriver : send the points as statsd gauges over UDP -------- #
+class StatsdDriver(ExportDriver):
+    backend = "statsd"
+
+    # Characters with a meaning in the statsd (and DogStatsD tags) format, replaced in names and tags
+    RESERVED_RE = re.compile(r"[:|@,#\s]")
+
+    def __init__(self, host="127.0.0.1", port=8125, prefix="nvml", max_packet=1432, batch_size=5000,
+                 flush_interval=0, delta=None):
+        """Constructor of StatsdDriver class
+        Args:
+            host           (string)      : Host of the statsd server
+            port           (int)         : UDP port of the statsd server
+            prefix         (string)      : Prefix of the metric names, empty for none
+            max_packet     (int)         : Size in bytes of the largest datagram, 1432 fits an ethernet MTU
+            batch_size     (int)         : Flush as soon as this many gauges are buffered
+            flush_interval (float)       : Flush when the oldest buffered gauge is older than this many seconds
+            delta          (DeltaFilter) : Only write what changed since it was last written, None to write all
+        Fields:
+            sock (socket) : UDP socket, opened by the first send once the host is resolved
+        """
+        ExportDriver.__init__(self, batch_size, flush_interval, delta)
+        self.host       = host
+        self.port       = int(port)
+        self.prefix     = prefix + "." if prefix else ""
+        self.max_packet = int(max_packet)
+        self.sock       = None
+        self.address    = None
+
+    def serialize(self, points, query_time):
+        # <prefix>.<measurement>.<field>:<value>|g|#tag:value,... (DogStatsD tags, understood by telegraf too)
+        records = []
+        for measurement, tags, fields in points:
+            name     = self.prefix + measurement.replace("/", ".") + "."
+            tag_list = ",".join("%s:%s" % (self.RESERVED_RE.sub("_", key), self.RESERVED_RE.sub("_", str(tags[key])))
+                                for key in sorted(tags) if tags[key] != "")
+            suffix   = "|g|#" + tag_list if tag_list else "|g"
+            for key in sorted(fields):
+                value = fields[key]
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    continue
+                metric = self.RESERVED_RE.sub("_", name + key)
+                record = "%s:%s%s" % (metric, repr(value) if isinstance(value, float) else value, suffix)
+                # a signed value changes a gauge instead of setting it: reset it first
+                if value < 0:
+                    record = "%s:0%s\n%s" % (metric, suffix, record)
+                records.append(record)
+
+        return records
+
+    def send(self, records):
+        start = monotonic()
+        try:
+            if self.sock is None:
+                family, _, _, _, self.address = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_DGRAM)[0]
+                self.sock                     = socket.socket(family, socket.SOCK_DGRAM)
+
+            # as many records per datagram as fit in max_packet bytes
+            packet = b""
+            for record in records:
+                record = record.encode("utf-8")
+                if packet and len(packet) + 1 + len(record) > self.max_packet:
+                    self.sock.sendto(packet, self.address)
+                    packet = b""
+                packet = packet + b"\n" + record if packet else record
+            if packet:
+                self.sock.sendto(packet, self.address)
+        except socket.error as err:
+            self.close()
+            raise ExportError("Cannot send %d gauge(s) to statsd: %s" % (len(records), err))
+        finally:
+            METRICS.observe("write", monotonic() - start)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+# --------- Class FileDriver : append the points to a local, size-rotated NDJSON file -------- #
+class FileDriver(ExportDriver):
+    backend = "file"
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=3, batch_size=5000, flush_interval=0, delta=None):
+        """Constructor of FileDriver class
+        Each point is a JSON object on its own line: {"time": <epoch seconds>, "measurement", "tags", "fields"}.
+        Args:
+            path           (string)      : File the points are appended to
+            max_bytes      (int)         : Size above which the file is rotated to <path>.1, <path>.1 to <path>.2...
+            backups        (int)         : Rotated files kept, 0 to truncate the file instead
+            batch_size     (int)         : Flush as soon as this many points are buffered
+            flush_interval (float)       : Flush when the oldest buffered point is older than this many seconds
+            delta          (DeltaFilter) : Only write what changed since it was last written, None to write all
+        """
+        ExportDriver.__init__(self, batch_size, flush_interval, delta)
+        self.path      = path
+        self.max_bytes = int(max_bytes)
+        self.backups   = int(backups)
+
+    def serialize(self, points, query_time):
+        return [json.dumps({"time": query_time, "measurement": measurement, "tags": tags, "fields": fields},
+                           sort_keys=True, separators=(",", ":"))
+                for measurement, tags, fields in points]
+
+    def rotate(self):
+        """Shift <path> to <path>.1, <path>.1 to <path>.2..., the oldest backup is overwritten"""
+        for backup in range(self.backups - 1, 0, -1):
+            if os.path.exists("%s.%d" % (self.path, backup)):
+                os.replace("%s.%d" % (self.path, backup), "%s.%d" % (self.path, backup + 1))
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+
+    def send(self, records):
+        start = monotonic()
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self.rotate()
+            with open(self.path, "a") as ndjson:
+                ndjson.write("\n".join(records) + "\n")
+        except (IOError, OSError) as err:
+            raise ExportError("Cannot write %d point(s) into %s: %s" % (len(records), self.path, err))
+        finally:
+            METRICS.observe("write", monotonic() - start)
+
+
+# Backends selectable with type in the sinks list of conf.yaml, called with the other keys of the sink
+SINK_DRIVERS = {
+    "influxdb" : new_influxdb_driver,
+    "influxdb2": InfluxDB2Driver,
+    "otlp"     : OTLPDriver,
+    "statsd"   : StatsdDriver,
+    "file"     : FileDriver,
+}
+
+
+# --------- Class DiskSpool : append-only, segment-rotated spool of points that could not be written -------- #
+class DiskSpool(object):
+    # Each record is a batch of points: payload length, crc32 of the payload, then the records of the driver that
+    # failed to write them (line protocol, OTLP JSON gauges, statsd or NDJSON lines), one per line
+    RECORD_HEADER  = struct.Struct(">II")
+    SEGMENT_SUFFIX = ".seg"
+    CURSOR_FILE    = "cursor"
+
+    def __init__(self, directory, max_bytes=AGENT_DEFAULTS["spool_max_bytes"],
+                 segment_bytes=AGENT_DEFAULTS["spool_segment_bytes"]):
+        """Constructor of DiskSpool class, resumes the spool left in directory by a previous run
+        Args:
+            directory     (string) : Directory of the segment files and of the replay cursor
+            max_bytes     (int)    : Size cap of the spool, the oldest segments are evicted above it
+            segment_bytes (int)    : A new segment is started once the current one reaches this size
+        Fields:
+            segments (py dictionary) : Size in bytes of each segment, keyed by its sequence number
+            cursor   (tuple)         : (segment, offset) of the next record to replay
+            writer   (file)          : Newest segment, opened for appending
+        """
+        self.directory     = directory
+        self.max_bytes     = int(max_bytes)
+        self.segment_bytes = int(segment_bytes)
+        self.lock          = threading.Lock()
+        self.writer        = None
+        self.evicted       = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.segments = {}
+        for filename in os.listdir(directory):
+            if filename.endswith(self.SEGMENT_SUFFIX):
+                # a stray file (e.g. copied by hand) is not a segment of the spool
+                try:
+                    sequence = int(filename[:-len(self.SEGMENT_SUFFIX)])
+                except ValueError:
+                    LOGGER.warning("Ignoring %s in the spool directory, not a segment", filename)
+                    continue
+                self.segments[sequence] = os.path.getsize(self.segment_path(sequence))
+
+        self.cursor = self.load_cursor()
+        if self.segments:
+            LOGGER.info("Spool resumed with %d segment(s), %d byte(s)", len(self.segments), self.size())
+
+    def segment_path(self, sequence):
+        return os.path.join(self.directory, "%020d%s" % (sequence, self.SEGMENT_SUFFIX))
+
+    def size(self):
+        """Size of the spool on disk, in bytes"""
+        return sum(self.segments.values())
+
+    def load_cursor(self):
+        """Read the replay position saved by commit(), defaulting to the start of the oldest segment"""
+        oldest = (min(self.segments), 0) if self.segments else (0, 0)
+        try:
+            with open(os.path.join(self.directory, self.CURSOR_FILE), "r") as cursor_file:
+                sequence, offset = [int(value) for value in cursor_file.read().split()]
+        except (IOError, OSError, ValueError):
+            return oldest
+
+        return (sequence, offset) if sequence in self.segments else oldest
+
+    def append(self, lines):
+        """Append a batch of points, fsync'ed before returning so it survives a crash or a restart
+        Args:
+            lines (list of string) : Points serialized by the driver of the sink, one line each
+        """
+        payload = "\n".join(lines).encode("utf-8")
+
+        with self.lock:
+            # rotate when the current segment is full, a new run also starts a new segment
+            if self.writer is None or self.writer.tell() >= self.segment_bytes:
+                self.rotate()
+
+            self.writer.write(self.RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            self.segments[self.current] = self.writer.tell()
+
+            self.evict()
+
+    def rotate(self):
+        """Close the current segment and start the next one"""
+        if self.writer is not None:
+            self.writer.close()
+
+        self.current                = max(self.segments) + 1 if self.segments else 1
+        self.segments[self.current] = 0
+        self.writer                 = open(self.segment_path(self.current), "ab")
+        if self.cursor[0] not in self.segments:
+            self.cursor = (min(self.segments), 0)
+
+    def evict(self):
+        """Delete the oldest segments while the spool is above its size cap, the current segment is kept"""
+        while self.size() > self.max_bytes and len(self.segments) > 1:
+            oldest = min(self.segments)
+            self.remove(oldest)
+            self.evicted += 1
+            LOGGER.error("Spool above %d byte(s), evicted its oldest segment", self.max_bytes)
+
+    def remove(self, sequence):
+        """Delete a segment, moving the replay cursor to the next one if it pointed there"""
+        del self.segments[sequence]
+        os.remove(self.segment_path(sequence))
+        if self.cursor[0] == sequence:
+            self.cursor = (min(self.segments), 0) if self.segments else (0, 0)
+            self.save_cursor()
+
+    def save_cursor(self):
+        """Persist the replay position, replaced atomically so a crash leaves either the old or the new one"""
+        path = os.path.join(self.directory, self.CURSOR_FILE)
+        with open(path + ".tmp", "w") as cursor_file:
+            cursor_file.write("%d %d" % self.cursor)
+        os.replace(path + ".tmp", path)
+
+    def peek(self):
+        """Read the next record to replay, without consuming it
+        Fully replayed segments are deleted on the way, except the one being appended to.
+        Returns:
+            record (tuple) : (lines, position to pass to commit()), None when everything was replayed
+        """
+        with self.lock:
+            while self.segments:
+                sequence, offset = self.cursor
+                if sequence not in self.segments:
+                    self.cursor = (min(self.segments), 0)
+                    continue
+
+                with open(self.segment_path(sequence), "rb") as segment:
+                    segment.seek(offset)
+                    header = segment.read(self.RECORD_HEADER.size)
+                    if len(header) == self.RECORD_HEADER.size:
+                        length, crc = self.RECORD_HEADER.unpack(header)
+                        payload     = segment.read(length)
+                        if len(payload) == length and zlib.crc32(payload) == crc:
+                            position = (sequence, offset + self.RECORD_HEADER.size + length)
+                            return payload.decode("utf-8").split("\n"), position
+
+                        # a record truncated by a crash ends the segment
+                        LOGGER.error("Spool segment %d is corrupted at offset %d, skipping its end", sequence, offset)
+
+                if self.writer is not None and sequence == self.current:
+                    return None
+                self.remove(sequence)
+
+            return None
+
+    def commit(self, position):
+        """Mark the record returned by peek() as replayed"""
+        with self.lock:
+            self.cursor = position
+            self.save_cursor()
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+
+# --------- Class SnapshotQueue : bounded hand-off of GPUStat snapshots from the sampler to the exporter -------- #
+class SnapshotQueue(object):
+    def __init__(self, maxsize=AGENT_DEFAULTS["queue_size"], overflow=AGENT_DEFAULTS["queue_overflow"]):
+        """Constructor of SnapshotQueue class
+        Args:
+            maxsize  (int)    : Maximum number of snapshots waiting for export
+            overflow (string) : "drop-oldest" to discard the oldest snapshot when full, "block" to wait for room
+        Fields:
+            dropped (int)  : Number of snapshots discarded by the drop-oldest policy
+            closed  (bool) : No more snapshots will be put, get() returns None once the queue is drained
+        """
+        if overflow not in QUEUE_OVERFLOW_POLICIES:
+            raise ValueError("queue_overflow must be one of %s" % ", ".join(QUEUE_OVERFLOW_POLICIES))
+
+        self.maxsize   = max(1, int(maxsize))
+        self.overflow  = overflow
+        self.items     = deque()
+        self.condition = threading.Condition()
+        self.dropped   = 0
+        self.closed    = False
+
+    def depth(self):
+        """Number of snapshots waiting for export"""
+        return len(self.items)
+
+    def put(self, snapshot):
+        """Queue a snapshot, applying the overflow policy when the queue is full"""
+        with self.condition:
+            while len(self.items) >= self.maxsize and not self.closed:
+                if self.overflow == "drop-oldest":
+                    self.items.popleft()
+                    self.dropped += 1
+                    LOGGER.warning("Export queue full, dropped the oldest snapshot (%d dropped so far)", self.dropped)
+                else:
+                    self.condition.wait(1)
+
+            self.items.append(snapshot)
+            self.condition.notify_all()
+
+    def get(self):
+        """Wait for the next snapshot
+        Returns:
+            snapshot (GPUStat) : Oldest queued snapshot, None when the queue is closed and drained
+        """
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+
+            snapshot = self.items.popleft() if self.items else None
+            self.condition.notify_all()
+            return snapshot
+
+    def take_all(self):
+        """Remove every queued snapshot at once, without waiting
+        Returns:
+            snapshots (list of GPUStat) : Queued snapshots, oldest first
+        """
+        with self.condition:
+            snapshots = list(self.items)
+            self.items.clear()
+            self.condition.notify_all()
+            return snapshots
+
+    def close(self):
+        """Wake up the exporter, which leaves once the remaining snapshots are exported"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# --------- Class ExportWorker : export queued snapshots, retrying with exponential backoff -------- #
+class ExportWorker(threading.Thread):
+    def __init__(self, queue, driver, retries=AGENT_DEFAULTS["export_retries"],
+                 backoff=AGENT_DEFAULTS["export_backoff"], max_backoff=AGENT_DEFAULTS["export_max_backoff"],
+                 spool=None, replay_rate=AGENT_DEFAULTS["spool_replay_rate"]):
+        """Constructor of ExportWorker class
+        Args:
+            queue       (SnapshotQueue)  : Queue drained by the worker, None to only call export() directly
+            driver      (ExportDriver)   : Driver writing the snapshots
+            retries     (int)            : Attempts after the first failure before the points are spooled
+            backoff     (float)          : Seconds to wait after the first failure, doubled after each one,
+                                           also the first wait before probing a backend that is down
+            max_backoff (float)          : Upper bound of the wait between two attempts or two probes
+            spool       (DiskSpool)      : Where failed points are kept until the backend is back, None to drop them
+            replay_rate (float)          : Maximum points per second replayed from the spool
+        Fields:
+            exported      (int)             : Snapshots written
+            export_errors (int)             : Failed write attempts
+            replayed      (int)             : Points replayed from the spool
+            circuit_open  (bool)            : The backend failed a whole retry schedule, snapshots are spooled
+                                              at once until a probe goes through
+            probe_time    (float)           : monotonic() time of the next probe while the circuit is open
+            abort         (threading.Event) : Set to stop retrying, used when the agent cannot wait any longer
+        """
+        threading.Thread.__init__(self, name="nvml-agent-exporter")
+        self.daemon        = True
+        self.queue         = queue
+        self.driver        = driver
+        self.retries       = int(retries)
+        self.backoff       = float(backoff)
+        self.max_backoff   = float(max_backoff)
+        self.spool         = spool
+        self.replay_rate   = float(replay_rate)
+        self.replay_budget = self.replay_rate
+        self.replay_time   = monotonic()
+        self.exported      = 0
+        self.export_errors = 0
+        self.replayed      = 0
+        self.circuit_open  = False
+        self.probe_delay   = self.backoff
+        self.probe_time    = None
+        self.abort         = threading.Event()
+
+    def run(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                break
+
+            # an unexpected error must not kill the exporter, the next snapshots are still exported
+            try:
+                self.export(snapshot)
+            except Exception:
+                LOGGER.exception("Export failed")
+                self.save(self.driver.take())
+
+    def export(self, snapshot):
+        """Write a snapshot, retrying the flush with exponential backoff
+        Once a whole retry schedule failed, the circuit opens: the next snapshots are spooled straight away
+        instead of each waiting through the retries, which would fill the queue during an outage. Every
+        probe_delay seconds (backoff doubled up to max_backoff) a snapshot is written with a single attempt as
+        a probe; the spool is only replayed once one goes through.
+        Returns:
+            success (bool) : False when the points were spooled or dropped
+        """
+        retries = self.retries
+        if self.circuit_open:
+            if monotonic() < self.probe_time:
+                self.driver.add(snapshot)
+                self.save(self.driver.take())
+                return False
+            retries = 0
+
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            try:
+                if attempt == 0 and not self.circuit_open:
+                    self.driver.write(snapshot)
+                else:
+                    # a probe is always flushed, a buffered snapshot would not tell whether the backend is back
+                    if attempt == 0:
+                        self.driver.add(snapshot)
+                    self.driver.flush()
+                self.exported += 1
+                if self.circuit_open:
+                    LOGGER.info("%s is reachable again, replaying the spool", self.driver.backend)
+                    self.circuit_open = False
+                self.replay()
+                return True
+            except ExportError as err:
+                self.export_errors += 1
+                if attempt == retries or self.abort.is_set():
+                    LOGGER.error("%s", err)
+                    break
+                LOGGER.warning("%s, retrying in %.1fs", err, delay)
+
+            if self.abort.wait(delay):
+                break
+            delay = min(delay * 2, self.max_backoff)
+
+        self.trip()
+        self.save(self.driver.take())
+        return False
+
+    def trip(self):
+        """Open the circuit after a failed retry schedule, or keep it open after a failed probe"""
+        if self.circuit_open:
+            self.probe_delay = min(self.probe_delay * 2, self.max_backoff)
+        else:
+            LOGGER.error("%s unavailable, spooling the snapshots until a probe goes through", self.driver.backend)
+            self.circuit_open = True
+            self.probe_delay  = self.backoff
+        self.probe_time = monotonic() + self.probe_delay
+
+    def save(self, lines):
+        """Keep points that could not be written in the spool, or drop them when there is no spool
+        Spooled points are written on replay, the state of the delta filter is committed; dropped ones never are,
+        it is rolled back so that the next sample writes their changes again.
+        """
+        if not lines:
+            return
+
+        delta = self.driver.delta
+        if self.spool is None:
+            LOGGER.error("Export to %s failed, %d point(s) dropped", self.driver.backend, len(lines))
+            if delta is not None:
+                delta.rollback()
+            return
+
+        try:
+            self.spool.append(lines)
+            LOGGER.warning("Export to %s failed, %d point(s) spooled to disk", self.driver.backend, len(lines))
+            if delta is not None:
+                delta.commit()
+        except (IOError, OSError) as err:
+            LOGGER.error("Cannot spool %d point(s), dropped: %s", len(lines), err)
+            if delta is not None:
+                delta.rollback()
+
+    def replay(self):
+        """Write spooled points in order, at most replay_rate points per second
+        The worker keeps replaying between two snapshots: it yields as soon as a snapshot is queued, so fresh
+        samples go first, and stops when the queue is closed. Without a queue (--once), at most one second's
+        worth of points is replayed.
+        """
+        if self.spool is None:
+            return
+
+        while not self.abort.is_set():
+            if self.queue is not None and (self.queue.depth() or self.queue.closed):
+                return
+
+            # token bucket, refilled with the time elapsed since the previous batch, at most one second of budget
+            now                = monotonic()
+            self.replay_budget = min(self.replay_rate,
+                                     self.replay_budget + (now - self.replay_time) * self.replay_rate)
+            self.replay_time   = now
+            if self.replay_budget <= 0:
+                if self.queue is None:
+                    return
+                self.abort.wait(min(-self.replay_budget / self.replay_rate, 1))
+                continue
+
+            record = self.spool.peek()
+            if record is None:
+                return
+
+            lines, position = record
+            try:
+                self.driver.send(lines)
+            except ExportError as err:
+                LOGGER.warning("Spool replay paused: %s", err)
+                return
+
+            self.spool.commit(position)
+            self.replay_budget -= len(lines)
+            self.replayed      += len(lines)
+
+    def close(self):
+        """Flush or spool the points still buffered by the driver, spool the snapshots left in the queue
+        Called once the worker thread is stopped, so that a restart does not lose them.
+        """
+        if self.queue is not None:
+            for snapshot in self.queue.take_all():
+                self.driver.add(snapshot)
+
+        # once aborted or with the circuit open, the backend is known to be down: spool without another failure
+        if self.abort.is_set() or self.circuit_open:
+            self.save(self.driver.take())
+        else:
+            try:
+                self.driver.flush()
+            except ExportError as err:
+                LOGGER.error("%s", err)
+                self.save(self.driver.take())
+
+        if self.spool is not None:
+            self.spool.close()
+
+    def spool_queue(self):
+        """Spool the snapshots left in the queue while the worker thread is still blocked in a write
+        Only the queue and the spool are used, both are locked; the driver's buffer belongs to the thread.
+        """
+        for snapshot in self.queue.take_all():
+            self.save(self.driver.encode(snapshot))
+
+
+def new_export_worker(queue, driver, agent_cfg):
+    """Create the exporter of a driver from the agent options
+    Args:
+        queue     (SnapshotQueue)  : Queue drained by the worker, None for synchronous export()
+        driver    (ExportDriver)   : Driver writing the snapshots
+        agent_cfg (py dictionary)  : Agent options, see AGENT_DEFAULTS
+    Returns:
+        worker (ExportWorker) : Worker thread, not started
+    """
+    spool = None
+    if agent_cfg["spool_dir"]:
+        spool = DiskSpool(agent_cfg["spool_dir"], agent_cfg["spool_max_bytes"], agent_cfg["spool_segment_bytes"])
+
+    return ExportWorker(queue, driver,
+                        agent_cfg["export_retries"],
+                        agent_cfg["export_backoff"],
+                        agent_cfg["export_max_backoff"],
+                        spool,
+                        agent_cfg["spool_replay_rate"])
+
+
+def new_sinks(cfg, agent_cfg):
+    """Create the export sinks of the configuration file
+    Each entry of the sinks list has a type of SINK_DRIVERS, the options of its driver, an optional name
+    (default: its type) and its own values of SINK_OPTIONS. Without a sinks list, the influxdb_* keys
+    configure a single InfluxDB sink, as before sinks existed.
+    Args:
+        cfg       (py dictionary) : Configuration file without the agent options, sinks is removed from it
+        agent_cfg (py dictionary) : Agent options, see AGENT_DEFAULTS
+    Returns:
+        sinks (list of ExportSink) : Sinks the samples are exported to, empty when none is configured
+    """
+    sinks_cfg = cfg.pop("sinks", None)
+    if sinks_cfg is None:
+        if not cfg.get("influxdb_host"):
+            return []
+        return [ExportSink("influxdb", InfluxDBDriver(delta=new_delta_filter(agent_cfg), **cfg), agent_cfg)]
+
+    sinks = []
+    for sink_cfg in sinks_cfg:
+        sink_cfg  = dict(sink_cfg)
+        sink_type = sink_cfg.pop("type", None)
+        if sink_type not in SINK_DRIVERS:
+            raise ValueError("Unknown sink type %r, expected one of %s"
+                             % (sink_type, ", ".join(sorted(SINK_DRIVERS))))
+
+        name = str(sink_cfg.pop("name", sink_type))
+        if name in [sink.name for sink in sinks]:
+            raise ValueError("Several sinks are named %r, give them distinct names" % name)
+
+        options = dict(agent_cfg)
+        for key in SINK_OPTIONS:
+            if key in sink_cfg:
+                options[key] = sink_cfg.pop(key)
+        # each sink spools and replays the points it could not write on its own
+        if options["spool_dir"]:
+            options["spool_dir"] = os.path.join(options["spool_dir"], name)
+
+        sinks.append(ExportSink(name, SINK_DRIVERS[sink_type](delta=new_delta_filter(options), **sink_cfg), options))
+
+    return sinks
+
+
+# --------- Class ExportFanout : one queue and exporter thread per sink, fed with every snapshot -------- #
+class ExportFanout(object):
+    def __init__(self, sinks):
+        """Constructor of ExportFanout class
+        Each sink has its own queue, batching and exporter thread: a slow or unreachable backend fills its own
+        queue (and spool) while the others keep being written. A "block" queue would stall the sampling, and so
+        every sink, behind the slowest one: with several sinks, it drops the oldest snapshot instead.
+        Args:
+            sinks (list of ExportSink) : Sinks every snapshot is exported to
+        Fields:
+            queues    (list of SnapshotQueue) : Queue of each sink
+            exporters (list of ExportWorker)  : Thread writing the queued snapshots of each sink
         """
-        self.gpus_pod_usage = gpus_pod_usage
+        self.sinks     = sinks
+        self.queues    = []
+        self.exporters = []
+        for sink in sinks:
+            overflow = sink.options["queue_overflow"]
+            if overflow == "block" and len(sinks) > 1:
+                LOGGER.warning("queue_overflow block of sink %s would hold back the other sinks, dropping the "
+                               "oldest snapshot instead", sink.name)
+                overflow = "drop-oldest"
+            queue          = SnapshotQueue(sink.options["queue_size"], overflow)
+            exporter       = new_export_worker(queue, sink.driver, sink.options)
+            exporter.name  = "nvml-agent-exporter-%s" % sink.name
+            self.queues.append(queue)
+            self.exporters.append(exporter)
 
-        # attach host and time information of each GPUStat
-        self.hostname       = socket.gethostname()
-        self.query_time     = datetime.now()
+    def start(self):
+        for exporter in self.exporters:
+            exporter.start()
+
+    def put(self, snapshot):
+        """Queue a snapshot for every sink, it is not modified anymore: the exporter threads share it"""
+        for queue in self.queues:
+            queue.put(snapshot)
+
+    def health(self, counters, gauges):
+        """Add the state of the queues and exporters, summed over the sinks, to the health of the agent"""
+        counters["snapshots_dropped"]  = sum(queue.dropped for queue in self.queues)
+        counters["snapshots_exported"] = sum(exporter.exported for exporter in self.exporters)
+        counters["points_replayed"]    = sum(exporter.replayed for exporter in self.exporters)
+        counters["export_errors"]      = sum(exporter.export_errors for exporter in self.exporters)
+        gauges["queue_depth"]          = sum(queue.depth() for queue in self.queues)
+
+    def join(self, timeout):
+        """Wait for the exporter threads, at most timeout seconds for all of them"""
+        deadline = monotonic() + timeout
+        for exporter in self.exporters:
+            exporter.join(max(deadline - monotonic(), 0))
+
+    def drain(self):
+        """Stop the exporters once they wrote the queued snapshots, or spool them when their backend is still down
+        The sinks are drained together, the shutdown takes as long as the slowest one, not the sum of them.
+        """
+        # let the exporters drain their queue, but stop retrying if a backend is still down
+        for queue in self.queues:
+            queue.close()
+        self.join(EXPORT_DRAIN_TIMEOUT)
+        for sink, queue, exporter in zip(self.sinks, self.queues, self.exporters):
+            if exporter.is_alive():
+                LOGGER.warning("Export queue of %s not drained after %ds, %d snapshot(s) left",
+                               sink.name, EXPORT_DRAIN_TIMEOUT, queue.depth())
+                exporter.abort.set()
+        self.join(EXPORT_ABORT_TIMEOUT)
+
+        for sink, queue, exporter in zip(self.sinks, self.queues, self.exporters):
+            # still blocked in a write: leave the driver to it, the daemon thread ends with the agent
+            if exporter.is_alive():
+                LOGGER.error("Exporter of %s still writing after %ds, spooling the %d queued snapshot(s) only",
+                             sink.name, EXPORT_DRAIN_TIMEOUT + EXPORT_ABORT_TIMEOUT, queue.depth())
+                exporter.spool_queue()
+                continue
+
+            # whatever could not be written is spooled for the next run
+            exporter.close()
+            sink.driver.close()
+
+
+# --------- Class PrometheusExporter : serve the latest snapshot on /metrics in Prometheus text format -------- #
+class PrometheusExporter(object):
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, port, address=""):
+        """Constructor of PrometheusExporter class
+        Args:
+            port    (int)    : Port of the HTTP server, 0 picks a free one
+            address (string) : Address the HTTP server listens on, empty for all
+        Fields:
+            page   (tuple)                         : (body, gzipped body, etag, last modified) of the latest snapshot
+            server (http.server.ThreadingHTTPServer) : Server answering the scrapes from its own threads
+        """
+        # only imported when /metrics is served
+        import http.server
+
+        self.page   = self.render_page(b"", datetime.now())
+        self.server = http.server.ThreadingHTTPServer((address, int(port)), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="nvml-agent-prometheus")
+        self.thread.daemon = True
 
     @staticmethod
-    def new_query():
-        """Query the information of all the GPUs on the machine & Trace Pod Processes that utilize them
+    def render_page(body, query_time):
+        """Pre-render everything a scrape needs, so serving it costs no NVML, runtime nor encoding work"""
+        from email.utils import formatdate
+
+        return (body,
+                gzip.compress(body),
+                '"%s"' % hashlib.sha1(body).hexdigest(),
+                formatdate(query_time.timestamp(), usegmt=True))
+
+    @staticmethod
+    def render(gpu_stats):
+        """Render a snapshot in Prometheus text exposition format
+        Args:
+            gpu_stats (GPUStat Obj) : Statistics and details to account GPU usage by Pods.
         Returns:
-        GPUStat Object : Statistics and details to account GPU usage by Pods
+            body (bytes) : One gauge family per pod metric and per telemetry metric
         """
-        
-        def get_process_info(nv_process):
-            """Get the process information of specific GPU process ; username, command, pid, and GPU memory usage
-            Args:
-                nv_process (nvmlFriendlyObject) : A process that utilize the resource of NVIDIA GPU
-            Returns:
-                process    (py dictionary)      : Contains the desired information of GPU process
-            """
+        families = {}
 
-            # init dict to store process' information
-            process = {}
-
-            # Store pid and GPU memory usage into dict
-            # get pid of the process    
-            process['pid']              = nv_process.pid
-            # Bytes to MBytes
-            process['gpu_memory_usage'] = int(nv_process.usedGpuMemory / 1024 / 1024)
-            
-            # get process detail (process object) for given pid of a nvidia process    
-            ps_process          = psutil.Process(pid = nv_process.pid)
-            
-            # get process username
-            process['username'] = ps_process.username()
-
-            # figure out OS command that execute the process
-            # cmdline returns full path; as in `ps -o comm`, get short cmdnames.
-            _cmdline = ps_process.cmdline()
-            
-            # sometimes, zombie or unknown (e.g. [kworker/8:2H])
-            if not _cmdline:   
-                process['command'] = '?'
-            else:
-                process['command'] = os.path.basename(_cmdline[0])
-            
-            return process
+        def add(name, help_text, labels, value, metric_type="gauge"):
+            label_set = ",".join('%s="%s"' % (key, str(labels[key]).replace("\\", "\\\\").replace('"', '\\"')
+                                                                  .replace("\n", "\\n"))
+                                 for key in sorted(labels))
+            family    = families.setdefault(name, ["# HELP %s %s" % (name, help_text),
+                                                   "# TYPE %s %s" % (name, metric_type)])
+            family.append("%s{%s} %s" % (name, label_set, repr(float(value))))
 
-        def get_parent_process_info(nv_process):
-            """Get the information of parent container (pod) of specific container pid    
-            Args:
-                nv_process (nvmlFriendlyObject) : A process that utilize the resource of NVIDIA GPU
-            Returns:
-                process    (psutil.Process)     : Prosess object for parent container (pod)
-            """
+        for gpu in gpu_stats.gpus_pod_usage:
+            gpu_labels = {
+                "nodename" : gpu_stats.hostname,
+                "gpu_name" : gpu.name,
+                "gpu_uuid" : gpu.uuid,
+                "gpu_index": gpu.index
+            }
+            gpu_labels.update(gpu_tags(gpu))
+            for metric, value in gpu.telemetry.items():
+                if metric in PROMETHEUS_COUNTERS:
+                    add("nvml_gpu_%s_total" % metric, "GPU telemetry %s read from NVML" % metric,
+                        gpu_labels, value, "counter")
+                else:
+                    add("nvml_gpu_" + metric, "GPU telemetry %s read from NVML" % metric, gpu_labels, value)
 
-            # get process detail (process object) for given pid of a nvidia process    
-            process  = psutil.Process(pid = nv_process.pid)
+            # one series per pod's container, a pid label would start a new series for every job
+            for (pod_name, pod_container_name, namespace_name), (pod, fields) in sum_pod_usage(gpu).items():
+                labels = dict(gpu_labels,
+                              pod_name=pod_name,
+                              container_name=pod_container_name,
+                              namespace_name=namespace_name)
+                labels.update(pod_tags(pod))
+                add("nvml_pod_gpu_memory_used_megabytes", "GPU memory used by the pod's container, in MB",
+                    labels, fields["value"])
+                for _, field in PROCESS_UTILIZATION_FIELDS:
+                    if field in fields:
+                        add("nvml_pod_gpu_%s_percent" % field,
+                            "Average %s of the pod's container since the previous sample" % field,
+                            labels, fields[field])
 
-            # In context of kubernetes, pod is parent process of containers (jobs) that run across the nodes in kubernetes cluster
-            # Loop until we find the parent container (pod), the keyword is "docker-containerd-shim" (daemonless containers)
-            while process.parent().name() != "docker-containerd-shim":
-                process = process.parent()
+        # timings and counters of the agent itself
+        if gpu_stats.health is not None:
+            health = gpu_stats.health
+            labels = {"nodename": gpu_stats.hostname}
+            for counter, value in health.counters.items():
+                add("nvml_agent_%s_total" % counter, "Agent %s since it started" % counter, labels, value, "counter")
+            for gauge, value in health.gauges.items():
+                add("nvml_agent_" + gauge, "Agent %s" % gauge, labels, value)
 
-            return process
+            name = "nvml_agent_stage_seconds"
+            for stage in sorted(health.stages):
+                counts, total, count, _ = health.stages[stage]
+                family     = families.setdefault(name, ["# HELP %s Duration of each stage of the agent" % name,
+                                                        "# TYPE %s histogram" % name])
+                cumulative = 0
+                for bound, bucket in zip(STAGE_BUCKETS + ("+Inf",), counts):
+                    cumulative += bucket
+                    family.append('%s_bucket{le="%s",nodename="%s",stage="%s"} %d'
+                                  % (name, bound, gpu_stats.hostname, stage, cumulative))
+                family.append('%s_sum{nodename="%s",stage="%s"} %r' % (name, gpu_stats.hostname, stage, total))
+                family.append('%s_count{nodename="%s",stage="%s"} %d' % (name, gpu_stats.hostname, stage, count))
 
-        def get_pod_info(pod_pid):
-            """Get the pod information ; pod pid, container's name, pod name, pod namespace, container's id
-            Args:
-                pod_pid (int)           : Pid of given pod
-            Returns:
-                pod     (py dictionary) : Contains the desired information of pod.
-            """
+        lines = []
+        for name in sorted(families):
+            lines.extend(families[name])
 
-            # init dict to store pod's information
-            pod = {}
-
-            # Equal to "docker ps -q" in shell terminal, listing all ids of running containers
-            docker_ps                      = subprocess.Popen(
-                                                ["docker", "ps", "-q"],
-                                                stdin=subprocess.PIPE,
-                                                stdout=subprocess.PIPE,
-                                                stderr=subprocess.PIPE
-                                                )
-            docker_ps_out, docker_ps_err   = docker_ps.communicate()
-
-            # Store the result of "docker ps -q" as an array of containers' id
-            container_ids = docker_ps_out.split("\n")
-
-            # Loop through all container ids, 
-            # inspect each and try to find container details that match given pod_pid
-            for container_id in container_ids:
-                # Equal to "docker inspect --format '{{.State.Pid}} {{.Name}} {{.Id}}' [container_id]" in shell,
-                # Inspect pid, docker process's name, and container's id of each container's id 
-                # (some are redundants, but it is to ensure we inspect the same process)
-                docker_inspect                         = subprocess.Popen(
-                                                        ["docker", "inspect", "--format","'{{printf \"%.0f %s %s\" .State.Pid .Name .Id}}'",container_id],
-                                                        stdin=subprocess.PIPE,
-                                                        stdout=subprocess.PIPE,
-                                                        stderr=subprocess.PIPE)
-                docker_inspect_out, docker_inspect_err = docker_inspect.communicate()
-
-                # The result of docker inspect should contain desired information
-                # Split the result of docker inspect: [process_pid/pod_pid] [docker_process_name] [container_id]
-                pod_info = docker_inspect_out.split("\n")[0].replace("'","").split()
-
-                # Break the loop if we find the desired container details of a pod
-                if pod_info[0] == str(pod_pid):
-                    break
-            
-            # The name format for each running docker process in kubernetes is as follows:
-            # /k8s_[pod-name]_[container_name]_[pod_namespace]_[random_hash]
-            # Split them as pod_containers_details to obtain "container_name", "name", "namespace"
-            pod_container_details = pod_info[1].split("_")
-            
-            # Store the results
-            pod['pid']            = pod_info[0]
-            pod['container_name'] = pod_container_details[1]        
-            pod['name']           = pod_container_details[2]
-            pod['namespace']      = pod_container_details[3]
-            pod['container_id']   = pod_info[2]   
-
-            return pod
-
-        def benchmark_gpu():
-            """Query all utilizations in each GPU and resolve them to pod information and identity"""
-            
-            # detect all NVIDIA GPU in machine
-            device_count = N.nvmlDeviceGetCount()
-
-            # Init empty list to store usage by each GPU
-            gpus_usage   = []
-            
-            # Iterate through available GPU
-            for index in range(device_count):
-                # get the NVML object based on GPU's index target
-                # get the name and uuid of NVIDIA GPU
-                handle = N.nvmlDeviceGetHandleByIndex(index)
-                name   = (N.nvmlDeviceGetName(handle))
-                uuid   = (N.nvmlDeviceGetUUID(handle))
-
-                # init list to store process and parent container (pod) for each process that utilizes NVIDIA
-                # process        = jobs (container) that utilize NVIDA GPU
-                # parent process = parent container (pod) that utilize NVIDIA GPU
-                processes       = []
-                parentProcesses = []
-                
-                # Get running processes in each GPU
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+    def update(self, gpu_stats):
+        """Replace the page served on /metrics with the rendering of a new snapshot"""
+        # a single reference swap, scrapes in flight keep the page they started with
+        self.page = self.render_page(self.render(gpu_stats), gpu_stats.query_time)
+
+    def handler(self):
+        import http.server
+
+        exporter = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                LOGGER.debug("Prometheus scrape from %s: " + fmt, self.client_address[0], *args)
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body, gzipped, etag, last_modified = exporter.page
+
+                # conditional request, the page did not change since the scraper fetched it
+                if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzipped
+                    self.send_response(200)
+                    self.send_header("Content-Encoding", "gzip")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", PrometheusExporter.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                self.wfile.write(body)
+
+        return MetricsHandler
+
+    def start(self):
+        self.thread.start()
+        LOGGER.info("Serving Prometheus metrics on port %d", self.server.server_address[1])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# --------- Class NVMLEventWatcher : report NVML events (Xid, ECC, clocks) without waiting for the next sample -------- #
+class NVMLEventWatcher(threading.Thread):
+    def __init__(self, session, events, queue=None, timeout=1):
+        """Constructor of NVMLEventWatcher class
+        Args:
+            session (NVMLSession)    : Opened NVML session, its GPUs are registered when the thread starts
+            events  (list of string) : Names of NVML_EVENT_TYPES to wait for
+            queue   (ExportFanout)   : Export queues receiving a gpu/event point per event, None to only log them
+            timeout (float)          : Seconds of each nvmlEventSetWait, the thread stops within this delay
+        Fields:
+            event_set (nvmlEventSet_t) : Event set the GPUs are registered in, None until the thread starts
+        """
+        unknown = [event for event in events if event not in NVML_EVENT_TYPES]
+        if unknown:
+            raise ValueError("Unknown nvml_events %s, expected some of %s"
+                             % (", ".join(unknown), ", ".join(sorted(NVML_EVENT_TYPES))))
+
+        threading.Thread.__init__(self, name="nvml-agent-events")
+        self.daemon    = True
+        self.session   = session
+        self.events    = list(events)
+        self.queue     = queue
+        self.timeout   = float(timeout)
+        self.event_set = None
+        self.finished  = threading.Event()
+
+    def register(self):
+        """Register every GPU of the session for the configured events it supports
+        Returns:
+            registered (int) : Number of GPUs registered
+        """
+        self.event_set = N.nvmlEventSetCreate()
+
+        registered = 0
+        for device in self.session.devices:
+            # the events of a MIG device are reported by its GPU
+            if device.mig is not None:
+                continue
+            try:
+                supported = N.nvmlDeviceGetSupportedEventTypes(device.handle)
+            except N.NVMLError as err:
+                LOGGER.warning("NVML events not supported by GPU %s: %s", device.uuid, err)
+                continue
+
+            mask = 0
+            for event in self.events:
+                mask |= getattr(N, NVML_EVENT_TYPES[event], 0) & supported
+            if not mask:
+                continue
+
+            try:
+                N.nvmlDeviceRegisterEvents(device.handle, mask, self.event_set)
+                registered += 1
+            except N.NVMLError as err:
+                LOGGER.warning("Cannot register GPU %s for NVML events: %s", device.uuid, err)
+
+        return registered
+
+    def run(self):
+        try:
+            if not self.register():
+                LOGGER.warning("No GPU supports the nvml_events %s", ", ".join(self.events))
+                return
+
+            while not self.finished.is_set():
                 try:
-                    nv_comp_processes = N.nvmlDeviceGetComputeRunningProcesses(handle)
-                except N.NVMLError:
-                    nv_comp_processes = None  # Not supported
+                    data = N.nvmlEventSetWait(self.event_set, int(self.timeout * 1000))
+                except N.NVMLError as err:
+                    # no event during the timeout
+                    if getattr(err, "value", None) == getattr(N, "NVML_ERROR_TIMEOUT", None):
+                        continue
+                    LOGGER.error("Waiting for NVML events failed, not watching them anymore: %s", err)
+                    return
+                self.report(data)
+        except N.NVMLError as err:
+            LOGGER.error("Cannot watch NVML events: %s", err)
+        finally:
+            if self.event_set is not None:
+                N.nvmlEventSetFree(self.event_set)
+                self.event_set = None
+
+    def report(self, data):
+        """Log an event and hand its gpu/event point over to the exporter"""
+        event = "unknown"
+        for name, constant in NVML_EVENT_TYPES.items():
+            if getattr(N, constant, None) == data.eventType:
+                event = name
+        try:
+            uuid = nvml_string(N.nvmlDeviceGetUUID(data.device))
+        except N.NVMLError:
+            uuid = ""
+
+        METRICS.count("nvml_events")
+        log = LOGGER.error if event in NVML_CRITICAL_EVENTS else LOGGER.info
+        log("NVML %s event on GPU %s, data %d", event, uuid, data.eventData)
+
+        if self.queue is not None:
+            hostname = sys.intern(socket.gethostname())
+            self.queue.put(EventSnapshot(hostname, datetime.now(),
+                                         [("gpu/event", {"nodename": hostname, "gpu_uuid": uuid, "event": event},
+                                           {"event_data": int(data.eventData)})]))
+
+    def stop(self):
+        """Leave the wait loop, at most timeout seconds later"""
+        self.finished.set()
+        self.join(2 * self.timeout)
+
+
+# --------- Class SamplingProfiler : stacks of every thread sampled at a fixed interval, toggled at runtime -------- #
+class SamplingProfiler(threading.Thread):
+    def __init__(self, directory=AGENT_DEFAULTS["profile_dir"], interval=AGENT_DEFAULTS["profile_interval"]):
+        """Constructor of SamplingProfiler class
+        The stacks are written in the folded format of flamegraph.pl and speedscope, one line per distinct
+        stack with the number of times it was seen.
+        Args:
+            directory (string) : Directory of the profile written when the profiler is stopped
+            interval  (float)  : Seconds between two samples of the stacks
+        Fields:
+            stacks (py dictionary) : Number of samples of each folded stack, outermost frame first
+        """
+        threading.Thread.__init__(self, name="nvml-agent-profiler")
+        self.daemon    = True
+        self.directory = directory
+        self.interval  = float(interval)
+        self.stacks    = {}
+        self.finished  = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append("%s (%s:%d)" % (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename),
+                                                 frame.f_code.co_firstlineno))
+                    frame = frame.f_back
+                stack = ";".join(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def stop(self):
+        """Stop sampling and write the profile
+        Returns:
+            path (string) : File the profile was written to
+        """
+        self.finished.set()
+        self.join()
+
+        path = os.path.join(self.directory, "nvml-agent-%d-%s.folded"
+                            % (os.getpid(), datetime.now().strftime("%Y%m%d-%H%M%S")))
+        with open(path, "w") as profile:
+            for stack, count in sorted(self.stacks.items()):
+                profile.write("%s %d\n" % (stack, count))
+        return path
+
+
+# --------- Class SamplingScheduler : interval between two samples, following the activity of the GPUs -------- #
+class SamplingScheduler(object):
+    def __init__(self, interval=AGENT_DEFAULTS["sampling_interval"], adaptive=False,
+                 min_interval=AGENT_DEFAULTS["sampling_min_interval"],
+                 idle_interval=AGENT_DEFAULTS["sampling_idle_interval"],
+                 memory_change=AGENT_DEFAULTS["sampling_memory_change"], cpu_budget=0.0, start_jitter=0):
+        """Constructor of SamplingScheduler class
+        When adaptive, the interval drops to min_interval as soon as the processes or the memory used of a GPU
+        change, then doubles back to interval once they are stable, and keeps doubling up to idle_interval while
+        no GPU runs a process. Between two samples further apart than interval, the processes of the GPUs are
+        probed every interval: a job starting on an idle node is sampled right away.
+        Whether adaptive or not, the interval is stretched so that the agent stays within its cpu_budget.
+        Args:
+            interval      (float) : Seconds between two samples of GPUs busy with stable processes
+            adaptive      (bool)  : Follow the activity of the GPUs, otherwise always sample every interval
+            min_interval  (float) : Seconds between two samples while the GPUs change
+            idle_interval (float) : Seconds between two samples while the GPUs are idle
+            memory_change (float) : Relative change of the memory used on a GPU that counts as activity
+            cpu_budget    (float) : Fraction of one CPU the agent may use, 0 for no limit
+            start_jitter  (float) : Seconds over which the first sample of the nodes is spread
+        Fields:
+            current     (float)         : Seconds until the next sample
+            fingerprint (py dictionary) : Pids and memory used of each GPU, by uuid, when last probed
+            changes     (bool)          : Whether a probe found the GPUs changed since the last sample
+            cpu_time    (float)         : CPU time of the agent when the interval was last computed
+            wall_time   (float)         : Monotonic time when the interval was last computed
+        """
+        self.interval      = float(interval)
+        self.adaptive      = adaptive
+        self.min_interval  = min(float(min_interval), self.interval)
+        self.idle_interval = max(float(idle_interval), self.interval)
+        self.memory_change = memory_change
+        self.cpu_budget    = cpu_budget
+        self.start_jitter  = start_jitter
+        self.current       = self.interval
+        self.fingerprint   = None
+        self.changes       = False
+        self.cpu_time      = process_time()
+        self.wall_time     = monotonic()
+
+    def start_delay(self, hostname=None):
+        """Delay before the first sample of this node
+        It depends on the hostname only: the nodes restarted together by a deploy do not sample, nor write into the
+        backends, at the same instant, and each node keeps the same phase across its restarts.
+        Returns:
+            delay (float) : Seconds in [0, start_jitter)
+        """
+        if not self.start_jitter:
+            return 0.0
+        digest = hashlib.sha1((hostname or socket.gethostname()).encode("utf-8")).digest()
+        return self.start_jitter * (struct.unpack(">I", digest[:4])[0] / 2.0 ** 32)
 
-                # Get running graphics processes in each GPU                
+    @staticmethod
+    def probe(devices):
+        """Read the processes running on each GPU, and the memory they use, from NVML only
+        Args:
+            devices (list of GPUDevice) : GPUs of the NVML session
+        Returns:
+            fingerprint (py dictionary) : uuid -> (frozenset of pids, bytes of GPU memory used by them)
+        """
+        fingerprint = {}
+        for device in devices:
+            # the processes of the MIG devices are listed on their GPU
+            if device.mig is not None:
+                continue
+            processes = []
+            for query in (N.nvmlDeviceGetComputeRunningProcesses, N.nvmlDeviceGetGraphicsRunningProcesses):
                 try:
-                    nv_graphics_processes = N.nvmlDeviceGetGraphicsRunningProcesses(handle)
+                    processes.extend(query(device.handle))
                 except N.NVMLError:
-                    nv_graphics_processes = None  # Not supported
+                    pass   # Not supported
+            fingerprint[device.uuid] = (frozenset(process.pid for process in processes),
+                                        sum(process.usedGpuMemory or 0 for process in processes))
+        return fingerprint
 
-                # Check if process is found or not
-                if nv_comp_processes is None and nv_graphics_processes is None:
-                    processes = None   # Not supported (in both cases)
-                else:
-                    nv_comp_processes     = nv_comp_processes or []
-                    nv_graphics_processes = nv_graphics_processes or []
-                    # Iterate through running process found, inspect each process 
-                    # and find corresponding pod (parent container) that run the process
-                    for nv_process in (nv_comp_processes + nv_graphics_processes):
-                        try:
-                            process       = get_process_info(nv_process)
-                            parentProcess = get_parent_process_info(nv_process)
-
-                            processes.append(process)
-                            parentProcesses.append(parentProcess)
-                        except psutil.NoSuchProcess:
-                            LOGGER.error("PSutil No Such Process")
-                        except psutil.Error:
-                            LOGGER.error("PSutil General Error")
-
-                # list, each GPU can have >1 running process(es) (but in Kubernetes 1.8, they should come from same container/pod)
-                pod_details = []
-
-                # iterate throught the pair process (container) & parent process (pod/parent container)
-                for proc,parentProc in zip(processes,parentProcesses):
-                    # get pod detail from parentProc.pid
-                    pod        = get_pod_info(parentProc.pid)
-                    # store the detail
-                    pod_detail = {
-                                    "pod_container_name": pod['container_name'],
-                                    "pod_name"          : pod['name'],
-                                    "pod_namespace"     : pod['namespace'],
-                                    "pod_proc_username" : proc['username'],
-                                    "pod_gpu_usage"     : proc['gpu_memory_usage'],
-                                    "pod_proc_pid"      : proc['pid']               # long data type
-                                }
-                    # information of each pod that runs jobs in kubernetes cluster
-                    pod_details.append(pod_detail)
-
-                # Store utilization per gpu
-                per_gpu_usage = {
-                                "gpu_name" : name,
-                                "gpu_index": index,
-                                "gpu_uuid" : uuid,
-                                "gpu_usage": pod_details
-                               }
-
-                # append per-gpu usage
-                gpus_usage.append(per_gpu_usage)
-            
-            return gpus_usage
-        
-        # init the python-nvml driver
-        N.nvmlInit()
+    def changed(self, fingerprint):
+        """Whether the GPUs changed since the previous probe, which fingerprint replaces
+        A GPU changed when a process started or exited on it, or when its memory used moved by more than
+        memory_change of its previous value; the GPUs changed when one appeared or disappeared. The change is
+        remembered until the next interval is computed.
+        """
+        previous, self.fingerprint = self.fingerprint, fingerprint
+        if previous is None:
+            return False
 
-        # get current utilization in each GPU and corresponding pods details
-        gpus_pod_usage = benchmark_gpu()
+        if set(fingerprint) != set(previous):
+            self.changes = True
+            return True
+        for uuid, (pids, memory) in fingerprint.items():
+            previous_pids, previous_memory = previous[uuid]
+            if pids != previous_pids or abs(memory - previous_memory) > self.memory_change * previous_memory:
+                self.changes = True
+                return True
+        return False
 
-        # close the python-nvml driver        
-        N.nvmlShutdown()
+    def idle(self):
+        """Whether no GPU ran a process when last probed"""
+        return self.fingerprint is not None and not any(pids for pids, _ in self.fingerprint.values())
 
-        # return query result as GPUStat object
-        return GPUStat(gpus_pod_usage)        
+    def next_interval(self, devices):
+        """Compute the seconds until the next sample, once a sample is done
+        Args:
+            devices (list of GPUDevice) : GPUs of the NVML session, probed when adaptive
+        Returns:
+            interval (float) : Seconds between the start of the sample and the start of the next one
+        """
+        if self.adaptive:
+            self.changed(self.probe(devices))
 
+        if not self.adaptive:
+            interval = self.interval
+        elif self.changes:
+            interval = self.min_interval
+        elif self.idle():
+            interval = min(self.current * 2, self.idle_interval)
+        else:
+            interval = min(self.current * 2, self.interval) if self.current < self.interval else self.interval
 
-# --------- Class InfluxdbDriver : handle write process of GPU stats into Influxdb server -------- #
-class InfluxDBDriver:
-    def __init__(self, influxdb_host, influxdb_port, influxdb_user, influxdb_pass, influxdb_db, *args):
-        """Constructor of InfluxDBDriver class
+        # CPU time of all the threads of the agent (collectors, exporters, /metrics) since the previous interval
+        cpu_time, wall_time = process_time(), monotonic()
+        if self.cpu_budget and wall_time > self.wall_time:
+            usage = (cpu_time - self.cpu_time) / (wall_time - self.wall_time)
+            if usage > self.cpu_budget:
+                stretched = self.current * usage / self.cpu_budget
+                if stretched > interval:
+                    LOGGER.debug("Agent used %.1f%% of a CPU, %.1f%% allowed: sampling every %.1fs",
+                                 usage * 100, self.cpu_budget * 100, stretched)
+                    interval = stretched
+        self.cpu_time, self.wall_time = cpu_time, wall_time
+
+        self.changes = False
+        self.current = interval
+        return interval
+
+    def probe_interval(self):
+        """Seconds between two probes of the GPUs while waiting for the next sample, None for no probe"""
+        if not self.adaptive or self.current <= self.interval:
+            return None
+        return self.interval
+
+
+def new_sampling_scheduler(agent_cfg):
+    """Create the scheduler of the daemon from the agent options
+    Returns:
+        scheduler (SamplingScheduler) : Interval of the samples, fixed to sampling_interval unless adaptive_sampling
+    """
+    return SamplingScheduler(agent_cfg["sampling_interval"], agent_cfg["adaptive_sampling"],
+                             agent_cfg["sampling_min_interval"], agent_cfg["sampling_idle_interval"],
+                             agent_cfg["sampling_memory_change"], agent_cfg["cpu_budget"], agent_cfg["start_jitter"])
+
+
+# --------- Class AgentDaemon : sample the GPUs on an adaptive schedule until the agent is told to stop -------- #
+class AgentDaemon(object):
+    def __init__(self, sinks, agent_cfg):
+        """Constructor of AgentDaemon class
         Args:
-            influxdb_host (string) : Hostname (URL) of influxdb server, to store the data for.
-            influxdb_port (string) : Port which infludb server is running on.
-            influxdb_user (string) : Access username.
-            influxdb_pass (string) : Access password.
-            influxdb_db   (string) : db name to write the GPU stats for.
-        Fields: 
-            client (InfluxDBClient): Connection object for the given Influxdb
+            sinks     (list of ExportSink) : Sinks every sample is written to, empty to only serve /metrics
+            agent_cfg (py dictionary)      : Agent options, see AGENT_DEFAULTS
+        Fields:
+            scheduler         (SamplingScheduler)  : Seconds between the start of two samples
+            session           (NVMLSession)        : NVML session kept open for the lifetime of the daemon
+            pod_index         (PodIndex)           : Pid to pod index kept across samples
+            telemetry         (TelemetryCollector) : Collector of the device telemetry, None when disabled
+            pool              (ThreadPoolExecutor) : Collector workers kept across samples, None to collect sequentially
+            rollup            (Rollup)             : Aggregation of the samples over windows, None to export each one
+            store             (RingStore)          : Recent samples kept on the node, None when disabled
+            exports           (ExportFanout)       : Queue and exporter thread of each sink, None without sinks
+            prometheus        (PrometheusExporter) : /metrics endpoint, None when disabled
+            stop_event        (threading.Event)    : Set by SIGTERM/SIGINT to leave the sampling loop
+            profiler          (SamplingProfiler)   : Profiler started by SIGUSR2, None when not running
+            tracker           (ProcessTracker)     : GPU processes followed across samples
+            events            (NVMLEventWatcher)   : Thread reporting the NVML events, None when nvml_events is empty
         """
+        self.scheduler         = new_sampling_scheduler(agent_cfg)
+        self.session           = NVMLSession()
+        self.pod_index         = new_pod_index(agent_cfg)
+        self.telemetry         = new_telemetry_collector(agent_cfg)
+        self.pool              = new_collector_pool(agent_cfg)
+        self.rollup            = new_rollup(agent_cfg)
+        self.store             = new_ring_store(agent_cfg)
+        self.tracker           = ProcessTracker(self.pod_index)
+        self.events            = None
+        self.exports           = None
+        self.prometheus        = None
+        self.stop_event        = threading.Event()
+        self.profiler          = None
+        self.profile_dir       = agent_cfg["profile_dir"]
+        self.profile_interval  = agent_cfg["profile_interval"]
 
-        # Try connecting to influxdb instance
+        if sinks:
+            self.exports = ExportFanout(sinks)
+        if agent_cfg["prometheus_port"]:
+            self.prometheus = PrometheusExporter(agent_cfg["prometheus_port"], agent_cfg["prometheus_address"])
+        if agent_cfg["nvml_events"]:
+            self.events = NVMLEventWatcher(self.session, agent_cfg["nvml_events"], self.exports)
+
+    def stop(self, signum=None, frame=None):
+        """Signal handler, ask the sampling loop to terminate after the current sample"""
+        LOGGER.info("Received signal %s, stopping nvml-agent", signum)
+        self.stop_event.set()
+
+    def reconfigure(self, signum=None, frame=None):
+        """Signal handler, enumerate the GPUs and their MIG devices again before the next sample"""
+        LOGGER.info("Received signal %s, GPUs enumerated again at the next sample", signum)
+        self.session.stale = True
+
+    def toggle_profiler(self, signum=None, frame=None):
+        """Signal handler, start the sampling profiler, or stop it and write its profile"""
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(self.profile_dir, self.profile_interval)
+            self.profiler.start()
+            LOGGER.info("Profiler started, send signal %s again to write the profile", signum)
+            return
+
+        profiler, self.profiler = self.profiler, None
         try:
-            client = InfluxDBClient(influxdb_host,
-                                    influxdb_port,
-                                    influxdb_user,
-                                    influxdb_pass,
-                                    influxdb_db
-                                   )
-        except InfluxDBClientError:
-            client = None
-            LOGGER.error("Influxdb connection does not working") 
+            LOGGER.info("Profile written to %s", profiler.stop())
+        except (IOError, OSError) as err:
+            LOGGER.error("Cannot write the profile: %s", err)
 
-        # this->object->client
-        self.client = client
+    def health(self):
+        """Timings and counters of the agent, with the state of the export queues
+        Returns:
+            health (AgentHealth) : Snapshot attached to the sample
+        """
+        counters = {}
+        gauges   = {"pod_index_containers": len(self.pod_index.by_container_id),
+                    "sampling_interval_s" : self.scheduler.current}
+        if self.exports is not None:
+            self.exports.health(counters, gauges)
 
-    def write(self, gpu_stats):
-        """Write the gpus' usage statistics to influxdb server
-        Args:
-            gpu_stats (GPUStat Obj) : Statistics and details to account GPU usage by Pods.
-        Returns: 
-            None
+        return METRICS.snapshot(counters, gauges)
+
+    def sample(self):
+        """Collect a single sample from the opened NVML session and hand it over to the exporter"""
+        gpu_stats        = GPUStat.new_query(self.session, self.pod_index, self.telemetry, self.pool, self.tracker)
+        gpu_stats.health = self.health()
+        LOGGER.info(gpu_stats.gpus_pod_usage)
+        LOGGER.debug("Success getting statistics from GPU!")
+
+        # scrapes are answered from the page rendered here, between two samples
+        if self.prometheus is not None:
+            self.prometheus.update(gpu_stats)
+
+        # every sample is kept on the node, whatever is exported
+        if self.store is not None:
+            self.store.append(gpu_stats)
+
+        if self.exports is None:
+            return
+
+        # with a rollup, only the aggregates of a window are exported, once the next window starts
+        if self.rollup is not None:
+            gpu_stats = self.rollup.add(gpu_stats)
+            if gpu_stats is None:
+                return
+
+        # the snapshot is not modified anymore once queued, the exporter threads share it
+        self.exports.put(gpu_stats)
+        for sink, queue, exporter in zip(self.exports.sinks, self.exports.queues, self.exports.exporters):
+            LOGGER.debug("Export queue of %s depth %d, %d snapshot(s) dropped, %d exported, %d export error(s)",
+                         sink.name, queue.depth(), queue.dropped, exporter.exported, exporter.export_errors)
+
+    def run(self):
+        """Sample on the schedule of the scheduler until stopped
+        The schedule is anchored to the start time, so the duration of a sample does not make it drift.
+        When a sample overruns one or more ticks, they are skipped instead of being run back to back.
         """
-        # get hostname and timestamp of the query
-        nodename  = gpu_stats.hostname
-        stat_time = gpu_stats.query_time
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR2, self.toggle_profiler)
+        signal.signal(signal.SIGHUP, self.reconfigure)
 
-        # iterate though all available GPU in machine
-        for gpu_stat in gpu_stats.gpus_pod_usage:
-            # Assign and gather identity of each GPU
-            gpu_name  = gpu_stat["gpu_name"]
-            gpu_index = gpu_stat["gpu_index"]
-            gpu_uuid  = gpu_stat["gpu_uuid"]
-            gpu_usage = gpu_stat["gpu_usage"]
-            
-            # iterate through all pods' processes in each gpu     
-            for usage in gpu_usage:
-                # Assign and gather information of pods' utilization
-                pod_container_name = usage['pod_container_name']
-                pod_name           = usage['pod_name']
-                namespace_name     = usage['pod_namespace']
-                pod_gpu_usage      = usage['pod_gpu_usage']
-
-                # Form the data to write with json format
-                json_body = [
-                                {
-                                    "measurement": "gpu/usage",
-                                    "tags": {
-                                        "nodename" : nodename,
-                                        "gpu_name" : gpu_name,
-                                        "gpu_uuid" : gpu_uuid,
-                                        "gpu_index": gpu_index,
-                                        "pod_name" : pod_name,
-                                        "container_name" : pod_container_name,
-                                        "namespace_name" : namespace_name
-                                    },
-                                    "time": stat_time,
-                                    "fields": {
-                                        "value": pod_gpu_usage
-                                    }
-                                }
-                            ]
-
-                # attempt writing into influxdb
+        self.session.open()
+        LOGGER.debug("NVML initialised with %d GPU(s)", len(self.session.devices))
+        if self.exports is not None:
+            self.exports.start()
+        if self.prometheus is not None:
+            self.prometheus.start()
+        if self.events is not None:
+            self.events.start()
+
+        try:
+            # the nodes of the cluster do not all sample, and write, at the same instant
+            next_tick = monotonic() + self.scheduler.start_delay()
+            self.stop_event.wait(next_tick - monotonic())
+            while not self.stop_event.is_set():
+                # a failed sample must not stop the daemon, the next tick tries again
+                try:
+                    self.sample()
+                except (N.NVMLError, psutil.Error) as err:
+                    LOGGER.error("Cannot get statistics from GPU: %s", err)
+                except Exception:
+                    LOGGER.exception("Sampling failed")
+
+                try:
+                    interval = self.scheduler.next_interval(self.session.devices)
+                except N.NVMLError as err:
+                    LOGGER.error("Cannot probe the GPUs: %s", err)
+                    interval = self.scheduler.current
+
+                next_tick += interval
+                now        = monotonic()
+                if next_tick < now:
+                    missed     = int((now - next_tick) // interval) + 1
+                    next_tick += missed * interval
+                    LOGGER.warning("Sampling overran its interval, skipped %d tick(s)", missed)
+
+                # wake up on the next tick, as soon as a stop signal arrives, or when a probe finds the GPUs changed
+                next_tick = self.wait(next_tick)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Close what the daemon opened, then drain the exports"""
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.events is not None:
+            self.events.stop()
+
+        # a watcher still waiting for (or freeing) its event set would call into a library already shut down; the
+        # process exits right after, which releases NVML all the same
+        if self.events is not None and self.events.is_alive():
+            LOGGER.warning("NVML event watcher still running, leaving NVML initialised")
+        else:
+            self.session.close()
+        self.pod_index.runtime_client.close()
+        if self.prometheus is not None:
+            self.prometheus.close()
+        if self.store is not None:
+            self.store.close()
+        if self.profiler is not None:
+            self.toggle_profiler()
+
+        if self.exports is not None:
+            self.drain()
+        LOGGER.info("nvml-agent stopped")
+
+    def wait(self, next_tick):
+        """Wait for the next tick, probing the GPUs meanwhile when the scheduler asks for it
+        Args:
+            next_tick (float) : Monotonic time of the next sample
+        Returns:
+            next_tick (float) : Monotonic time of the next sample, now when a probe found the GPUs changed
+        """
+        probe_interval = self.scheduler.probe_interval()
+        now            = monotonic()
+        while now < next_tick:
+            wake_up = next_tick if probe_interval is None else min(next_tick, now + probe_interval)
+            if self.stop_event.wait(wake_up - now):
+                break
+            now = monotonic()
+            if now < next_tick:
                 try:
-                    self.client.write_points(json_body)
-                except InfluxDBClientError as err:
-                    LOGGER.error("Cannot write into influxdb, check configuration")             
-                    pass 
+                    if self.scheduler.changed(self.scheduler.probe(self.session.devices)):
+                        LOGGER.debug("GPU processes changed, sampling %.1fs ahead of time", next_tick - now)
+                        return now
+                except N.NVMLError as err:
+                    LOGGER.error("Cannot probe the GPUs: %s", err)
+        return next_tick
+
+    def drain(self):
+        """Stop the exporters once they wrote the queued snapshots, or spool them when a backend is still down"""
+        # the window in progress is exported as well, even though it is not complete
+        if self.rollup is not None:
+            rollup = self.rollup.flush()
+            if rollup is not None:
+                self.exports.put(rollup)
+
+        self.exports.drain()
 
 
 def setup_logging():
@@ -358,10 +4124,10 @@ def setup_logging():
     LOGGER.addHandler(ch)
 
 
-def get_influxdb_conf():
-    """Read configuration for influxdb from file with YAML format
+def get_conf_path():
+    """Get the path of the YAML configuration file
     Returns:
-        influx_cfg (py dictionary): information about Influxdb server's hostname, port, username, password and database name
+        path (string) : NVML_INFLUX_CFG from the environment if it is set, the default path otherwise
     """
 
     # Get path configuration file from given env and set default file path in addition
@@ -373,22 +4139,199 @@ def get_influxdb_conf():
     if value:
         default_path = value
 
+    return default_path
+
+
+def load_yaml(path):
+    """Read a YAML file, or the copy of its content parsed by a previous run when the file did not change
+    The content is cached as JSON in CONF_CACHE_DIR, keyed by the path, size, modification time and inode of the
+    file: a restart with the same configuration neither imports yaml nor parses the file again. Only a cache
+    file owned by the agent's user and written by no one else is trusted.
+    Args:
+        path (string) : Path of the YAML file
+    Returns:
+        content (py object) : Parsed content of the file
+    """
+    stat       = os.stat(path)
+    key        = [os.path.realpath(path), stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino]
+    cache_path = os.path.join(CONF_CACHE_DIR, hashlib.sha1(key[0].encode("utf-8")).hexdigest() + ".json")
+    try:
+        with open(cache_path, "r") as cache_file:
+            cache_stat = os.fstat(cache_file.fileno())
+            if cache_stat.st_uid == os.getuid() and not cache_stat.st_mode & 0o022:
+                cached = json.load(cache_file)
+                if cached["key"] == key:
+                    return cached["content"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    import yaml
+    with open(path, "r") as ymlfile:
+        content = yaml.safe_load(ymlfile)
+
+    # only a content that comes back the same from JSON is cached: no dates, no integer keys...
+    try:
+        if json.loads(json.dumps(content)) == content:
+            if not os.path.isdir(CONF_CACHE_DIR):
+                os.makedirs(CONF_CACHE_DIR, 0o700)
+            # the configuration holds credentials: written readable by the agent's user only
+            temp_path = "%s.%d" % (cache_path, os.getpid())
+            with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as cache_file:
+                json.dump({"key": key, "content": content}, cache_file)
+            os.replace(temp_path, cache_path)
+    except (IOError, OSError, TypeError, ValueError) as err:
+        LOGGER.debug("Content of %s not cached: %s", path, err)
+
+    return content
+
+
+def get_influxdb_conf():
+    """Read configuration for influxdb from file with YAML format
+    Returns:
+        influx_cfg (py dictionary): information about Influxdb server's hostname, port, username, password and database name
+    """
+
+    default_path = get_conf_path()
+
     # Read the YAML file
     if os.path.exists(default_path):
-        with open(default_path, "r") as  ymlfile:
-            influx_cfg  = (yaml.load(ymlfile))
+        influx_cfg = load_yaml(default_path)
     else:
         LOGGER.error("Configuration file not found!")
     
     return influx_cfg
 
 
+def get_agent_conf(cfg):
+    """Split the agent options from the influxdb connection settings of the configuration file
+    Args:
+        cfg (py dictionary) : Content of the YAML configuration file, agent options are removed from it
+    Returns:
+        agent_cfg (py dictionary) : Agent options, missing ones are set to their value in AGENT_DEFAULTS
+    """
+    agent_cfg = {}
+    for key, default in AGENT_DEFAULTS.items():
+        agent_cfg[key] = cfg.pop(key, default)
+
+    # the schedule of the daemon divides by them
+    for key in ("sampling_interval", "sampling_min_interval", "sampling_idle_interval"):
+        if not isinstance(agent_cfg[key], (int, float)) or agent_cfg[key] <= 0:
+            raise ValueError("%s must be a number of seconds above 0, got %r" % (key, agent_cfg[key]))
+
+    return agent_cfg
+
+
+def positive_seconds(value):
+    """Type of the --interval argument: a number of seconds above 0"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0
+    if not seconds > 0:
+        raise argparse.ArgumentTypeError("expected a number of seconds above 0, got %r" % value)
+    return seconds
+
+
+def get_args():
+    """Parse command line arguments
+    Returns:
+        args (argparse.Namespace) : --once to collect a single sample, --interval to override sampling_interval,
+                                    --query to print the samples of the ring store
+    """
+    parser = argparse.ArgumentParser(description="Collect per-pod NVIDIA GPU usage and write it into Influxdb")
+    parser.add_argument("--once", action="store_true",
+                        help="collect and write a single sample, then exit")
+    parser.add_argument("--interval", type=positive_seconds, default=None,
+                        help="seconds between two samples in daemon mode (default: sampling_interval from conf.yaml)")
+    parser.add_argument("--resolve-pid", type=int, default=None, metavar="PID",
+                        help="print the pod of a GPU process pid, as get-pod-from-pid.sh does, then exit")
+    parser.add_argument("--query", action="store_true",
+                        help="print the samples kept in the ring store, filtered by --gpu, --pod, --since and --until")
+    parser.add_argument("--store", default=None, metavar="PATH",
+                        help="ring store read by --query (default: ring_store_path from conf.yaml)")
+    parser.add_argument("--gpu", default=None,
+                        help="index or uuid of the GPU printed by --query")
+    parser.add_argument("--pod", default=None,
+                        help="pod name or namespace/name printed by --query, wildcards allowed")
+    parser.add_argument("--since", default=None,
+                        help="first sample printed by --query: seconds ago, or a local time 2024-01-31T12:00:00")
+    parser.add_argument("--until", default=None,
+                        help="last sample printed by --query: seconds ago, or a local time 2024-01-31T12:00:00")
+
+    return parser.parse_args()
+
+
+def resolve_pid(pid):
+    """Print the pod running a process, one value per line:
+    pod uid, container id, container name, pod name and pod namespace (empty lines when not found)
+    Args:
+        pid (int) : Pid of a process that runs on GPU
+    """
+    # the container runtime configured in conf.yaml, docker on its default socket without one
+    cfg = {}
+    if os.path.exists(get_conf_path()):
+        cfg = get_influxdb_conf() or {}
+
+    pod_index = new_pod_index(get_agent_conf(cfg))
+    pod       = pod_index.resolve(pid) or PodInfo("", "", "", "", "")
+    pod_index.runtime_client.close()
+
+    for value in (pod.pod_uid, pod.container_id, pod.container_name, pod.name, pod.namespace):
+        print(value)
+
+
+def parse_query_time(value):
+    """Epoch time of a --since or --until argument: seconds ago, or a local ISO 8601 time; None when not given"""
+    if value is None:
+        return None
+    try:
+        return datetime.now().timestamp() - float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def query_store(args):
+    """Print the records of the ring store matching the --gpu, --pod, --since and --until arguments, one per line:
+    local time, GPU index, GPU uuid, namespace/pod/container (- for the GPU itself), then name=value of each value
+    Args:
+        args (argparse.Namespace) : Parsed command line
+    """
+    path = args.store
+    if path is None:
+        cfg  = get_influxdb_conf() if os.path.exists(get_conf_path()) else {}
+        path = get_agent_conf(cfg or {})["ring_store_path"]
+    if not path:
+        raise SystemExit("No ring store: set ring_store_path in conf.yaml, or give --store")
+
+    store = RingStore(path, readonly=True)
+    try:
+        for timestamp, kind, fields, values in store.query(args.gpu, args.pod, parse_query_time(args.since),
+                                                           parse_query_time(args.until)):
+            owner  = "/".join(fields[2:5]) if kind == RING_STORE_POD else "-"
+            values = " ".join("%s=%s" % (name, "%g" % value if not math.isnan(value) else "-")
+                              for (name, _, _), value in zip(RING_STORE_FIELDS[kind], values))
+            print("%s\t%s\t%s\t%s\t%s" % (datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds"),
+                                          fields[1], fields[0], owner, values))
+    finally:
+        store.close()
+
+
 # --------- Main function goes here -------- #
 def main():
-    """Read stats from GPU and write them into Influxdb server
+    """Read stats from GPU and write them into Influxdb server, once or as a long-running daemon
     Returns None
     """
 
+    args = get_args()
+
+    # Debugging helper, prints on stdout without logging nor influxdb configuration
+    if args.resolve_pid is not None:
+        resolve_pid(args.resolve_pid)
+        return
+    if args.query:
+        query_store(args)
+        return
+
     try:
         # Set the custom logging format 
         setup_logging()
@@ -396,23 +4339,47 @@ def main():
 
         # Get the configuration to connect and write to Influxdb server
         influx_cfg = get_influxdb_conf()
+        agent_cfg  = get_agent_conf(influx_cfg)
         LOGGER.debug("Configuration file successfully loaded!")        
 
-        # Request the GPU statistics
-        gpu_stats  = GPUStat().new_query()
-        LOGGER.info(gpu_stats.gpus_pod_usage)
-        LOGGER.debug("Success getting statistics from GPU!")
-        
-        # Connect into Influxdb instance using given configuration
-        influxClient = InfluxDBDriver(**influx_cfg)
-        # Write the statistics into Influxdb        
-        influxClient.write(gpu_stats)
-        LOGGER.debug("Success writing metrics to Influxdb!")
+        # Connect into Influxdb instance (or the sinks) using given configuration, unless only Prometheus scrapes
+        # the agent
+        sinks = new_sinks(influx_cfg, agent_cfg)
+        if not sinks:
+            LOGGER.info("No influxdb_host nor sinks configured, not writing into Influxdb")
+
+        if args.interval:
+            agent_cfg["sampling_interval"] = args.interval
+
+        if args.once:
+            # Request the GPU statistics
+            pod_index  = new_pod_index(agent_cfg)
+            pool       = new_collector_pool(agent_cfg)
+            gpu_stats  = GPUStat().new_query(pod_index=pod_index, telemetry=new_telemetry_collector(agent_cfg),
+                                             pool=pool)
+            pod_index.runtime_client.close()
+            if pool is not None:
+                pool.shutdown()
+            LOGGER.info(gpu_stats.gpus_pod_usage)
+            LOGGER.debug("Success getting statistics from GPU!")
+
+            # Write the statistics into each sink, with the same retries and spool as the daemon
+            for sink in sinks:
+                exporter = new_export_worker(None, sink.driver, sink.options)
+                if exporter.export(gpu_stats):
+                    LOGGER.debug("Success writing metrics to %s!", sink.name)
+                exporter.close()
+                sink.driver.close()
+        else:
+            # Keep NVML and the sink sessions open, sample until SIGTERM
+            AgentDaemon(sinks, agent_cfg).run()
 
     except IOError:
         LOGGER.error("File does not exist!")
     except TypeError:
         LOGGER.error("Wrong formating in YAML configuration file")
+    except ValueError as err:
+        LOGGER.error("Wrong value in YAML configuration file: %s", err)
     # Catch Error when library is missing
     except N.NVMLError:
         LOGGER.info("NVML Library is missing, no gpu data obtained")
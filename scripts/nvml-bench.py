@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+"""Benchmark of nvml-agent.py against a fake NVML, a fake docker daemon and a fake InfluxDB server
+
+Each scenario runs the sampling and the export of the agent with a number of GPUs and of kubernetes containers,
+one GPU process per container spread over the GPUs, and reports per sample:
+    * the latency of each stage: NVML queries, process lookups, pod resolutions, serialisation and write
+    * the memory allocated (peak) and kept (retained) by the sample and its export, with tracemalloc
+    * the read/write syscalls (from /proc/self/io) and the subprocesses forked
+
+With --startup, it reports instead how long a restarted agent takes to import its modules, read its configuration
+(parsed, then from the cache of a previous run) and collect its first sample, each time in a fresh interpreter.
+
+Nothing is read from the real GPUs, processes or containers of the machine: pynvml is replaced by a fake binding
+before the agent is loaded, the processes live in a fake /proc tree, docker is a fake Engine API on a unix socket and
+InfluxDB a local HTTP server answering 204 to every write.
+"""
+from time import perf_counter, sleep
+
+import argparse
+import hashlib
+import http.server
+import importlib.util
+import json
+import os.path
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+import types
+
+AGENT_SCRIPT  = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nvml-agent.py")
+
+# Fake pids start above the largest pid_max of linux, they never clash with a real process
+FAKE_PID_BASE = 5000000
+
+# Stages timed in each sample, in the order they are reported
+STAGES        = ("sample", "nvml", "process_lookup", "pod_resolution", "serialisation", "write")
+
+# Default scenarios: (GPUs, containers)
+SCENARIOS     = [(1, 10), (4, 10), (8, 100), (16, 100), (16, 500)]
+
+# Modules of the agent only imported by the code paths needing them, none of them is expected in a collect-only start
+OPTIONAL_MODULES = ("influxdb", "requests", "yaml", "http.server", "logging.config")
+
+# Run by run_startup in a fresh interpreter: the agent is loaded first, so its imports are timed whole, and the fakes
+# of the benchmark only once it is loaded. The placeholder of pynvml is filled with the fake NVML before the sample.
+STARTUP_CHILD = """
+from time import perf_counter
+start = perf_counter()
+import importlib.util, sys, types
+sys.modules["pynvml"] = types.ModuleType("pynvml")
+spec  = importlib.util.spec_from_file_location("nvml_agent", %(agent)r)
+agent = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(agent)
+imported = perf_counter()
+loaded   = set(sys.modules)
+spec  = importlib.util.spec_from_file_location("nvml_bench", %(bench)r)
+bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench)
+bench.startup_child(agent, imported - start, loaded, %(gpus)d, %(containers)d, %(conf)r)
+"""
+
+
+# --------- Fake NVML : a pynvml module with a configurable number of GPUs and processes -------- #
+def new_fake_nvml(gpus, processes, latency=0.0):
+    """Build a pynvml module answering with fixed GPUs and processes
+    Args:
+        gpus      (int)            : Number of GPUs on the fake machine
+        processes (list of tuple)  : (gpu index, pid, used bytes) of every process running on a GPU
+        latency   (float)          : Seconds each NVML call takes, as a driver round trip would
+    Returns:
+        nvml (module) : Replacement of pynvml
+    """
+    nvml = types.ModuleType("pynvml")
+
+    class NVMLError(Exception):
+        def __init__(self, value):
+            Exception.__init__(self, "NVML error %d" % value)
+            self.value = value
+
+    class Struct(object):
+        def __init__(self, **fields):
+            self.__dict__.update(fields)
+
+    by_gpu = dict((index, []) for index in range(gpus))
+    for index, pid, used in processes:
+        by_gpu[index].append(Struct(pid=pid, usedGpuMemory=used))
+
+    field_ids = ["NVML_FI_DEV_MEMORY_TEMP", "NVML_FI_DEV_POWER_INSTANT", "NVML_FI_DEV_TOTAL_ENERGY_CONSUMPTION",
+                 "NVML_FI_DEV_ECC_SBE_VOL_TOTAL", "NVML_FI_DEV_ECC_DBE_VOL_TOTAL", "NVML_FI_DEV_ECC_SBE_AGG_TOTAL",
+                 "NVML_FI_DEV_ECC_DBE_AGG_TOTAL", "NVML_FI_DEV_PCIE_REPLAY_COUNTER",
+                 "NVML_FI_DEV_NVLINK_BANDWIDTH_C0_TOTAL"]
+    for field_id, name in enumerate(field_ids, 100):
+        setattr(nvml, name, field_id)
+
+    def call(result):
+        """NVML function waiting latency seconds, then returning result(*args)"""
+        def function(*args):
+            if latency:
+                sleep(latency)
+            return result(*args)
+        return function
+
+    def process_utilization(handle, last_seen):
+        # one sample per process and per second, NVML_ERROR_NOT_FOUND when there is none since last_seen
+        timestamp = int(perf_counter() * 1000000)
+        if timestamp <= last_seen or not by_gpu[handle]:
+            raise NVMLError(nvml.NVML_ERROR_NOT_FOUND)
+        return [Struct(pid=process.pid, timeStamp=timestamp, smUtil=50, memUtil=20, encUtil=0, decUtil=0)
+                for process in by_gpu[handle]]
+
+    def not_supported(*args):
+        raise NVMLError(3)
+
+    nvml.NVMLError                                 = NVMLError
+    nvml.NVML_ERROR_NOT_FOUND                      = 6
+    nvml.NVML_TEMPERATURE_GPU                      = 0
+    nvml.NVML_CLOCK_SM                             = 1
+    nvml.NVML_CLOCK_MEM                            = 2
+    nvml.NVML_PCIE_UTIL_TX_BYTES                   = 0
+    nvml.NVML_PCIE_UTIL_RX_BYTES                   = 1
+    nvml.nvmlInit                                  = call(lambda: None)
+    nvml.nvmlShutdown                              = call(lambda: None)
+    nvml.nvmlDeviceGetCount                        = call(lambda: gpus)
+    nvml.nvmlDeviceGetHandleByIndex                = call(lambda index: index)
+    nvml.nvmlDeviceGetName                         = call(lambda handle: "Tesla V100-SXM2-16GB")
+    nvml.nvmlDeviceGetUUID                         = call(lambda handle: "GPU-%08x-0000-0000-0000-000000000000" % handle)
+    nvml.nvmlDeviceGetComputeRunningProcesses      = call(lambda handle: list(by_gpu[handle]))
+    nvml.nvmlDeviceGetGraphicsRunningProcesses     = call(not_supported)
+    nvml.nvmlDeviceGetProcessUtilization           = call(process_utilization)
+    nvml.nvmlDeviceGetUtilizationRates             = call(lambda handle: Struct(gpu=50, memory=20))
+    nvml.nvmlDeviceGetMemoryInfo                   = call(lambda handle: Struct(used=1 << 30, total=16 << 30))
+    nvml.nvmlDeviceGetTemperature                  = call(lambda handle, sensor: 60)
+    nvml.nvmlDeviceGetPowerUsage                   = call(lambda handle: 150000)
+    nvml.nvmlDeviceGetTotalEnergyConsumption       = call(lambda handle: 123456789)
+    nvml.nvmlDeviceGetClockInfo                    = call(lambda handle, clock: 1380)
+    nvml.nvmlDeviceGetCurrentClocksThrottleReasons = call(lambda handle: 0)
+    nvml.nvmlDeviceGetPcieThroughput               = call(lambda handle, counter: 1000)
+    nvml.nvmlDeviceGetFieldValues                  = call(
+        lambda handle, ids: [Struct(fieldId=field_id, nvmlReturn=0, valueType=3, value=Struct(ullVal=field_id * 10))
+                             for field_id in ids])
+
+    return nvml
+
+
+# --------- Class FakeProc : /proc tree of the fake GPU processes -------- #
+class FakeProc(object):
+    def __init__(self, containers, processes_per_container=1):
+        """Constructor of FakeProc class
+        Args:
+            containers              (int) : Number of kubernetes containers running a GPU process
+            processes_per_container (int) : GPU processes in each container
+        Fields:
+            root       (string)        : Directory mounted in place of /proc
+            containers (py dictionary) : Labels of each container, keyed by container id
+            pids       (list of int)   : Pids of the GPU processes
+        """
+        self.root       = tempfile.mkdtemp(prefix="nvml-bench-proc-")
+        self.containers = {}
+        self.pids       = []
+
+        for container in range(containers):
+            container_id = hashlib.sha256(b"container-%d" % container).hexdigest()
+            pod_uid      = hashlib.md5(b"pod-%d" % container).hexdigest()
+            pod_uid      = "-".join((pod_uid[:8], pod_uid[8:12], pod_uid[12:16], pod_uid[16:20], pod_uid[20:]))
+            self.containers[container_id] = {
+                "io.kubernetes.pod.name"       : "trainer-%d" % container,
+                "io.kubernetes.pod.namespace"  : "ml-%d" % (container % 10),
+                "io.kubernetes.pod.uid"        : pod_uid,
+                "io.kubernetes.container.name" : "trainer"
+            }
+
+            for process in range(processes_per_container):
+                pid = FAKE_PID_BASE + container * processes_per_container + process
+                self.pids.append(pid)
+                self.write(pid, "stat", "%d (python3) S 1 %d %d 0 -1 4194560 %s 4242 0\n"
+                                        % (pid, pid, pid, " ".join(["0"] * 12)))
+                self.write(pid, "cgroup", "0::/kubepods/burstable/pod%s/%s\n" % (pod_uid, container_id))
+                self.write(pid, "status", "Name:\tpython3\nUid:\t0\t0\t0\t0\n")
+                self.write(pid, "cmdline", "/usr/bin/python3\0train.py\0")
+
+    def write(self, pid, name, content):
+        directory = os.path.join(self.root, str(pid))
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+        with open(os.path.join(directory, name), "w") as proc_file:
+            proc_file.write(content)
+
+    def psutil(self):
+        """Build a psutil module whose processes are read from this tree"""
+        proc_root = self.root
+        module    = types.ModuleType("psutil")
+
+        class Error(Exception):
+            pass
+
+        class NoSuchProcess(Error):
+            pass
+
+        class Process(object):
+            def __init__(self, pid):
+                self.path = os.path.join(proc_root, str(pid))
+                if not os.path.isdir(self.path):
+                    raise NoSuchProcess(pid)
+
+            def username(self):
+                with open(os.path.join(self.path, "status")) as status:
+                    for line in status:
+                        if line.startswith("Uid:"):
+                            return "root" if line.split()[1] == "0" else line.split()[1]
+
+            def create_time(self):
+                with open(os.path.join(self.path, "stat")) as stat:
+                    return float(stat.read().rsplit(")", 1)[1].split()[19])
+
+            def cmdline(self):
+                with open(os.path.join(self.path, "cmdline")) as cmdline:
+                    return [argument for argument in cmdline.read().split("\0") if argument]
+
+        module.Error         = Error
+        module.NoSuchProcess = NoSuchProcess
+        module.Process       = Process
+        return module
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+# --------- Fake docker : Engine API listing the containers of the fake /proc tree -------- #
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, containers):
+        socketserver.UnixStreamServer.__init__(self, socket_path, FakeDockerHandler)
+        self.requests = 0
+        self.body     = json.dumps([{"Id": container_id, "Labels": labels}
+                                    for container_id, labels in containers.items()]).encode("utf-8")
+
+
+# --------- Fake InfluxDB : HTTP server accepting every write -------- #
+class FakeInfluxDBHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests += 1
+        self.server.bytes    += len(body)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class FakeInfluxDBServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        http.server.HTTPServer.__init__(self, ("127.0.0.1", 0), FakeInfluxDBHandler)
+        self.requests = 0
+        self.bytes    = 0
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, name="nvml-bench-server")
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def load_agent(nvml):
+    """Load nvml-agent.py as a module on top of the fake NVML binding
+    Returns:
+        agent (module) : A fresh copy of the agent, with its own caches
+    """
+    real_nvml = sys.modules.get("pynvml")
+    sys.modules["pynvml"] = nvml
+    try:
+        spec  = importlib.util.spec_from_file_location("nvml_agent_bench", AGENT_SCRIPT)
+        agent = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(agent)
+    finally:
+        if real_nvml is not None:
+            sys.modules["pynvml"] = real_nvml
+        else:
+            del sys.modules["pynvml"]
+
+    return agent
+
+
+# --------- Class StageTimer : accumulated time of each stage during a sample -------- #
+class StageTimer(object):
+    def __init__(self):
+        """Constructor of StageTimer class
+        Fields:
+            current (py dictionary) : Seconds spent in each stage since the last take(), summed over the workers
+        """
+        self.lock    = threading.Lock()
+        self.current = dict((stage, 0.0) for stage in STAGES)
+
+    def wrap(self, stage, function):
+        """Wrap function so its calls are accounted in stage"""
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                with self.lock:
+                    self.current[stage] += elapsed
+        return timed
+
+    def take(self):
+        with self.lock:
+            current      = self.current
+            self.current = dict((stage, 0.0) for stage in STAGES)
+        return current
+
+
+class CountingPopen(subprocess.Popen):
+    """subprocess.Popen counting the processes it forks"""
+    forks = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.forks += 1
+        subprocess.Popen.__init__(self, *args, **kwargs)
+
+
+def read_syscalls():
+    """Read and write syscalls made by this process so far, None where /proc/self/io is not available"""
+    try:
+        with open("/proc/self/io") as io:
+            counters = dict(line.split(":", 1) for line in io.read().splitlines())
+        return int(counters["syscr"]) + int(counters["syscw"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def percentile(values, quantile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))] if values else 0.0
+
+
+def run_scenario(gpus, containers, samples=20, threads=8, latency=0.0, processes_per_container=1):
+    """Sample and export a fake machine, stage by stage
+    Args:
+        gpus                    (int)   : Number of GPUs
+        containers              (int)   : Number of kubernetes containers running on the GPUs
+        samples                 (int)   : Samples measured, after a first one warming up the caches
+        threads                 (int)   : collector_threads of the agent
+        latency                 (float) : Seconds each NVML call takes
+        processes_per_container (int)   : GPU processes in each container
+    Returns:
+        result (py dictionary) : p50/p95 latency of each stage in ms, allocations in KB, syscalls and forks per sample
+    """
+    proc      = FakeProc(containers, processes_per_container)
+    processes = [(position % gpus, pid, (position + 1) << 20) for position, pid in enumerate(proc.pids)]
+    agent     = load_agent(new_fake_nvml(gpus, processes, latency))
+    agent.psutil = proc.psutil()
+    agent.LOGGER.disabled = True
+
+    docker_dir = tempfile.mkdtemp(prefix="nvml-bench-")
+    docker     = serve(FakeDockerServer(os.path.join(docker_dir, "docker.sock"), proc.containers))
+    influxdb   = serve(FakeInfluxDBServer())
+    timer      = StageTimer()
+
+    agent_cfg                      = dict(agent.AGENT_DEFAULTS)
+    agent_cfg["collector_threads"] = threads
+    session   = agent.NVMLSession()
+    session.open()
+    pod_index = agent.PodIndex(agent.DockerRuntimeClient(docker.server_address),
+                               cgroup_resolver=agent.CgroupResolver(proc.root))
+    telemetry = agent.new_telemetry_collector(agent_cfg)
+    pool      = agent.new_collector_pool(agent_cfg)
+    tracker   = agent.ProcessTracker(pod_index)
+    driver    = agent.InfluxDBDriver("127.0.0.1", influxdb.server_address[1], "root", "root", "k8s")
+
+    # every stage is timed where the agent calls it, on the instances it is given
+    telemetry.collect           = timer.wrap("nvml", telemetry.collect)
+    telemetry.collect_processes = timer.wrap("nvml", telemetry.collect_processes)
+    for name in ("nvmlDeviceGetComputeRunningProcesses", "nvmlDeviceGetGraphicsRunningProcesses"):
+        setattr(agent.N, name, timer.wrap("nvml", getattr(agent.N, name)))
+    for name in ("create_time", "username", "cmdline"):
+        setattr(agent.psutil.Process, name, timer.wrap("process_lookup", getattr(agent.psutil.Process, name)))
+    agent.psutil.Process        = timer.wrap("process_lookup", agent.psutil.Process)
+    pod_index.resolve           = timer.wrap("pod_resolution", pod_index.resolve)
+    driver.encode               = timer.wrap("serialisation", driver.encode)
+    driver.send                 = timer.wrap("write", driver.send)
+
+    def sample():
+        start     = perf_counter()
+        gpu_stats = agent.GPUStat.new_query(session, pod_index, telemetry, pool, tracker)
+        elapsed   = perf_counter() - start
+        driver.write(gpu_stats)
+        stages           = timer.take()
+        stages["sample"] = elapsed
+        return stages
+
+    real_popen       = subprocess.Popen
+    subprocess.Popen = CountingPopen
+    try:
+        # first sample: lists the containers and fills the caches, as the first sample of the daemon does
+        sample()
+
+        latencies = dict((stage, []) for stage in STAGES)
+        syscalls  = []
+        forks     = CountingPopen.forks
+        for _ in range(samples):
+            before = read_syscalls()
+            for stage, elapsed in sample().items():
+                latencies[stage].append(elapsed * 1000)
+            after  = read_syscalls()
+            if before is not None and after is not None:
+                syscalls.append(after - before)
+        forks = CountingPopen.forks - forks
+
+        # allocations are measured apart, tracemalloc slows every allocation down
+        peaks    = []
+        tracemalloc.start()
+        retained = tracemalloc.get_traced_memory()[0]
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            sample()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        retained = tracemalloc.get_traced_memory()[0] - retained
+        tracemalloc.stop()
+    finally:
+        subprocess.Popen = real_popen
+        if pool is not None:
+            pool.shutdown()
+        pod_index.runtime_client.close()
+        driver.close()
+        session.close()
+        for server in (docker, influxdb):
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(docker_dir, ignore_errors=True)
+        proc.close()
+
+    result = {
+        "gpus"                 : gpus,
+        "containers"           : containers,
+        "samples"              : samples,
+        "alloc_peak_kb"        : round(percentile(peaks, 0.5) / 1024.0, 1),
+        "alloc_retained_kb"    : round(retained / 1024.0 / samples, 1),
+        "syscalls_per_sample"  : percentile(syscalls, 0.5) if syscalls else None,
+        "forks_per_sample"     : float(forks) / samples,
+        "influxdb_requests"    : influxdb.requests
+    }
+    for stage in STAGES:
+        result[stage + "_p50_ms"] = round(percentile(latencies[stage], 0.5), 3)
+        result[stage + "_p95_ms"] = round(percentile(latencies[stage], 0.95), 3)
+
+    return result
+
+
+def startup_child(agent, import_time, loaded, gpus, containers, conf_path):
+    """Read the configuration and collect the first sample of a freshly loaded agent, print the timings as JSON
+    Args:
+        agent       (module) : Agent loaded by STARTUP_CHILD
+        import_time (float)  : Seconds the agent took to load
+        loaded      (set)    : Modules imported once the agent was loaded, before the benchmark itself
+        gpus        (int)    : Number of GPUs
+        containers  (int)    : Number of kubernetes containers running on the GPUs
+        conf_path   (string) : conf.yaml of the agent, cached in NVML_AGENT_CACHE_DIR
+    """
+    modules   = len(loaded)
+    proc      = FakeProc(containers)
+    processes = [(position % gpus, pid, (position + 1) << 20) for position, pid in enumerate(proc.pids)]
+    docker    = serve(FakeDockerServer(os.path.join(proc.root, "docker.sock"), proc.containers))
+    # the agent bound the placeholder module as default argument, it gets the fake bindings in place
+    vars(agent.N).update((name, value) for name, value in vars(new_fake_nvml(gpus, processes)).items()
+                         if not name.startswith("__"))
+    agent.psutil = proc.psutil()
+    agent.LOGGER.disabled = True
+
+    try:
+        # the benchmark imports some of them itself, only the ones imported by the agent count
+        before    = set(sys.modules)
+        start     = perf_counter()
+        agent_cfg = agent.get_agent_conf(agent.load_yaml(conf_path))
+        conf_time = perf_counter() - start
+
+        # what the daemon does before and for its first sample
+        start     = perf_counter()
+        session   = agent.NVMLSession()
+        session.open()
+        pod_index = agent.PodIndex(agent.DockerRuntimeClient(docker.server_address),
+                                   cgroup_resolver=agent.CgroupResolver(proc.root))
+        pool      = agent.new_collector_pool(agent_cfg)
+        agent.GPUStat.new_query(session, pod_index, agent.new_telemetry_collector(agent_cfg), pool,
+                                agent.ProcessTracker(pod_index))
+        sample_time = perf_counter() - start
+
+        optional = [module for module in OPTIONAL_MODULES
+                    if module in loaded or (module in sys.modules and module not in before)]
+        if pool is not None:
+            pool.shutdown()
+        pod_index.runtime_client.close()
+        session.close()
+    finally:
+        docker.shutdown()
+        docker.server_close()
+        proc.close()
+
+    print(json.dumps({"import_ms": import_time * 1000, "conf_ms": conf_time * 1000,
+                      "first_sample_ms": sample_time * 1000, "modules": modules, "optional_modules": optional}))
+
+
+def run_startup(runs=10, gpus=8, containers=100):
+    """Start the agent runs times, each in a fresh interpreter, on the same configuration file
+    The first run parses the configuration and caches it, the next ones read it from the cache.
+    Args:
+        runs       (int) : Fresh interpreters started, at least 2
+        gpus       (int) : Number of GPUs
+        containers (int) : Number of kubernetes containers running on the GPUs
+    Returns:
+        result (py dictionary) : p50 of each part of the start in ms, and the modules the agent imported
+    """
+    directory = tempfile.mkdtemp(prefix="nvml-bench-startup-")
+    conf_path = os.path.join(directory, "conf.yaml")
+    with open(conf_path, "w") as conf:
+        conf.write("influxdb_host: \"\"\ncollector_threads: 8\nsampling_interval: 5\n")
+    env       = dict(os.environ, NVML_AGENT_CACHE_DIR=os.path.join(directory, "cache"))
+    code      = STARTUP_CHILD % {"agent": AGENT_SCRIPT, "bench": os.path.abspath(__file__), "gpus": gpus,
+                                 "containers": containers, "conf": conf_path}
+
+    try:
+        interpreter = []
+        children    = []
+        for _ in range(max(runs, 2)):
+            start = perf_counter()
+            subprocess.check_call([sys.executable, "-c", "pass"], env=env)
+            interpreter.append((perf_counter() - start) * 1000)
+            children.append(json.loads(subprocess.check_output([sys.executable, "-c", code], env=env)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    warm   = children[1:]
+    result = {
+        "startup"          : True,
+        "gpus"             : gpus,
+        "containers"       : containers,
+        "runs"             : len(children),
+        "interpreter_ms"   : round(percentile(interpreter, 0.5), 1),
+        "import_ms"        : round(percentile([child["import_ms"] for child in children], 0.5), 1),
+        "conf_parse_ms"    : round(children[0]["conf_ms"], 2),
+        "conf_ms"          : round(percentile([child["conf_ms"] for child in warm], 0.5), 2),
+        "first_sample_ms"  : round(percentile([child["first_sample_ms"] for child in warm], 0.5), 1),
+        "modules"          : children[-1]["modules"],
+        "optional_modules" : " ".join(children[-1]["optional_modules"]) or "-"
+    }
+    result["time_to_first_sample_ms"] = round(result["interpreter_ms"] + result["import_ms"] + result["conf_ms"] +
+                                              result["first_sample_ms"], 1)
+    return result
+
+
+def print_results(results):
+    if results and results[0].get("startup"):
+        columns = ["gpus", "containers", "interpreter_ms", "import_ms", "conf_parse_ms", "conf_ms", "first_sample_ms",
+                   "time_to_first_sample_ms", "modules", "optional_modules"]
+        widths  = [max(len(column), 8) for column in columns]
+        print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+        for result in results:
+            print("  ".join(str(result[column]).rjust(width) for column, width in zip(columns, widths)))
+        return
+
+    columns = ["gpus", "containers"] + ["%s_p50_ms" % stage for stage in STAGES] + \
+              ["sample_p95_ms", "alloc_peak_kb", "alloc_retained_kb", "syscalls_per_sample", "forks_per_sample"]
+    widths  = [max(len(column), 8) for column in columns]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).rjust(width) for column, width in zip(columns, widths)))
+
+
+def compare(results, baseline, tolerance):
+    """Find the scenarios whose sample or write latency, or the start, regressed by more than tolerance over the baseline
+    Returns:
+        regressions (list of string) : One message per regression
+    """
+    previous    = dict(((result["gpus"], result["containers"], result.get("startup", False)), result)
+                       for result in baseline)
+    regressions = []
+    for result in results:
+        reference = previous.get((result["gpus"], result["containers"], result.get("startup", False)))
+        if reference is None:
+            continue
+        if result.get("startup"):
+            # a cached configuration is read in well under a millisecond, it only counts in the total
+            columns = ("import_ms", "first_sample_ms", "time_to_first_sample_ms")
+        else:
+            columns = ("sample_p50_ms", "serialisation_p50_ms", "write_p50_ms", "alloc_peak_kb")
+        for column in columns:
+            # below a tenth of a millisecond or kilobyte, the difference is noise
+            if result[column] > max(reference[column] * (1 + tolerance), reference[column] + 0.1):
+                regressions.append("%d GPU(s), %d container(s): %s %s -> %s"
+                                   % (result["gpus"], result["containers"], column, reference[column], result[column]))
+    return regressions
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark nvml-agent.py against fake NVML, docker and InfluxDB")
+    parser.add_argument("--scenario", action="append", default=None, metavar="GPUS:CONTAINERS",
+                        help="GPUs and containers of a scenario, repeatable (default: %s)"
+                             % " ".join("%d:%d" % scenario for scenario in SCENARIOS))
+    parser.add_argument("--samples", type=int, default=20,
+                        help="samples measured per scenario (default: 20)")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="collector_threads of the agent (default: 8)")
+    parser.add_argument("--nvml-latency", type=float, default=0.0, metavar="SECONDS",
+                        help="time each fake NVML call takes (default: 0)")
+    parser.add_argument("--processes-per-container", type=int, default=1,
+                        help="GPU processes in each container (default: 1)")
+    parser.add_argument("--save", metavar="FILE",
+                        help="write the results as a JSON baseline")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with a JSON baseline, exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown over the baseline reported as a regression (default: 0.25)")
+    parser.add_argument("--startup", action="store_true",
+                        help="benchmark the start of the agent in fresh interpreters instead of the scenarios, "
+                             "on the first --scenario (default: 8:100)")
+    parser.add_argument("--startup-runs", type=int, default=10,
+                        help="fresh interpreters started with --startup (default: 10)")
+    parser.add_argument("--startup-target", type=float, default=None, metavar="MS",
+                        help="exit 1 when the time to the first sample is above this many ms with --startup")
+
+    return parser.parse_args()
+
+
+def main():
+    args      = get_args()
+    scenarios = [tuple(int(value) for value in scenario.split(":")) for scenario in args.scenario] \
+                if args.scenario else SCENARIOS
+
+    if args.startup:
+        gpus, containers = scenarios[0] if args.scenario else (8, 100)
+        results          = [run_startup(args.startup_runs, gpus, containers)]
+    else:
+        results = [run_scenario(gpus, containers, args.samples, args.threads, args.nvml_latency,
+                                args.processes_per_container)
+                   for gpus, containers in scenarios]
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+    if args.startup and args.startup_target is not None and \
+       results[0]["time_to_first_sample_ms"] > args.startup_target:
+        print("REGRESSION time to the first sample %sms above the %sms target"
+              % (results[0]["time_to_first_sample_ms"], args.startup_target))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from time import sleep
 
+import concurrent.futures
 import pynvml as N
 import psutil
 import os.path
@@ -45,8 +46,31 @@ def get_process_info(nv_process):
     
     return process
 
-def benchmark_gpu():
-    """Query all utilizations in each GPU and resolve them to pod information and identity"""
+def get_pod_info(pid):
+    """Resolve a process pid to its pod with get-pod-from-pid.sh
+    Args:
+        pid (int) : Pid of a process that runs on GPU
+    Returns:
+        pod (list of string) : Pod's container name, pod name and pod namespace
+    """
+    # trigger bash script to resolve process pid to pod information
+    p = subprocess.Popen(
+        ["bash", "get-pod-from-pid.sh", str(pid) ],
+        stdin  = subprocess.PIPE,
+        stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+        universal_newlines = True)
+    out, err   = p.communicate()
+
+    # Get the result from stdout, see "get-pod-from-pid" for more details
+    # container, pod and namespace
+    return out.split("\n")[2:5]
+
+def benchmark_gpu(pool):
+    """Query all utilizations in each GPU and resolve them to pod information and identity
+    Args:
+        pool (ThreadPoolExecutor) : Workers resolving the processes of all GPUs to their pods concurrently
+    """
     
     # detect all NVIDIA GPU in machine
     device_count = N.nvmlDeviceGetCount()
@@ -79,9 +103,7 @@ def benchmark_gpu():
             nv_graphics_processes = None  # Not supported
 
         # Check if process is found or not
-        if nv_comp_processes is None and nv_graphics_processes is None:
-            processes = None   # Not supported (in both cases)
-        else:
+        if nv_comp_processes is not None or nv_graphics_processes is not None:
             nv_comp_processes     = nv_comp_processes or []
             nv_graphics_processes = nv_graphics_processes or []
             # Iterate through running process found, inspect each process 
@@ -94,30 +116,23 @@ def benchmark_gpu():
                 except psutil.Error:
                     LOGGER.debug("PSutil General Error")
 
+        gpus_usage.append((index, name, uuid, processes))
+
+    # resolve every distinct process of all GPUs to its pod at once, instead of one GPU after the other
+    pids = sorted(set(proc['pid'] for _, _, _, processes in gpus_usage for proc in processes))
+    pods = dict(zip(pids, pool.map(get_pod_info, pids)))
+
+    for index, name, uuid, processes in gpus_usage:
         # Display NVIDIA GPU information
         LOGGER.debug(",".join([str(index), name, uuid]))
 
         # iterate throught the process (container) that runs on GPU
         for proc in processes:
-            # trigger bash script to resolve process pid to pod information
-            p = subprocess.Popen(
-                ["bash", "get-pod-from-pid.sh", str(proc['pid']) ],
-                stdin  = subprocess.PIPE,
-                stdout = subprocess.PIPE,
-                stderr = subprocess.PIPE)
-            out, err   = p.communicate()
-
-            # Get the result from stdout, see "get-pod-from-pid" for more details
-            container  = out.split("\n")[2]
-            pod        = out.split("\n")[3]
-            namespace  = out.split("\n")[4]
+            container, pod, namespace = (pods[proc['pid']] + ["", "", ""])[:3]
 
             # Display pod information and its usage
             LOGGER.debug(",".join([str(index)+":",container,pod,namespace,proc['username'],str(proc['gpu_memory_usage']),str(proc['pid'])]))
 
-        # Set one second delay between each GPU statistics    
-        sleep(1)  
-
 def setup_logging():
     """Configure custom logging format
     Returns None
@@ -151,11 +166,14 @@ def main():
     try:
         # init the python-nvml driver
         N.nvmlInit()
+
+        # workers resolving the pods of the processes, kept across queries
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
         
         # Loop forever
         while True:
             # Get the stats and print them
-            benchmark_gpu()
+            benchmark_gpu(pool)
 
             # Set one second delay between queries
             sleep(1)
@@ -0,0 +1,97 @@
+import importlib.util
+import os.path
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "nvml-agent.py")
+
+
+@pytest.fixture(scope="session")
+def agent():
+    """nvml-agent.py loaded as a module, the tests are skipped where its dependencies are not installed"""
+    for module in ("pynvml", "psutil", "influxdb", "requests", "yaml"):
+        pytest.importorskip(module)
+
+    if "nvml_agent" not in sys.modules:
+        spec   = importlib.util.spec_from_file_location("nvml_agent", SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["nvml_agent"] = module
+        spec.loader.exec_module(module)
+
+    return sys.modules["nvml_agent"]
+
+
+class FakeProcess(object):
+    """Process listed by NVML on a GPU, with the GPU and compute instance ids of its MIG device when given"""
+
+    def __init__(self, pid, used_bytes, gpu_instance_id=None, compute_instance_id=None):
+        self.pid               = pid
+        self.usedGpuMemory     = used_bytes
+        self.gpuInstanceId     = gpu_instance_id
+        self.computeInstanceId = compute_instance_id
+
+
+class FakeNVML(object):
+    """NVML binding of count Tesla V100, whose handles are their indexes, listing the compute processes of each GPU
+    from processes as FakeProcess arguments; graphics processes are not supported. The test modules extend it
+    (MIG devices, events...) and select their class with the nvml_class fixture."""
+    count = 2
+
+    class NVMLError(Exception):
+        def __init__(self, value=None):
+            Exception.__init__(self, value)
+            self.value = value
+
+    def __init__(self):
+        self.processes   = dict((handle, []) for handle in range(self.count))
+        self.probes      = 0
+        self.initialized = False
+
+    def nvmlInit(self):
+        self.initialized = True
+
+    def nvmlShutdown(self):
+        self.initialized = False
+
+    def nvmlDeviceGetCount(self):
+        return self.count
+
+    def nvmlDeviceGetHandleByIndex(self, index):
+        return index
+
+    def nvmlDeviceGetName(self, handle):
+        return b"Tesla V100"
+
+    def nvmlDeviceGetUUID(self, handle):
+        return "GPU-%04d" % handle
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        self.probes += 1
+        return [FakeProcess(*process) for process in self.processes.get(handle, [])]
+
+    def nvmlDeviceGetGraphicsRunningProcesses(self, handle):
+        raise self.NVMLError("not supported")
+
+
+@pytest.fixture
+def nvml_class():
+    """Class of the fake NVML binding, overridden by the test modules extending FakeNVML"""
+    return FakeNVML
+
+
+@pytest.fixture
+def nvml(agent, monkeypatch, nvml_class):
+    """Fake NVML binding in place of pynvml"""
+    nvml = nvml_class()
+    monkeypatch.setattr(agent, "N", nvml)
+    return nvml
+
+
+@pytest.fixture
+def session(agent, nvml):
+    """NVML session opened on the fake binding"""
+    session = agent.NVMLSession()
+    session.open()
+    yield session
+    session.close()
@@ -0,0 +1,45 @@
+import importlib.util
+import os.path
+
+import pytest
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "nvml-bench.py")
+
+
+@pytest.fixture(scope="module")
+def bench(agent):
+    spec   = importlib.util.spec_from_file_location("nvml_bench", BENCH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_scenario_reports_every_stage(bench):
+    result = bench.run_scenario(2, 5, samples=2, threads=2)
+
+    for stage in bench.STAGES:
+        assert result[stage + "_p50_ms"] >= 0
+    assert result["process_lookup_p50_ms"] > 0
+    # the processes are followed across samples, only the first one resolves their pods
+    assert result["pod_resolution_p50_ms"] == 0
+    assert result["forks_per_sample"] == 0
+
+
+def test_regressions_are_reported_over_the_tolerance(bench):
+    baseline = [{"gpus": 1, "containers": 10, "sample_p50_ms": 10.0, "serialisation_p50_ms": 1.0,
+                 "write_p50_ms": 1.0, "alloc_peak_kb": 100.0}]
+    result   = dict(baseline[0], sample_p50_ms=14.0)
+
+    assert bench.compare([result], baseline, 0.25) == ["1 GPU(s), 10 container(s): sample_p50_ms 10.0 -> 14.0"]
+    assert bench.compare([dict(baseline[0], sample_p50_ms=12.0)], baseline, 0.25) == []
+
+
+def test_startup_reads_the_cached_configuration_without_optional_modules(bench):
+    result = bench.run_startup(runs=2, gpus=1, containers=2)
+
+    assert result["runs"] == 2
+    assert result["import_ms"] > 0 and result["first_sample_ms"] > 0
+    assert result["time_to_first_sample_ms"] >= result["interpreter_ms"] + result["import_ms"]
+    # yaml parsed the configuration of the first run only
+    assert result["optional_modules"] == "-"
+    assert bench.compare([dict(result, import_ms=result["import_ms"] * 2)], [result], 0.25) != []
@@ -0,0 +1,123 @@
+import pytest
+
+TAGS = {"nodename": "node-1", "gpu_uuid": "GPU-0000", "pod_name": "train-0"}
+
+
+@pytest.fixture
+def delta(agent):
+    return agent.DeltaFilter(deadband=0.1, heartbeat=60)
+
+
+def test_only_changed_fields_are_written(delta):
+    assert delta.filter([("gpu/usage", TAGS, {"value": 100, "sm_util": 50.0})], 0) == \
+        [("gpu/usage", TAGS, {"value": 100, "sm_util": 50.0})]
+
+    # within the deadband of the written values: nothing to write
+    assert delta.filter([("gpu/usage", TAGS, {"value": 105, "sm_util": 54.0})], 5) == []
+
+    # out of the deadband: only that field is written
+    assert delta.filter([("gpu/usage", TAGS, {"value": 111, "sm_util": 54.0})], 10) == \
+        [("gpu/usage", TAGS, {"value": 111})]
+
+
+def test_deadband_is_relative_to_the_value_last_written(delta):
+    delta.filter([("gpu/telemetry", TAGS, {"power": 100})], 0)
+
+    # a slow drift is written once it adds up to more than the deadband
+    assert delta.filter([("gpu/telemetry", TAGS, {"power": 106})], 5) == []
+    assert delta.filter([("gpu/telemetry", TAGS, {"power": 112})], 10) == [("gpu/telemetry", TAGS, {"power": 112})]
+
+
+def test_heartbeat_writes_every_field(delta):
+    delta.filter([("gpu/usage", TAGS, {"value": 100, "sm_util": 50.0})], 0)
+    assert delta.filter([("gpu/usage", TAGS, {"value": 100, "sm_util": 50.0})], 30) == []
+    assert delta.filter([("gpu/usage", TAGS, {"value": 100, "sm_util": 50.0})], 60) == \
+        [("gpu/usage", TAGS, {"value": 100, "sm_util": 50.0})]
+
+
+def test_pod_start_and_stop_are_reported(agent, delta):
+    other = dict(TAGS, pod_name="train-1")
+
+    # the pods running when the agent starts are not reported as started
+    assert delta.filter([("gpu/usage", TAGS, {"value": 100})], 0) == [("gpu/usage", TAGS, {"value": 100})]
+
+    assert delta.filter([("gpu/usage", TAGS, {"value": 100}), ("gpu/usage", other, {"value": 10})], 5) == [
+        ("gpu/usage", other, {"value": 10}),
+        (agent.DeltaFilter.EVENT_MEASUREMENT, other, {"event": "start"})
+    ]
+    # stopped once missing from two samples in a row
+    assert delta.filter([("gpu/usage", other, {"value": 10})], 10) == []
+    assert delta.filter([("gpu/usage", other, {"value": 10})], 15) == \
+        [(agent.DeltaFilter.EVENT_MEASUREMENT, TAGS, {"event": "stop"})]
+
+
+def test_series_missing_from_one_sample_is_kept(delta):
+    delta.filter([("gpu/usage", TAGS, {"value": 100, "sm_util": 50.0})], 0)
+
+    # neither a stop/start pair nor a full write of the series
+    assert delta.filter([], 10) == []
+    assert delta.filter([("gpu/usage", TAGS, {"value": 100, "sm_util": 60.0})], 15) == \
+        [("gpu/usage", TAGS, {"sm_util": 60.0})]
+
+
+def test_rollback_restores_the_last_commit(agent, delta):
+    other = dict(TAGS, pod_name="train-1")
+    delta.filter([("gpu/usage", TAGS, {"value": 100})], 0)
+    delta.commit()
+
+    points = [("gpu/usage", TAGS, {"value": 200}), ("gpu/usage", other, {"value": 10})]
+    written = delta.filter(points, 5)
+    delta.rollback()
+
+    # the points of the rolled back sample are filtered again as if it never happened
+    assert delta.filter(points, 10) == written
+    delta.commit()
+    assert delta.filter(points, 15) == []
+
+
+class DownInfluxDBClient(object):
+    """InfluxDBClient failing the write requests until it is up"""
+
+    def __init__(self):
+        self.up       = False
+        self.requests = []
+
+    def request(self, **kwargs):
+        from influxdb.exceptions import InfluxDBServerError
+
+        if not self.up:
+            raise InfluxDBServerError("503 Service Unavailable")
+        self.requests.append(kwargs)
+
+    def close(self):
+        pass
+
+
+def test_dropped_points_are_written_again(agent):
+    driver        = agent.InfluxDBDriver("localhost", 8086, "root", "root", "k8s", delta=agent.DeltaFilter())
+    driver.client = DownInfluxDBClient()
+    worker        = agent.ExportWorker(None, driver, retries=0, backoff=0)
+    stats         = agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000", telemetry={"temperature_c": 60})])
+
+    assert not worker.export(stats)
+
+    # the backend is back, the sample dropped meanwhile is not taken as written
+    driver.client.up    = True
+    worker.circuit_open = False
+    assert worker.export(stats)
+    assert len(driver.client.requests) == 1
+    assert driver.encode(stats) == []
+
+
+def test_driver_encodes_the_delta(agent):
+    driver = agent.InfluxDBDriver("localhost", 8086, "root", "root", "k8s", delta=agent.DeltaFilter())
+    stats  = agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000",
+                                              telemetry={"temperature_c": 60, "power_usage_mw": 150000})])
+
+    assert len(driver.encode(stats)) == 1
+    assert driver.encode(stats) == []
+    stats.gpus_pod_usage[0].telemetry["temperature_c"] = 61
+    lines = driver.encode(stats)
+    assert len(lines) == 1
+    assert " temperature_c=61i " in lines[0]
+    assert "power_usage_mw" not in lines[0]
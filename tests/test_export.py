@@ -0,0 +1,231 @@
+import threading
+
+import pytest
+
+
+class StubInfluxDBClient(object):
+    """InfluxDBClient recording the write requests, raising the queued errors first"""
+
+    def __init__(self, errors=()):
+        self.errors   = list(errors)
+        self.requests = []
+
+    def request(self, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.requests.append(kwargs)
+
+    def close(self):
+        pass
+
+
+def snapshot(agent, temperature=60):
+    return agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000", telemetry={"temperature_c": temperature})])
+
+
+def iter_spool(spool):
+    record = spool.peek()
+    while record is not None:
+        yield record[0]
+        spool.commit(record[1])
+        record = spool.peek()
+
+
+@pytest.fixture
+def driver(agent):
+    driver        = agent.InfluxDBDriver("localhost", 8086, "root", "root", "k8s")
+    driver.client = StubInfluxDBClient()
+    return driver
+
+
+def test_client_is_given_a_timeout(agent, monkeypatch):
+    calls = []
+    monkeypatch.setattr(agent, "InfluxDBClient", lambda *args, **kwargs: calls.append(kwargs))
+    agent.InfluxDBDriver("localhost", 8086, "root", "root", "k8s", influxdb_timeout=3)
+
+    assert calls == [{"timeout": 3.0}]
+
+
+def test_server_errors_are_export_errors(agent, driver):
+    from influxdb.exceptions import InfluxDBServerError
+
+    driver.client.errors.append(InfluxDBServerError("503 Service Unavailable"))
+    with pytest.raises(agent.ExportError):
+        driver.send(["gpu/telemetry temperature_c=60i 0"])
+
+
+def test_server_errors_are_retried_then_spooled(agent, driver, tmp_path):
+    from influxdb.exceptions import InfluxDBServerError
+
+    driver.client.errors.extend([InfluxDBServerError("500"), InfluxDBServerError("502")])
+    spool  = agent.DiskSpool(str(tmp_path))
+    worker = agent.ExportWorker(None, driver, retries=1, backoff=0, spool=spool)
+
+    assert not worker.export(snapshot(agent))
+    assert worker.export_errors == 2
+    assert spool.peek() is not None
+
+    # the backend is known to be down: close() spools the buffered points without raising
+    driver.add(snapshot(agent))
+    worker.close()
+    assert driver.client.requests == []
+    assert len(list(iter_spool(worker.spool))) == 2
+
+
+class BlockingInfluxDBClient(StubInfluxDBClient):
+    """InfluxDBClient whose writes hang until released, as with a blackholed server"""
+
+    def __init__(self):
+        StubInfluxDBClient.__init__(self)
+        self.entered  = threading.Event()
+        self.released = threading.Event()
+
+    def request(self, **kwargs):
+        self.entered.set()
+        self.released.wait(10)
+        StubInfluxDBClient.request(self, **kwargs)
+
+
+def test_drain_spools_the_queue_when_the_exporter_is_stuck(agent, driver, tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, "EXPORT_DRAIN_TIMEOUT", 0.1)
+    monkeypatch.setattr(agent, "EXPORT_ABORT_TIMEOUT", 0.1)
+
+    driver.client = BlockingInfluxDBClient()
+    options       = dict(agent.AGENT_DEFAULTS, queue_size=10, spool_dir=str(tmp_path))
+    exports       = agent.ExportFanout([agent.ExportSink("influxdb", driver, options)])
+    queue, worker = exports.queues[0], exports.exporters[0]
+    exports.start()
+
+    exports.put(snapshot(agent, 60))
+    assert driver.client.entered.wait(5)
+    exports.put(snapshot(agent, 61))
+    exports.put(snapshot(agent, 62))
+
+    daemon         = agent.AgentDaemon.__new__(agent.AgentDaemon)
+    daemon.exports = exports
+    daemon.rollup  = None
+    daemon.drain()
+
+    # the queued snapshots are spooled, the write in flight is left to the worker thread
+    assert queue.depth() == 0
+    assert worker.spool.peek() is not None
+    assert driver.client.requests == []
+
+    driver.client.released.set()
+    worker.join(5)
+    assert not worker.is_alive()
+    assert len(driver.client.requests) == 1
+
+
+def test_a_stuck_sink_does_not_hold_back_the_others(agent, driver, tmp_path):
+    driver.client = BlockingInfluxDBClient()
+    ndjson        = tmp_path / "metrics.ndjson"
+    exports       = agent.ExportFanout([
+        agent.ExportSink("influxdb", driver, dict(agent.AGENT_DEFAULTS, queue_size=2)),
+        agent.ExportSink("file", agent.FileDriver(str(ndjson)), dict(agent.AGENT_DEFAULTS, queue_size=10))
+    ])
+    exports.start()
+
+    for temperature in range(5):
+        exports.put(snapshot(agent, 60 + temperature))
+    assert driver.client.entered.wait(5)
+    exports.queues[1].close()
+    exports.exporters[1].join(5)
+
+    # every snapshot is in the file, the influxdb queue dropped the oldest ones while its write hung
+    assert len(ndjson.read_text().splitlines()) == 5
+    assert exports.queues[0].dropped > 0
+
+    driver.client.released.set()
+    exports.queues[0].close()
+    exports.exporters[0].join(5)
+
+
+def test_a_blocking_sink_does_not_stall_the_sampling(agent, driver, tmp_path):
+    driver.client = BlockingInfluxDBClient()
+    ndjson        = tmp_path / "metrics.ndjson"
+    exports       = agent.ExportFanout([
+        agent.ExportSink("influxdb", driver, dict(agent.AGENT_DEFAULTS, queue_size=1, queue_overflow="block")),
+        agent.ExportSink("file", agent.FileDriver(str(ndjson)), dict(agent.AGENT_DEFAULTS, queue_size=10))
+    ])
+    assert exports.queues[0].overflow == "drop-oldest"
+    exports.start()
+
+    # the influxdb write hangs with its queue full, put() returns all the same
+    exports.put(snapshot(agent, 60))
+    assert driver.client.entered.wait(5)
+    for temperature in range(1, 5):
+        exports.put(snapshot(agent, 60 + temperature))
+    exports.queues[1].close()
+    exports.exporters[1].join(5)
+
+    assert len(ndjson.read_text().splitlines()) == 5
+    assert exports.queues[0].dropped > 0
+
+    driver.client.released.set()
+    exports.queues[0].close()
+    exports.exporters[0].join(5)
+
+    # a single sink keeps its policy
+    single = agent.ExportFanout([agent.ExportSink("influxdb", driver, dict(agent.AGENT_DEFAULTS,
+                                                                           queue_overflow="block"))])
+    assert single.queues[0].overflow == "block"
+
+
+def test_open_circuit_spools_without_retrying(agent, driver, tmp_path):
+    from influxdb.exceptions import InfluxDBServerError
+
+    driver.client.errors.extend([InfluxDBServerError("503")] * 3)
+    worker = agent.ExportWorker(None, driver, retries=2, backoff=60, spool=agent.DiskSpool(str(tmp_path)))
+    worker.backoff = 0
+
+    # the first failure goes through the retry schedule and opens the circuit
+    assert not worker.export(snapshot(agent, 60))
+    assert worker.circuit_open
+    assert worker.export_errors == 3
+
+    # the next snapshots are spooled at once, the backend is not asked until the probe time
+    worker.probe_time = agent.monotonic() + 60
+    assert not worker.export(snapshot(agent, 61))
+    assert worker.export_errors == 3
+
+    # the probe goes through: the circuit closes and the spool is replayed behind it
+    worker.probe_time = agent.monotonic()
+    assert worker.export(snapshot(agent, 62))
+    assert not worker.circuit_open
+    assert worker.spool.peek() is None
+    assert len(driver.client.requests) == 3
+
+
+def test_replay_keeps_going_between_two_snapshots(agent, driver, tmp_path):
+    spool = agent.DiskSpool(str(tmp_path))
+    for temperature in range(10):
+        spool.append(["gpu/telemetry temperature_c=%di 0" % temperature])
+
+    worker = agent.ExportWorker(agent.SnapshotQueue(10), driver, spool=spool, replay_rate=1000)
+    worker.replay()
+
+    assert worker.replayed == 10
+    assert spool.peek() is None
+
+
+def test_replay_yields_to_queued_snapshots(agent, driver, tmp_path):
+    spool = agent.DiskSpool(str(tmp_path))
+    spool.append(["gpu/telemetry temperature_c=60i 0"])
+
+    queue  = agent.SnapshotQueue(10)
+    queue.put(snapshot(agent))
+    worker = agent.ExportWorker(queue, driver, spool=spool)
+    worker.replay()
+
+    assert worker.replayed == 0
+
+
+def test_spool_ignores_stray_segment_files(agent, tmp_path):
+    spool = agent.DiskSpool(str(tmp_path))
+    spool.append(["gpu/telemetry temperature_c=60i 0"])
+    spool.close()
+    tmp_path.joinpath("backup.seg").write_bytes(b"")
+
+    spool = agent.DiskSpool(str(tmp_path))
+    assert list(iter_spool(spool)) == [["gpu/telemetry temperature_c=60i 0"]]
@@ -0,0 +1,107 @@
+import concurrent.futures
+import os
+import threading
+
+import pytest
+
+from conftest import FakeNVML, FakeProcess
+
+
+class AgentNVML(FakeNVML):
+    """NVML binding where the agent's own process uses every GPU, recording the threads listing the processes"""
+
+    def __init__(self):
+        FakeNVML.__init__(self)
+        self.threads = set()
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        self.threads.add(threading.current_thread().name)
+        return [FakeProcess(os.getpid(), (handle + 1) * 1024 * 1024)]
+
+
+@pytest.fixture
+def nvml_class():
+    return AgentNVML
+
+
+class CountingPodIndex(object):
+    def __init__(self, agent):
+        self.pod      = agent.PodInfo("uid-1", "trainer", "train-0", "ml", "c1")
+        self.resolved = []
+        self.live     = None
+
+    def resolve(self, pid):
+        self.resolved.append(pid)
+        return self.pod
+
+    def prune(self, live_pids):
+        self.live = set(live_pids)
+
+
+@pytest.mark.parametrize("threads", [0, 4])
+def test_processes_on_several_gpus_are_resolved_once(agent, nvml, session, threads):
+    nvml.count = 8
+    session.enumerate()
+    pod_index  = CountingPodIndex(agent)
+    pool       = concurrent.futures.ThreadPoolExecutor(threads) if threads else None
+
+    try:
+        gpu_stats = agent.GPUStat.new_query(session, pod_index, pool=pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    assert pod_index.resolved == [os.getpid()]
+    assert pod_index.live == set([os.getpid()])
+    assert [gpu.index for gpu in gpu_stats.gpus_pod_usage] == list(range(8))
+    assert [gpu.processes[0].memory for gpu in gpu_stats.gpus_pod_usage] == list(range(1, 9))
+    # the pod of a process is shared by its GPUs, not copied
+    assert len(set(id(gpu.processes[0].pod) for gpu in gpu_stats.gpus_pod_usage)) == 1
+    if threads:
+        assert all(name.startswith("ThreadPoolExecutor") for name in nvml.threads)
+
+
+class AssigningPodIndex(CountingPodIndex):
+    """Pod index that cannot resolve any process, but knows which container each GPU is allocated to"""
+
+    def resolve(self, pid):
+        self.resolved.append(pid)
+        return None
+
+    def assignment(self, gpu_uuid):
+        return self.pod if gpu_uuid == "GPU-0001" else None
+
+
+def test_unresolved_processes_are_given_the_pod_their_gpu_is_allocated_to(agent, session):
+    gpu_stats = agent.GPUStat.new_query(session, AssigningPodIndex(agent))
+
+    assert [len(gpu.processes) for gpu in gpu_stats.gpus_pod_usage] == [0, 1]
+    assert gpu_stats.gpus_pod_usage[1].processes[0].pod.name == "train-0"
+
+
+def test_collector_pool_is_bounded_by_the_configuration(agent):
+    assert agent.new_collector_pool({"collector_threads": 1}) is None
+
+    pool = agent.new_collector_pool({"collector_threads": 3})
+    assert pool._max_workers == 3
+    pool.shutdown()
+
+
+def test_snapshots_are_slotted_and_do_not_share_their_gpus(agent):
+    first, second = agent.GPUStat(), agent.GPUStat()
+    first.gpus_pod_usage.append(agent.GPUSnapshot(0, "Tesla V100", "GPU-0000"))
+
+    assert second.gpus_pod_usage == []
+    assert not hasattr(first, "__dict__")
+    assert not hasattr(first.gpus_pod_usage[0], "__dict__")
+
+
+def test_sum_pod_usage_adds_memory_and_utilization_of_a_container(agent):
+    pod = agent.PodInfo("uid-1", "trainer", "train-0", "ml", "c1")
+    gpu = agent.GPUSnapshot(0, "Tesla V100", "GPU-0000", [agent.ProcessUsage(101, "root", 512, pod, (30.0, 5.0, 0.0, 0.0)),
+                                                          agent.ProcessUsage(102, "root", 256, pod)])
+
+    assert agent.sum_pod_usage(gpu) == {
+        ("train-0", "trainer", "ml"): (pod, {"value": 768, "sm_util": 30.0, "mem_util": 5.0, "enc_util": 0.0,
+                                             "dec_util": 0.0})
+    }
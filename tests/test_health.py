@@ -0,0 +1,68 @@
+import threading
+
+
+def test_histogram_buckets_and_snapshot(agent):
+    metrics = agent.AgentMetrics()
+    metrics.observe("write", 0.0003)
+    metrics.observe("write", 0.02)
+    metrics.observe("write", 60)
+    metrics.count("subprocesses", 2)
+
+    health = metrics.snapshot({"export_errors": 1}, {"queue_depth": 3})
+    counts, total, count, last = health.stages["write"]
+    assert counts[0] == 1
+    assert counts[agent.STAGE_BUCKETS.index(0.025)] == 1
+    assert counts[-1] == 1
+    assert (count, last) == (3, 60)
+    assert health.counters["subprocesses"] == 2
+    assert health.counters["export_errors"] == 1
+    assert health.gauges == {"queue_depth": 3}
+
+    # the snapshot is a copy, later observations do not change it
+    metrics.observe("write", 1)
+    assert health.stages["write"][2] == 3
+
+
+def test_health_is_exported_with_the_snapshot(agent):
+    metrics = agent.AgentMetrics()
+    metrics.observe("sample", 0.004)
+    gpu_stats        = agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000", telemetry={"temperature_c": 60})])
+    gpu_stats.health = metrics.snapshot({"export_errors": 2}, {"queue_depth": 1})
+
+    health = [point for point in agent.InfluxDBDriver.points(gpu_stats) if point[0] == "agent/health"]
+    assert len(health) == 1
+    assert health[0][2]["sample_count"] == 1
+    assert health[0][2]["export_errors"] == 2
+    assert health[0][2]["queue_depth"] == 1
+
+    body = agent.PrometheusExporter.render(gpu_stats).decode("utf-8")
+    assert "# TYPE nvml_agent_stage_seconds histogram" in body
+    assert 'nvml_agent_stage_seconds_bucket{le="0.005",nodename="%s",stage="sample"} 1' % gpu_stats.hostname in body
+    assert 'nvml_agent_stage_seconds_bucket{le="0.0025",nodename="%s",stage="sample"} 0' % gpu_stats.hostname in body
+    assert "nvml_agent_export_errors_total{" in body
+    assert "nvml_agent_queue_depth{" in body
+
+
+def test_snapshots_without_health_have_no_health_point(agent):
+    gpu_stats = agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000", telemetry={"temperature_c": 60})])
+
+    assert [point[0] for point in agent.InfluxDBDriver.points(gpu_stats)] == ["gpu/telemetry"]
+
+
+def test_profiler_writes_folded_stacks(agent, tmp_path):
+    stop   = threading.Event()
+    worker = threading.Thread(target=stop.wait, args=(5,))
+    worker.start()
+
+    profiler = agent.SamplingProfiler(str(tmp_path), interval=0.001)
+    profiler.start()
+    while not profiler.stacks:
+        stop.wait(0.01)
+    path = profiler.stop()
+    stop.set()
+    worker.join()
+
+    lines = open(path).read().splitlines()
+    assert lines
+    assert any("wait" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
@@ -0,0 +1,193 @@
+import http.server
+import json
+import socketserver
+import threading
+
+import pytest
+
+PODS = {
+    "kind" : "PodList",
+    "items": [
+        {
+            "metadata": {
+                "name"           : "trainer-7d4b9c-x2k8p",
+                "namespace"      : "ml",
+                "uid"            : "uid-1",
+                "labels"         : {"app.kubernetes.io/name": "trainer", "team": "vision",
+                                    "pod-template-hash": "7d4b9c"},
+                "ownerReferences": [{"kind": "ReplicaSet", "name": "trainer-7d4b9c", "controller": True}]
+            },
+            "status"  : {
+                "containerStatuses": [
+                    {"name": "trainer", "containerID": "containerd://c1", "state": {"running": {}}},
+                    {"name": "sidecar", "containerID": "containerd://c2", "state": {"terminated": {}}}
+                ]
+            }
+        },
+        {
+            "metadata": {
+                "name"           : "etl-27-5xq2m",
+                "namespace"      : "batch",
+                "uid"            : "uid-2",
+                "ownerReferences": [{"kind": "Job", "name": "etl-27", "controller": True}]
+            },
+            "status"  : {
+                "initContainerStatuses": [
+                    {"name": "fetch", "containerID": "docker://c3", "state": {"running": {}}}
+                ]
+            }
+        }
+    ]
+}
+
+
+class FakeKubeletHandler(http.server.BaseHTTPRequestHandler):
+    """Kubelet answering GET /pods with PODS, and 304 when If-None-Match is the ETag of its list"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.server.etag is not None and self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = json.dumps(PODS).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.etag is not None:
+            self.send_header("ETag", self.server.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeKubeletServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        http.server.HTTPServer.__init__(self, ("127.0.0.1", 0), FakeKubeletHandler)
+        self.requests = []
+        self.etag     = None
+
+
+@pytest.fixture
+def kubelet():
+    server = FakeKubeletServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(agent, kubelet, tmp_path):
+    token = tmp_path / "token"
+    token.write_text("s3cr3t\n")
+    client = agent.KubeletRuntimeClient("http://127.0.0.1:%d" % kubelet.server_address[1],
+                                        token_file=str(token), label_tags=["app.kubernetes.io/name"],
+                                        pod_resources_socket="")
+    yield client
+    client.close()
+
+
+def test_running_containers_are_listed_with_their_owner_and_labels(agent, client, kubelet):
+    containers = client.list_containers()
+
+    assert sorted(containers) == ["c1", "c3"]
+    assert containers["c1"] == agent.PodInfo("uid-1", "trainer", "trainer-7d4b9c-x2k8p", "ml", "c1",
+                                             "Deployment", "trainer", (("label_app_kubernetes_io_name", "trainer"),))
+    assert containers["c3"] == agent.PodInfo("uid-2", "fetch", "etl-27-5xq2m", "batch", "c3", "Job", "etl-27")
+    assert agent.pod_tags(containers["c1"]) == {"owner_kind"                   : "Deployment",
+                                                "owner_name"                   : "trainer",
+                                                "label_app_kubernetes_io_name" : "trainer"}
+    assert kubelet.requests[0][1]["Authorization"] == "Bearer s3cr3t"
+
+
+def test_unchanged_pod_list_is_not_decoded_again(agent, client, kubelet, monkeypatch):
+    kubelet.etag = '"v1"'
+    first        = client.list_containers()
+
+    # the kubelet answers 304 to the ETag of the previous list
+    decoded = []
+    monkeypatch.setattr(agent.json, "loads", lambda *args: decoded.append(args))
+    assert client.list_containers() == first
+    assert kubelet.requests[1][1]["If-None-Match"] == '"v1"'
+
+    # without ETag, the same list is recognised by its digest
+    kubelet.etag = None
+    client.etag  = None
+    assert client.list_containers() == first
+    assert decoded == []
+
+    # the pod index adds negative entries to the list it is given, the cached one is left alone
+    first["not-kubernetes"] = None
+    assert "not-kubernetes" not in client.list_containers()
+
+
+def test_endpoint_must_be_an_url(agent):
+    with pytest.raises(ValueError):
+        agent.KubeletRuntimeClient("/var/run/docker.sock")
+
+
+def varint(value):
+    encoded = bytearray()
+    while True:
+        byte, value = value & 0x7f, value >> 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def field(number, value):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+
+def pod_resources(*pods):
+    """Serialized ListPodResourcesResponse of pods given as (namespace, name, container, resource, device ids)"""
+    message = b""
+    for namespace, name, container, resource, device_ids in pods:
+        devices    = field(1, resource) + b"".join(field(2, device_id) for device_id in device_ids)
+        containers = field(1, container) + field(2, devices)
+        message   += field(1, field(1, name) + field(2, namespace) + field(3, containers))
+    return message
+
+
+def test_decode_protobuf_reads_varints_and_strings(agent):
+    assert agent.decode_protobuf(varint(1 << 3) + varint(300) + field(2, "gpu") + field(2, "")) == \
+        {1: [300], 2: [b"gpu", b""]}
+    with pytest.raises(ValueError):
+        agent.decode_protobuf(field(2, "gpu")[:-1])
+
+
+def test_gpus_allocated_to_a_single_container_are_assigned_to_its_pod(agent, client):
+    response = pod_resources(("ml", "trainer-7d4b9c-x2k8p", "trainer", "nvidia.com/gpu", ["GPU-0000", "GPU-0001"]),
+                             ("ml", "trainer-7d4b9c-x2k8p", "trainer", "example.com/nic", ["eth1"]),
+                             ("dev", "notebook-0", "jupyter", "nvidia.com/gpu", ["GPU-0002::0"]),
+                             ("dev", "notebook-1", "jupyter", "nvidia.com/gpu", ["GPU-0002::1"]),
+                             ("batch", "render-0", "blender", "nvidia.com/gpu", ["GPU-0003"]),
+                             ("ml", "infer-0", "server", "nvidia.com/mig-3g.20gb", ["MIG-0004-0000"]))
+    client.pod_resources_socket = "/var/lib/kubelet/pod-resources/kubelet.sock"
+    client.list_pod_resources   = lambda request, timeout: response
+    client.rpc_error            = IOError
+
+    containers  = client.list_containers()
+    assignments = client.gpu_assignments()
+
+    # the pod list completes the identity of the pods it knows, time-sliced GPUs are left out, MIG devices are kept
+    assert assignments == {
+        "GPU-0000": containers["c1"],
+        "GPU-0001": containers["c1"],
+        "GPU-0003": agent.PodInfo("", "blender", "render-0", "batch", ""),
+        "MIG-0004-0000": agent.PodInfo("", "server", "infer-0", "ml", "")
+    }
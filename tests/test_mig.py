@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+from conftest import FakeNVML
+
+
+class MIGNVML(FakeNVML):
+    """NVML binding of an A100 without MIG (handle 0) and one in MIG mode (handle 1), whose MIG devices are
+    (1, slot) handles; the processes of a GPU are listed with the instance they run in"""
+
+    NVML_DEVICE_MIG_ENABLE = 1
+
+    def __init__(self):
+        FakeNVML.__init__(self)
+        self.instances  = {1: {0: (1, 0), 1: (2, 0)}}    # slot -> (gpu instance id, compute instance id)
+        self.enumerated = 0
+
+    def nvmlDeviceGetName(self, handle):
+        return "NVIDIA A100-SXM4-40GB MIG 3g.20gb" if isinstance(handle, tuple) else b"NVIDIA A100-SXM4-40GB"
+
+    def nvmlDeviceGetUUID(self, handle):
+        if isinstance(handle, tuple):
+            return "MIG-%04d-%04d" % handle
+        return FakeNVML.nvmlDeviceGetUUID(self, handle)
+
+    def nvmlDeviceGetMigMode(self, handle):
+        if handle in self.instances:
+            return 1, 1
+        return 0, 0
+
+    def nvmlDeviceGetMaxMigDeviceCount(self, handle):
+        return 7
+
+    def nvmlDeviceGetMigDeviceHandleByIndex(self, handle, index):
+        self.enumerated += 1
+        if index not in self.instances[handle]:
+            raise self.NVMLError("not found")
+        return handle, index
+
+    def nvmlDeviceGetGpuInstanceId(self, handle):
+        return self.instances[handle[0]][handle[1]][0]
+
+    def nvmlDeviceGetComputeInstanceId(self, handle):
+        return self.instances[handle[0]][handle[1]][1]
+
+
+class FakePodIndex(object):
+    def __init__(self, agent):
+        self.pod = agent.PodInfo("uid-1", "server", "infer-0", "ml", "c1")
+
+    def resolve(self, pid):
+        return self.pod
+
+    def prune(self, live_pids):
+        pass
+
+    def assignment(self, gpu_uuid):
+        return None
+
+
+@pytest.fixture
+def nvml_class():
+    return MIGNVML
+
+
+def test_mig_devices_are_enumerated_after_the_gpus(agent, session):
+    assert [(device.index, device.uuid) for device in session.devices] == \
+        [(0, "GPU-0000"), (1, "GPU-0001"), (1, "MIG-0001-0000"), (1, "MIG-0001-0001")]
+    assert session.devices[3].mig == agent.MIGInstance("MIG-0001-0001", "GPU-0001", 2, 0)
+    assert session.devices[3].name == "NVIDIA A100-SXM4-40GB MIG 3g.20gb"
+    assert session.devices[0].mig is None and session.devices[1].mig is None
+
+
+def test_processes_and_memory_are_attributed_to_their_mig_device(agent, nvml, session):
+    nvml.processes[0] = [(os.getpid(), 1 << 30, agent.NVML_NO_INSTANCE, agent.NVML_NO_INSTANCE)]
+    nvml.processes[1] = [(os.getpid(), 2 << 30, 1, 0), (os.getpid(), None, 2, 0)]
+    enumerated        = nvml.enumerated
+
+    gpu_stats = agent.GPUStat.new_query(session, FakePodIndex(agent))
+    gpus      = gpu_stats.gpus_pod_usage
+
+    assert [(gpu.uuid, gpu.mig and gpu.mig.uuid, [process.memory for process in gpu.processes]) for gpu in gpus] == \
+        [("GPU-0000", None, [1024]), ("GPU-0001", None, []), ("GPU-0001", "MIG-0001-0000", [2048]),
+         ("GPU-0001", "MIG-0001-0001", [0])]
+
+    usage = [tags for measurement, tags, _ in agent.InfluxDBDriver.points(gpu_stats) if measurement == "gpu/usage"]
+    assert "mig_uuid" not in usage[0]
+    assert usage[1]["gpu_uuid"] == "GPU-0001" and usage[1]["mig_uuid"] == "MIG-0001-0000"
+    assert (usage[1]["gpu_instance_id"], usage[1]["compute_instance_id"]) == (1, 0)
+
+    # the topology is not read again while it does not change
+    agent.GPUStat.new_query(session, FakePodIndex(agent))
+    assert nvml.enumerated == enumerated and not session.stale
+
+
+def test_reconfigured_mig_devices_are_enumerated_again(agent, nvml, session):
+    # a new GPU instance, its process is left on its GPU until the MIG devices are enumerated again
+    nvml.instances[1][2] = (5, 0)
+    nvml.processes[1]    = [(os.getpid(), 1 << 30, 5, 0)]
+    gpus = agent.GPUStat.new_query(session, FakePodIndex(agent)).gpus_pod_usage
+    assert [len(gpu.processes) for gpu in gpus] == [0, 1, 0, 0]
+    assert session.stale
+
+    gpus = agent.GPUStat.new_query(session, FakePodIndex(agent)).gpus_pod_usage
+    assert [len(gpu.processes) for gpu in gpus] == [0, 0, 0, 0, 1]
+    assert gpus[4].mig.uuid == "MIG-0001-0002"
+
+    # MIG disabled: the processes are listed outside of any instance
+    del nvml.instances[1]
+    nvml.processes[1] = [(os.getpid(), 1 << 30, agent.NVML_NO_INSTANCE, agent.NVML_NO_INSTANCE)]
+    agent.GPUStat.new_query(session, FakePodIndex(agent))
+    assert session.stale
+    assert [device.uuid for device in agent.GPUStat.new_query(session, FakePodIndex(agent)).gpus_pod_usage] == \
+        ["GPU-0000", "GPU-0001"]
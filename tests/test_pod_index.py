@@ -0,0 +1,69 @@
+import pytest
+
+
+class StaticRuntimeClient(object):
+    """Runtime listing a fixed set of containers, counting the relists"""
+
+    def __init__(self, containers):
+        self.containers = containers
+        self.calls      = 0
+
+    def list_containers(self):
+        self.calls += 1
+        return dict(self.containers)
+
+    def gpu_assignments(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def pod(agent):
+    return agent.PodInfo("uid-1", "trainer", "train-0", "ml", "c1")
+
+
+def test_unknown_container_is_not_relisted_until_the_periodic_refresh(agent, pod):
+    runtime = StaticRuntimeClient({"c1": pod})
+    index   = agent.PodIndex(runtime, refresh_interval=3600, min_refresh_interval=0)
+
+    assert index.lookup("c1") == pod
+    assert runtime.calls == 1
+
+    # the first miss relists, the following ones hit the negative entry
+    assert index.lookup("not-kubernetes") is None
+    assert index.lookup("not-kubernetes") is None
+    assert index.lookup("not-kubernetes") is None
+    assert runtime.calls == 2
+
+    # the periodic refresh forgets the negative entries
+    index.last_refresh -= 3600
+    runtime.containers["not-kubernetes"] = pod
+    assert index.lookup("not-kubernetes") == pod
+    assert runtime.calls == 3
+
+
+class StaticCgroupResolver(object):
+    def __init__(self, containers):
+        self.containers = containers
+
+    def resolve(self, pid):
+        return self.containers.get(pid)
+
+    def prune(self, live_pids):
+        pass
+
+
+def test_resolve_falls_back_to_the_pod_uid_of_the_cgroup(agent, pod):
+    resolver = StaticCgroupResolver({
+        1: agent.ContainerRef("uid-1", "c1"),
+        2: agent.ContainerRef("uid-2", "c2"),
+        3: agent.ContainerRef(None, "c3")
+    })
+    index    = agent.PodIndex(StaticRuntimeClient({"c1": pod}), cgroup_resolver=resolver)
+
+    assert index.resolve(1) == pod
+    assert index.resolve(2) == agent.PodInfo("uid-2", "", "uid-2", "", "c2")
+    assert index.resolve(3) is None
+    assert index.resolve(4) is None
@@ -0,0 +1,74 @@
+import gzip
+import http.client
+
+import pytest
+
+
+@pytest.fixture
+def gpu_stats(agent):
+    pod = agent.PodInfo("uid-1", "trainer", "train-0", "ml", "c1")
+    return agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000",
+                                            [agent.ProcessUsage(101, "root", 512, pod, (30.0, 5.0, 0.0, 0.0)),
+                                             agent.ProcessUsage(102, "root", 256, pod, (10.0, 5.0, 0.0, 0.0))],
+                                            {"temperature_c": 60, "energy_mj": 123456, "ecc_dbe_volatile": 2})])
+
+
+@pytest.fixture
+def exporter(agent):
+    exporter = agent.PrometheusExporter(0, "127.0.0.1")
+    exporter.start()
+    yield exporter
+    exporter.close()
+
+
+def get(exporter, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", exporter.server.server_address[1], timeout=5)
+    try:
+        conn.request("GET", "/metrics", headers=headers or {})
+        response = conn.getresponse()
+        return response, response.read()
+    finally:
+        conn.close()
+
+
+def test_render_sums_the_processes_of_a_container(agent, gpu_stats):
+    body = agent.PrometheusExporter.render(gpu_stats).decode("utf-8")
+
+    series = [line for line in body.splitlines() if line.startswith("nvml_pod_gpu_memory_used_megabytes{")]
+    assert len(series) == 1
+    assert series[0].endswith(" 768.0")
+    assert "pid=" not in body
+    assert 'nvml_pod_gpu_sm_util_percent{container_name="trainer"' in body
+
+
+def test_render_types_monotonic_telemetry_as_counters(agent, gpu_stats):
+    body = agent.PrometheusExporter.render(gpu_stats).decode("utf-8")
+
+    assert "# TYPE nvml_gpu_energy_mj_total counter" in body
+    assert "# TYPE nvml_gpu_ecc_dbe_volatile_total counter" in body
+    assert "# TYPE nvml_gpu_temperature_c gauge" in body
+    assert "nvml_gpu_energy_mj{" not in body
+
+
+def test_scrape_is_conditional_and_compressed(exporter, gpu_stats):
+    exporter.update(gpu_stats)
+
+    response, body = get(exporter)
+    assert response.status == 200
+    assert b"nvml_gpu_temperature_c" in body
+    etag = response.getheader("ETag")
+
+    response, body = get(exporter, {"If-None-Match": etag})
+    assert response.status == 304
+    assert body == b""
+
+    response, body = get(exporter, {"Accept-Encoding": "gzip"})
+    assert response.getheader("Content-Encoding") == "gzip"
+    assert b"nvml_gpu_temperature_c" in gzip.decompress(body)
+
+
+def test_unknown_path_is_not_found(exporter):
+    conn = http.client.HTTPConnection("127.0.0.1", exporter.server.server_address[1], timeout=5)
+    conn.request("GET", "/")
+    assert conn.getresponse().status == 404
+    conn.close()
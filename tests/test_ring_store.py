@@ -0,0 +1,103 @@
+import math
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+START = datetime(2024, 1, 31, 12, 0, 0)
+
+
+def sample(agent, seconds, pods=("trainer-0",), memory=1024):
+    gpus = []
+    for index in range(2):
+        processes = [agent.ProcessUsage(100 + position, "root", memory,
+                                        agent.PodInfo("uid-%s" % name, "main", name, "ml", "c-%s" % name),
+                                        (50.0, 20.0, 0.0, 0.0) if position == 0 else None)
+                     for position, name in enumerate(pods)]
+        gpus.append(agent.GPUSnapshot(index, "Tesla V100", "GPU-%04d" % index, processes,
+                                      {"sm_utilization_pct": 50, "power_usage_mw": 250500,
+                                       "memory_used_bytes": memory * 1024 * 1024}))
+    gpu_stats            = agent.GPUStat(gpus)
+    gpu_stats.query_time = START + timedelta(seconds=seconds)
+    return gpu_stats
+
+
+def epoch(seconds):
+    return (START + timedelta(seconds=seconds)).timestamp()
+
+
+def test_records_are_kept_per_series_and_overwritten_oldest_first(agent, tmp_path):
+    store = agent.RingStore(str(tmp_path / "ring"), series=8, records=4)
+    for seconds in range(6):
+        store.append(sample(agent, seconds))
+
+    records = store.query(gpu="1")
+    assert [(record[0], record[1]) for record in records] == \
+        [(epoch(seconds), kind) for seconds in range(2, 6) for kind in (agent.RING_STORE_GPU, agent.RING_STORE_POD)]
+
+    timestamp, kind, fields, values = records[0]
+    assert fields == ("GPU-0001", "1")
+    assert values[0] == 50 and values[3] == pytest.approx(250.5) and values[2] == 1024
+    assert math.isnan(values[1]) and math.isnan(values[4])
+    store.close()
+
+    # the file keeps its size, and a restarted agent appends to the series it finds
+    size  = os.path.getsize(str(tmp_path / "ring"))
+    store = agent.RingStore(str(tmp_path / "ring"), series=8, records=4)
+    store.append(sample(agent, 6))
+    assert [record[0] for record in store.query(gpu="GPU-0000", pod="ml/*")] == [epoch(s) for s in range(3, 7)]
+    store.close()
+    assert os.path.getsize(str(tmp_path / "ring")) == size
+
+
+def test_query_by_pod_and_time_range(agent, tmp_path):
+    store = agent.RingStore(str(tmp_path / "ring"), series=8, records=100)
+    for seconds in range(10):
+        store.append(sample(agent, seconds, pods=("trainer-0", "etl-0") if seconds >= 5 else ("trainer-0",)))
+    store.close()
+
+    store   = agent.RingStore(str(tmp_path / "ring"), readonly=True)
+    records = store.query(pod="etl-*", since=epoch(7), until=epoch(8))
+    assert [(record[0], record[2][0], record[2][3]) for record in records] == \
+        [(epoch(7), "GPU-0000", "etl-0"), (epoch(7), "GPU-0001", "etl-0"),
+         (epoch(8), "GPU-0000", "etl-0"), (epoch(8), "GPU-0001", "etl-0")]
+    # processes without utilisation leave the utilisation of the pod unknown
+    assert math.isnan(records[0][3][0]) and records[0][3][4] == 1024
+    assert store.query(pod="ml/trainer-0", gpu="0", since=epoch(9))[0][3][:2] == (50.0, 20.0)
+    store.close()
+
+
+def test_clock_stepped_backwards_keeps_the_time_order(agent, tmp_path):
+    store = agent.RingStore(str(tmp_path / "ring"), series=8, records=100)
+    for seconds in (0, 1, 2, 3, 1, 2, 3, 4, 5):
+        store.append(sample(agent, seconds))
+
+    # the samples taken while the clock catches up are stamped with the last time written
+    assert [record[0] for record in store.query(gpu="0", pod="*")] == [epoch(s) for s in (0, 1, 2, 3, 3, 3, 3, 4, 5)]
+    assert [record[0] for record in store.query(gpu="0", pod="*", since=epoch(4))] == [epoch(4), epoch(5)]
+    store.close()
+
+
+def test_oldest_series_is_replaced_when_the_store_is_full(agent, tmp_path):
+    store = agent.RingStore(str(tmp_path / "ring"), series=4, records=10)
+    store.append(sample(agent, 0, pods=("trainer-0",)))
+    store.append(sample(agent, 1, pods=("etl-0",)))
+
+    assert {record[2][3] for record in store.query(pod="*")} == {"etl-0"}
+    assert [record[1] for record in store.query(gpu="0")] == [agent.RING_STORE_GPU, agent.RING_STORE_GPU,
+                                                               agent.RING_STORE_POD]
+    store.close()
+
+
+def test_another_geometry_starts_the_store_over(agent, tmp_path):
+    store = agent.RingStore(str(tmp_path / "ring"), series=4, records=10)
+    store.append(sample(agent, 0))
+    store.close()
+
+    store = agent.RingStore(str(tmp_path / "ring"), series=4, records=20)
+    assert store.query() == []
+    store.close()
+
+    (tmp_path / "other").write_bytes(b"not a ring store")
+    with pytest.raises(ValueError):
+        agent.RingStore(str(tmp_path / "other"), readonly=True)
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+
+
+def snapshot(agent, timestamp, memory, temperature=60):
+    pod       = agent.PodInfo("uid-1", "trainer", "train-0", "ml", "c1")
+    processes = [agent.ProcessUsage(101, "root", memory, pod)] if memory is not None else []
+    stats     = agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000", processes, {"temperature_c": temperature})])
+    stats.query_time = datetime.fromtimestamp(timestamp)
+    return stats
+
+
+def fields(rollup, measurement):
+    return [point[2] for point in rollup.points if point[0] == measurement]
+
+
+def test_window_is_aggregated_when_the_next_one_starts(agent):
+    rollup = agent.Rollup(10, quantiles=[0.5, 0.95])
+
+    for second, memory in enumerate([100, 120, 4000, 110, 100, 100, 100, 100, 100, 100]):
+        assert rollup.add(snapshot(agent, 1000 + second, memory)) is None
+
+    result = rollup.add(snapshot(agent, 1010, 100))
+    assert result.query_time == datetime.fromtimestamp(1000)
+
+    usage = fields(result, "gpu/usage")
+    assert len(usage) == 1
+    assert usage[0]["value_min"] == 100
+    assert usage[0]["value_max"] == 4000
+    assert usage[0]["value_mean"] == pytest.approx(493.0)
+    assert usage[0]["value_last"] == 100
+    assert usage[0]["value_p50"] == 100
+    assert usage[0]["value_p95"] == 4000
+    assert usage[0]["samples"] == 10
+
+
+def test_ring_keeps_the_newest_values_but_min_max_mean_see_all(agent):
+    series = agent.RollupSeries(4)
+    for value in [50, 1, 2, 3, 4]:
+        series.add(value)
+
+    assert series.minimum == 1
+    assert series.maximum == 50
+    assert series.total / series.count == 12
+    assert series.quantiles([1.0]) == [4]
+
+
+def test_series_gone_for_a_window_are_forgotten(agent):
+    rollup = agent.Rollup(10)
+    rollup.add(snapshot(agent, 1000, 100))
+    rollup.add(snapshot(agent, 1010, None))
+
+    result = rollup.add(snapshot(agent, 1020, None))
+    assert fields(result, "gpu/usage") == []
+    assert len(fields(result, "gpu/telemetry")) == 1
+    assert len(rollup.series) == 1
+
+
+def test_driver_encodes_a_rollup(agent):
+    rollup = agent.Rollup(10)
+    rollup.add(snapshot(agent, 1000, 100))
+    driver = agent.InfluxDBDriver("localhost", 8086, "root", "root", "k8s")
+
+    lines = driver.encode(rollup.flush())
+    assert len(lines) == 2
+    assert all(line.endswith(" 1000") for line in lines)
+    assert any("temperature_c_last=60.0," in line for line in lines)
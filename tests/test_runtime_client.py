@@ -0,0 +1,114 @@
+import http.server
+import json
+import os.path
+import shutil
+import socketserver
+import tempfile
+import threading
+
+import pytest
+
+CONTAINERS = [
+    {
+        "Id"     : "c1",
+        "Labels" : {
+            "io.kubernetes.pod.name"       : "train-0",
+            "io.kubernetes.pod.namespace"  : "ml",
+            "io.kubernetes.pod.uid"        : "uid-1",
+            "io.kubernetes.container.name" : "trainer"
+        }
+    }
+]
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    """Engine API answering GET /containers/json with CONTAINERS"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        status = self.server.status
+        body   = json.dumps(CONTAINERS if status == 200 else {"message": "boom"}).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        # drop the kept-alive connection without telling the client, as a restarted daemon would
+        if self.server.close_after_response:
+            self.close_connection = True
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        socketserver.UnixStreamServer.__init__(self, socket_path, FakeDockerHandler)
+        self.paths                = []
+        self.status               = 200
+        self.close_after_response = False
+
+
+@pytest.fixture
+def docker():
+    # a short directory, unix socket paths are limited to about a hundred bytes
+    directory = tempfile.mkdtemp(prefix="nvml-agent-")
+    server    = FakeDockerServer(os.path.join(directory, "docker.sock"))
+    thread    = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(directory)
+
+
+@pytest.fixture
+def client(agent, docker):
+    client = agent.DockerRuntimeClient("unix://" + docker.server_address)
+    yield client
+    client.close()
+
+
+def test_list_containers_reads_pod_identity_from_labels(agent, docker, client):
+    containers = client.list_containers()
+
+    assert containers == {"c1": agent.PodInfo("uid-1", "trainer", "train-0", "ml", "c1")}
+    assert docker.paths[0].startswith("/containers/json?filters=")
+    assert "io.kubernetes.pod.name" in agent.urllib.parse.unquote(docker.paths[0])
+
+
+def test_connection_is_kept_alive(docker, client):
+    client.list_containers()
+    connection = client.connection
+    client.list_containers()
+
+    assert client.connection is connection
+    assert len(docker.paths) == 2
+
+
+def test_reconnects_when_the_daemon_closed_the_connection(docker, client):
+    docker.close_after_response = True
+
+    assert "c1" in client.list_containers()
+    assert "c1" in client.list_containers()
+    assert len(docker.paths) == 2
+
+
+def test_non_200_answer_raises(agent, docker, client):
+    docker.status = 500
+
+    with pytest.raises(agent.RuntimeClientError):
+        client.list_containers()
+
+
+def test_unreachable_socket_raises(agent, tmp_path):
+    client = agent.DockerRuntimeClient(str(tmp_path / "missing.sock"))
+
+    with pytest.raises(agent.RuntimeClientError):
+        client.list_containers()
@@ -0,0 +1,97 @@
+import pytest
+
+
+@pytest.fixture
+def devices(session):
+    return session.devices
+
+
+def test_fixed_interval_unless_adaptive(agent, nvml, devices):
+    scheduler = agent.new_sampling_scheduler(agent.AGENT_DEFAULTS)
+
+    assert [scheduler.next_interval(devices) for _ in range(3)] == [5.0, 5.0, 5.0]
+    assert scheduler.probe_interval() is None
+    assert nvml.probes == 0
+
+
+def test_interval_follows_the_activity_of_the_gpus(agent, nvml, devices):
+    scheduler = agent.SamplingScheduler(5, adaptive=True, min_interval=1, idle_interval=60, memory_change=0.1)
+
+    # idle GPUs back off to the heartbeat, and are probed every interval meanwhile
+    assert [scheduler.next_interval(devices) for _ in range(6)] == [10.0, 20.0, 40.0, 60.0, 60.0, 60.0]
+    assert scheduler.probe_interval() == 5.0
+
+    # a job starting is found by a probe, then sampled at the highest rate
+    nvml.processes[0] = [(100, 1000)]
+    assert scheduler.changed(scheduler.probe(devices))
+    assert scheduler.next_interval(devices) == 1.0
+    nvml.processes[0] = [(100, 2000)]
+    assert scheduler.next_interval(devices) == 1.0
+
+    # a stable job goes back to the interval, a change of memory below memory_change is stable
+    nvml.processes[0] = [(100, 2100)]
+    assert [scheduler.next_interval(devices) for _ in range(4)] == [2.0, 4.0, 5.0, 5.0]
+    assert scheduler.probe_interval() is None
+
+    # so is its exit
+    nvml.processes[0] = []
+    assert scheduler.next_interval(devices) == 1.0
+
+
+def test_gpu_appearing_is_a_change(agent, nvml, devices):
+    scheduler = agent.SamplingScheduler(5, adaptive=True, min_interval=1, idle_interval=60)
+
+    scheduler.changed(scheduler.probe(devices[:1]))
+    assert scheduler.changed(scheduler.probe(devices))
+    assert scheduler.next_interval(devices) == 1.0
+
+
+def test_gpu_disappearing_is_a_change(agent, nvml, devices):
+    scheduler = agent.SamplingScheduler(5, adaptive=True, min_interval=1, idle_interval=60)
+
+    scheduler.changed(scheduler.probe(devices))
+    assert scheduler.changed(scheduler.probe(devices[:1]))
+    assert scheduler.next_interval(devices[:1]) == 1.0
+
+
+def test_interval_is_stretched_to_the_cpu_budget(agent, nvml, devices, monkeypatch):
+    clock     = {"cpu": 0.0, "wall": 0.0}
+    monkeypatch.setattr(agent, "process_time", lambda: clock["cpu"])
+    monkeypatch.setattr(agent, "monotonic", lambda: clock["wall"])
+    scheduler = agent.SamplingScheduler(5, cpu_budget=0.05)
+
+    # 1s of CPU every 5s is 20% of a CPU, four times the budget
+    clock["cpu"], clock["wall"] = 1.0, 5.0
+    assert scheduler.next_interval(devices) == pytest.approx(20.0)
+
+    # 1s of CPU every 20s is within the budget
+    clock["cpu"], clock["wall"] = 2.0, 25.0
+    assert scheduler.next_interval(devices) == 5.0
+
+
+def test_start_delay_depends_on_the_hostname(agent):
+    scheduler = agent.SamplingScheduler(5, start_jitter=5)
+    delays    = [scheduler.start_delay("gpu-node-%02d" % node) for node in range(50)]
+
+    assert all(0 <= delay < 5 for delay in delays)
+    assert len(set(delays)) == 50
+    assert scheduler.start_delay("gpu-node-00") == delays[0]
+    assert agent.SamplingScheduler(5).start_delay("gpu-node-00") == 0.0
+
+
+@pytest.mark.parametrize("key", ["sampling_interval", "sampling_min_interval", "sampling_idle_interval"])
+def test_intervals_must_be_above_zero(agent, key):
+    with pytest.raises(ValueError):
+        agent.get_agent_conf({key: 0})
+    with pytest.raises(ValueError):
+        agent.get_agent_conf({key: "5"})
+    assert agent.get_agent_conf({key: 0.5})[key] == 0.5
+
+
+def test_interval_argument_must_be_above_zero(agent, monkeypatch):
+    monkeypatch.setattr(agent.sys, "argv", ["nvml-agent.py", "--interval", "0"])
+    with pytest.raises(SystemExit):
+        agent.get_args()
+
+    monkeypatch.setattr(agent.sys, "argv", ["nvml-agent.py", "--interval", "0.5"])
+    assert agent.get_args().interval == 0.5
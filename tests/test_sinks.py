@@ -0,0 +1,153 @@
+import http.server
+import json
+import os.path
+import socket
+import socketserver
+import threading
+
+import pytest
+
+
+def snapshot(agent, temperature=60):
+    return agent.GPUStat([agent.GPUSnapshot(0, "Tesla V100", "GPU-0000", telemetry={"temperature_c": temperature,
+                                                                                    "power_w": 250.5})])
+
+
+class RecordingHandler(http.server.BaseHTTPRequestHandler):
+    """Receiver recording the posted requests, answering with the status of the server"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.path, dict(self.headers), body))
+
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class RecordingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, status):
+        http.server.HTTPServer.__init__(self, ("127.0.0.1", 0), RecordingHandler)
+        self.requests = []
+        self.status   = status
+
+
+@pytest.fixture
+def receiver():
+    servers = []
+
+    def start(status):
+        server = RecordingServer(status)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_influxdb_keys_configure_a_single_sink(agent):
+    cfg       = {"influxdb_host": "localhost", "influxdb_port": 8086, "influxdb_user": "root",
+                 "influxdb_pass": "root", "influxdb_db": "k8s"}
+    agent_cfg = dict(agent.AGENT_DEFAULTS, spool_dir="/var/lib/nvml-agent/spool")
+    sinks     = agent.new_sinks(cfg, agent_cfg)
+
+    assert [(sink.name, type(sink.driver)) for sink in sinks] == [("influxdb", agent.InfluxDBDriver)]
+    assert sinks[0].options["spool_dir"] == "/var/lib/nvml-agent/spool"
+    assert agent.new_sinks({"influxdb_host": ""}, agent_cfg) == []
+
+
+def test_each_sink_has_its_own_options_and_spool(agent, tmp_path):
+    cfg       = {"sinks": [
+        {"type": "influxdb2", "url": "http://localhost:8086", "org": "ml", "bucket": "gpu", "batch_size": 100},
+        {"type": "statsd", "queue_size": 5, "export_retries": 0, "delta_export": True},
+        {"type": "file", "name": "archive", "path": str(tmp_path / "metrics.ndjson"), "flush_interval": 60}
+    ]}
+    agent_cfg = dict(agent.AGENT_DEFAULTS, spool_dir="/var/lib/nvml-agent/spool")
+    sinks     = agent.new_sinks(cfg, agent_cfg)
+
+    assert [sink.name for sink in sinks] == ["influxdb2", "statsd", "archive"]
+    assert sinks[0].driver.batch_size == 100
+    assert sinks[1].options["queue_size"] == 5 and sinks[1].options["export_retries"] == 0
+    assert sinks[1].driver.delta is not None and sinks[0].driver.delta is None
+    assert sinks[2].driver.flush_interval == 60
+    assert sinks[2].options["spool_dir"] == "/var/lib/nvml-agent/spool/archive"
+    assert agent_cfg["queue_size"] == agent.AGENT_DEFAULTS["queue_size"]
+
+    with pytest.raises(ValueError):
+        agent.new_sinks({"sinks": [{"type": "statsd"}, {"type": "statsd"}]}, agent_cfg)
+    with pytest.raises(ValueError):
+        agent.new_sinks({"sinks": [{"type": "graphite"}]}, agent_cfg)
+
+
+def test_influxdb2_writes_line_protocol_with_its_token(agent, receiver):
+    server = receiver(204)
+    driver = agent.InfluxDB2Driver("http://127.0.0.1:%d" % server.server_address[1], org="ml", bucket="gpu",
+                                   token="s3cr3t", precision="u")
+    driver.write(snapshot(agent))
+    driver.close()
+
+    path, headers, body = server.requests[0]
+    assert path == "/api/v2/write?org=ml&bucket=gpu&precision=us"
+    assert headers["Authorization"] == "Token s3cr3t"
+    assert body.decode("utf-8").startswith("gpu/telemetry,gpu_index=0,")
+
+
+def test_otlp_gauges_carry_the_tags_as_attributes(agent, receiver):
+    server = receiver(200)
+    driver = agent.OTLPDriver("http://127.0.0.1:%d/v1/metrics" % server.server_address[1])
+    driver.write(snapshot(agent))
+
+    request = json.loads(server.requests[0][2])
+    metrics = request["resourceMetrics"][0]["scopeMetrics"][0]["metrics"]
+    assert [metric["name"] for metric in metrics] == ["gpu.telemetry.power_w", "gpu.telemetry.temperature_c"]
+    power, temperature = [metric["gauge"]["dataPoints"][0] for metric in metrics]
+    assert power["asDouble"] == 250.5 and temperature["asInt"] == "60"
+    assert {"key": "gpu_uuid", "value": {"stringValue": "GPU-0000"}} in power["attributes"]
+
+    server.status = 503
+    with pytest.raises(agent.ExportError):
+        driver.write(snapshot(agent))
+    driver.close()
+
+
+def test_statsd_gauges_are_packed_into_datagrams(agent):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(5)
+
+    driver = agent.StatsdDriver("127.0.0.1", sock.getsockname()[1], prefix="nvml")
+    driver.write(snapshot(agent))
+    driver.close()
+
+    gauges = sock.recv(65535).decode("utf-8").splitlines()
+    sock.close()
+    assert gauges[1].startswith("nvml.gpu.telemetry.temperature_c:60|g|#gpu_index:0,gpu_name:Tesla_V100,")
+    assert len(gauges) == 2
+
+    # a signed value would change the gauge instead of setting it
+    assert driver.serialize([("gpu/telemetry", {}, {"delta": -3})], 0) == ["nvml.gpu.telemetry.delta:0|g\n"
+                                                                           "nvml.gpu.telemetry.delta:-3|g"]
+
+
+def test_file_sink_rotates_its_ndjson(agent, tmp_path):
+    path   = str(tmp_path / "metrics.ndjson")
+    driver = agent.FileDriver(path, max_bytes=1, backups=2)
+    for temperature in range(4):
+        driver.write(snapshot(agent, temperature))
+
+    assert sorted(os.listdir(str(tmp_path))) == ["metrics.ndjson", "metrics.ndjson.1", "metrics.ndjson.2"]
+    with open(path) as ndjson:
+        point = json.loads(ndjson.readline())
+    assert point["fields"] == {"temperature_c": 3, "power_w": 250.5}
+    assert point["measurement"] == "gpu/telemetry"
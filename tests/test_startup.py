@@ -0,0 +1,67 @@
+import os
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def cache_dir(agent, tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, "CONF_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+def test_agent_loads_without_the_optional_backends(agent):
+    # a fresh interpreter: the session already imported them for the other tests
+    code = "\n".join([
+        "import importlib.util, sys",
+        "spec = importlib.util.spec_from_file_location('nvml_agent', %r)" % agent.__file__,
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))",
+        "print(' '.join(sorted(name for name in ('influxdb', 'requests', 'yaml', 'http.server', 'logging.config')",
+        "                      if name in sys.modules)))"
+    ])
+    env  = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+
+    assert subprocess.check_output([sys.executable, "-c", code], env=env).decode("utf-8").strip() == ""
+
+
+def test_unchanged_yaml_is_read_from_the_cache(agent, cache_dir, tmp_path, monkeypatch):
+    conf = tmp_path / "conf.yaml"
+    conf.write_text("influxdb_host: localhost\nsinks:\n  - type: statsd\n")
+    assert agent.load_yaml(str(conf)) == {"influxdb_host": "localhost", "sinks": [{"type": "statsd"}]}
+    assert len(os.listdir(str(cache_dir))) == 1
+    assert os.stat(str(cache_dir / os.listdir(str(cache_dir))[0])).st_mode & 0o077 == 0
+
+    # yaml cannot be imported anymore: the content comes from the cache
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    assert agent.load_yaml(str(conf)) == {"influxdb_host": "localhost", "sinks": [{"type": "statsd"}]}
+
+    # a modified file is parsed again
+    conf.write_text("influxdb_host: influxdb.example.com\n")
+    with pytest.raises(ImportError):
+        agent.load_yaml(str(conf))
+
+
+def test_cache_written_by_others_is_not_trusted(agent, cache_dir, tmp_path, monkeypatch):
+    conf = tmp_path / "conf.yaml"
+    conf.write_text("influxdb_host: localhost\n")
+    agent.load_yaml(str(conf))
+
+    cache = str(cache_dir / os.listdir(str(cache_dir))[0])
+    with open(cache) as cache_file:
+        content = cache_file.read().replace("localhost", "attacker.example.com")
+    with open(cache, "w") as cache_file:
+        cache_file.write(content)
+    assert agent.load_yaml(str(conf)) == {"influxdb_host": "attacker.example.com"}
+
+    os.chmod(cache, 0o666)
+    assert agent.load_yaml(str(conf)) == {"influxdb_host": "localhost"}
+
+
+def test_content_json_cannot_represent_is_not_cached(agent, cache_dir, tmp_path):
+    conf = tmp_path / "conf.yaml"
+    conf.write_text("1: one\nsince: 2024-01-01\n")
+
+    assert agent.load_yaml(str(conf))[1] == "one"
+    assert not cache_dir.exists() or os.listdir(str(cache_dir)) == []
@@ -0,0 +1,139 @@
+import pytest
+
+
+class FakeNVMLError(Exception):
+    def __init__(self, value=999):
+        Exception.__init__(self, value)
+        self.value = value
+
+
+class FakeValue(object):
+    def __init__(self, value):
+        self.ullVal = value
+        self.dVal   = float(value)
+
+
+class FakeFieldValue(object):
+    def __init__(self, field_id, nvml_return, value):
+        self.fieldId    = field_id
+        self.nvmlReturn = nvml_return
+        self.valueType  = 3 # NVML_VALUE_TYPE_UNSIGNED_LONG_LONG
+        self.value      = FakeValue(value)
+
+
+class FakeUtilization(object):
+    gpu    = 50
+    memory = 20
+
+
+class FakeNVML(object):
+    """NVML binding of a single GPU, recording the calls made to it"""
+    NVMLError                     = FakeNVMLError
+    NVML_ERROR_NOT_FOUND          = 6
+    NVML_TEMPERATURE_GPU          = 0
+    NVML_CLOCK_SM                 = 1
+    NVML_FI_DEV_MEMORY_TEMP       = 82
+    NVML_FI_DEV_POWER_INSTANT     = 186
+    NVML_FI_DEV_ECC_DBE_VOL_TOTAL = 4
+
+    def __init__(self, unsupported_fields=(), field_values=True):
+        self.calls              = []
+        self.unsupported_fields = set(unsupported_fields)
+        if not field_values:
+            self.nvmlDeviceGetFieldValues = self.no_field_values
+
+    def nvmlDeviceGetFieldValues(self, handle, field_ids):
+        self.calls.append(("fields", tuple(field_ids)))
+        return [FakeFieldValue(field_id, 3 if field_id in self.unsupported_fields else 0, field_id * 10)
+                for field_id in field_ids]
+
+    def no_field_values(self, handle, field_ids):
+        self.calls.append(("fields", tuple(field_ids)))
+        raise FakeNVMLError(13)
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        self.calls.append("utilization")
+        return FakeUtilization()
+
+    def nvmlDeviceGetTemperature(self, handle, sensor):
+        self.calls.append("temperature")
+        return 60
+
+    def nvmlDeviceGetPowerUsage(self, handle):
+        self.calls.append("power")
+        return 150000
+
+    def nvmlDeviceGetClockInfo(self, handle, clock):
+        self.calls.append("clock")
+        raise FakeNVMLError(3) # NVML_ERROR_NOT_SUPPORTED
+
+
+@pytest.fixture
+def device(agent):
+    return agent.GPUDevice(0, "handle-0", "Tesla V100", "GPU-0000")
+
+
+METRICS = ["sm_utilization_pct", "memory_utilization_pct", "temperature_c", "memory_temperature_c",
+           "power_usage_mw", "ecc_dbe_volatile"]
+
+
+def test_field_values_are_read_in_a_single_call(agent, device):
+    nvml      = FakeNVML()
+    collector = agent.TelemetryCollector(METRICS, process_utilization=False, nvml=nvml)
+
+    telemetry = collector.collect(device)
+
+    assert telemetry == {
+        "sm_utilization_pct"     : 50,
+        "memory_utilization_pct" : 20,
+        "temperature_c"          : 60,
+        "memory_temperature_c"   : 820,
+        "power_usage_mw"         : 1860,
+        "ecc_dbe_volatile"       : 40
+    }
+    # one batched field values call, one utilization call shared by two metrics
+    assert nvml.calls == [("fields", (82, 186, 4)), "utilization", "temperature"]
+
+
+def test_unsupported_field_falls_back_to_its_call(agent, device):
+    nvml      = FakeNVML(unsupported_fields=[186, 82])
+    collector = agent.TelemetryCollector(METRICS, process_utilization=False, nvml=nvml)
+
+    telemetry = collector.collect(device)
+    assert telemetry["power_usage_mw"] == 150000
+    assert "memory_temperature_c" not in telemetry
+
+    # the fallback and the unsupported metrics are remembered, not asked again
+    del nvml.calls[:]
+    collector.collect(device)
+    assert nvml.calls == [("fields", (4,)), "utilization", "temperature", "power"]
+
+
+def test_field_values_error_falls_back_to_single_calls(agent, device):
+    nvml      = FakeNVML(field_values=False)
+    collector = agent.TelemetryCollector(METRICS, process_utilization=False, nvml=nvml)
+
+    telemetry = collector.collect(device)
+    assert telemetry["power_usage_mw"] == 150000
+    assert "ecc_dbe_volatile" not in telemetry
+
+    del nvml.calls[:]
+    collector.collect(device)
+    assert nvml.calls == ["utilization", "temperature", "power"]
+
+
+def test_unsupported_metrics_are_cached(agent, device):
+    nvml      = FakeNVML()
+    collector = agent.TelemetryCollector(["sm_clock_mhz", "temperature_c"], process_utilization=False, nvml=nvml)
+
+    assert collector.collect(device) == {"temperature_c": 60}
+    assert ("GPU-0000", "sm_clock_mhz") in collector.unsupported
+
+    del nvml.calls[:]
+    collector.collect(device)
+    assert nvml.calls == ["temperature"]
+
+
+def test_unknown_metric_is_rejected(agent):
+    with pytest.raises(ValueError):
+        agent.TelemetryCollector(["not_a_metric"], nvml=FakeNVML())
@@ -0,0 +1,247 @@
+import threading
+
+import pytest
+
+from conftest import FakeNVML
+
+
+class FakeProcess(object):
+    """psutil.Process of a table of pid -> creation time, counting the inspections"""
+    create_times = {}
+    inspected    = []
+    denied       = set()
+
+    def __init__(self, pid):
+        if pid not in self.create_times:
+            raise FakeProcess.NoSuchProcess(pid)
+        if pid in self.denied:
+            raise FakeProcess.Error("access denied")
+        self.pid = pid
+
+    def create_time(self):
+        return self.create_times[self.pid]
+
+    def username(self):
+        FakeProcess.inspected.append(self.pid)
+        return "root"
+
+    def cmdline(self):
+        return ["/usr/bin/python3", "train.py"]
+
+
+class RecordingPodIndex(object):
+    def __init__(self, pods):
+        self.pods     = pods
+        self.resolved = []
+        self.live     = None
+
+    def resolve(self, pid):
+        self.resolved.append(pid)
+        return self.pods.get(pid)
+
+    def prune(self, live_pids):
+        self.live = set(live_pids)
+
+
+@pytest.fixture
+def processes(agent, monkeypatch):
+    FakeProcess.NoSuchProcess = agent.psutil.NoSuchProcess
+    FakeProcess.Error         = agent.psutil.Error
+    FakeProcess.create_times  = {101: 1000.0, 102: 1000.5}
+    FakeProcess.inspected     = []
+    FakeProcess.denied        = set()
+    monkeypatch.setattr(agent.psutil, "Process", FakeProcess)
+    return FakeProcess
+
+
+@pytest.fixture
+def pod(agent):
+    return agent.PodInfo("uid-1", "trainer", "train-0", "ml", "c1")
+
+
+def test_known_processes_are_not_inspected_again(agent, processes, pod):
+    pod_index = RecordingPodIndex({101: pod, 102: pod})
+    tracker   = agent.ProcessTracker(pod_index)
+
+    first  = tracker.update([101, 102])
+    second = tracker.update([101, 102])
+
+    assert second == first
+    assert processes.inspected == [101, 102]
+    assert pod_index.resolved == [101, 102]
+    assert second[101].command == "python3"
+
+
+def test_reused_pid_is_a_new_process(agent, processes, pod):
+    pod_index = RecordingPodIndex({101: pod})
+    tracker   = agent.ProcessTracker(pod_index)
+
+    tracker.update([101])
+    processes.create_times[101] = 2000.0
+    assert tracker.update([101])[101].create_time == 2000.0
+    assert processes.inspected == [101, 101]
+
+
+def test_processes_gone_from_the_gpus_are_retired(agent, processes, pod):
+    pod_index = RecordingPodIndex({101: pod, 102: pod})
+    tracker   = agent.ProcessTracker(pod_index)
+
+    tracker.update([101, 102])
+    del processes.create_times[102]
+    resolved = tracker.update([101, 102])
+
+    assert resolved[102] is None
+    assert set(tracker.processes) == set([101])
+    assert pod_index.live == set([101])
+
+
+def test_pod_known_by_its_uid_only_is_resolved_again(agent, processes, pod):
+    pod_index = RecordingPodIndex({101: agent.PodInfo("uid-1", "", "uid-1", "", "c1")})
+    tracker   = agent.ProcessTracker(pod_index, retry_delay=0)
+
+    tracker.update([101])
+    pod_index.pods[101] = pod
+    assert tracker.update([101])[101].pod == pod
+    assert pod_index.resolved == [101, 101]
+    assert processes.inspected == [101]
+
+
+def test_pod_known_by_its_uid_only_is_resolved_on_a_backoff(agent, processes, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(agent, "monotonic", lambda: clock[0])
+    pod_index = RecordingPodIndex({101: agent.PodInfo("uid-1", "", "uid-1", "", "c1")})
+    tracker   = agent.ProcessTracker(pod_index, retry_delay=1, max_retry_delay=4)
+
+    resolutions = []
+    for _ in range(12):
+        tracker.update([101])
+        resolutions.append(len(pod_index.resolved))
+        clock[0] += 1
+
+    # resolved again after 1, 2, 4 then 4 seconds
+    assert resolutions == [1, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4, 5]
+    assert tracker.processes[101].retry_delay == 4
+
+
+def test_process_outside_kubernetes_is_not_resolved_again(agent, processes):
+    pod_index = RecordingPodIndex({})
+    tracker   = agent.ProcessTracker(pod_index)
+
+    tracker.update([101])
+    assert tracker.update([101])[101].pod is None
+    assert pod_index.resolved == [101]
+
+
+def test_transient_error_keeps_a_known_process(agent, processes, pod):
+    pod_index = RecordingPodIndex({101: pod, 102: pod})
+    tracker   = agent.ProcessTracker(pod_index)
+
+    first = tracker.update([101])
+    processes.denied.update([101, 102])
+    resolved = tracker.update([101, 102])
+
+    # the tracked process keeps its identity, a new one cannot be inspected
+    assert resolved[101] == first[101]
+    assert resolved[102] is None
+    assert set(tracker.processes) == set([101])
+
+
+class EventData(object):
+    def __init__(self, device, event_type, event_data):
+        self.device    = device
+        self.eventType = event_type
+        self.eventData = event_data
+
+
+class EventNVML(FakeNVML):
+    """NVML binding of one GPU raising one Xid event between timeouts"""
+    count                          = 1
+    NVML_ERROR_TIMEOUT             = 10
+    nvmlEventTypeXidCriticalError  = 8
+    nvmlEventTypeDoubleBitEccError = 2
+
+    def __init__(self):
+        FakeNVML.__init__(self)
+        self.pending    = [EventData(0, 8, 79)]
+        self.registered = []
+        self.freed      = False
+
+    def nvmlEventSetCreate(self):
+        return "set"
+
+    def nvmlDeviceGetSupportedEventTypes(self, handle):
+        return 8
+
+    def nvmlDeviceRegisterEvents(self, handle, mask, event_set):
+        self.registered.append((handle, mask))
+
+    def nvmlEventSetWait(self, event_set, timeout_ms):
+        if self.pending:
+            return self.pending.pop(0)
+        raise self.NVMLError(self.NVML_ERROR_TIMEOUT)
+
+    def nvmlEventSetFree(self, event_set):
+        self.freed = True
+
+
+@pytest.fixture
+def nvml_class():
+    return EventNVML
+
+
+def test_events_are_queued_as_they_happen(agent, nvml, session):
+    queue   = agent.SnapshotQueue(10)
+    watcher = agent.NVMLEventWatcher(session, ["xid", "double_bit_ecc"], queue, timeout=0.01)
+
+    watcher.start()
+    snapshot = queue.get()
+    watcher.stop()
+
+    # only the supported event types are registered
+    assert nvml.registered == [(0, 8)]
+    assert nvml.freed
+    assert snapshot.points == [("gpu/event", {"nodename": snapshot.hostname, "gpu_uuid": "GPU-0000", "event": "xid"},
+                                {"event_data": 79})]
+    assert agent.InfluxDBDriver.points(snapshot) == snapshot.points
+
+
+def test_unknown_events_are_rejected(agent, session):
+    with pytest.raises(ValueError):
+        agent.NVMLEventWatcher(session, ["xid", "fan"])
+
+
+class StuckEventNVML(EventNVML):
+    """NVML binding whose event wait outlasts its timeout until released"""
+
+    def __init__(self):
+        EventNVML.__init__(self)
+        self.pending  = []
+        self.waiting  = threading.Event()
+        self.released = threading.Event()
+
+    def nvmlEventSetWait(self, event_set, timeout_ms):
+        self.waiting.set()
+        self.released.wait(5)
+        raise self.NVMLError(self.NVML_ERROR_TIMEOUT)
+
+
+class ClosedRuntimeClient(object):
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("nvml_class", [StuckEventNVML])
+def test_nvml_is_not_shut_down_under_a_running_event_watcher(agent, nvml, session):
+    daemon = agent.AgentDaemon.__new__(agent.AgentDaemon)
+    daemon.__dict__.update(pool=None, session=session, prometheus=None, store=None, profiler=None, exports=None,
+                           pod_index=agent.PodIndex(ClosedRuntimeClient()),
+                           events=agent.NVMLEventWatcher(session, ["xid"], None, timeout=0.01))
+    daemon.events.start()
+    assert nvml.waiting.wait(5)
+
+    daemon.shutdown()
+    assert nvml.initialized and session.initialized
+
+    nvml.released.set()
+    daemon.events.join(5)
+    assert nvml.freed